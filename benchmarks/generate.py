@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+"""Generates big logs shaped like the fixtures of test/: blocks starting with
+the path of a Drupal site, made of the output of drush, some of them containing
+errors, optionally wrapped in groups. The same parameters always give the same
+log.
+
+usage: generate.py [-h] [--size SIZE] [--block-length BLOCK_LENGTH]
+                   [--error-density ERROR_DENSITY] [--group-length GROUP_LENGTH]
+                   [--line-length LINE_LENGTH] [--seed SEED]
+                   output
+"""
+
+import argparse
+import datetime
+import random
+
+#: The start pattern matching the first line of the blocks.
+START_PATTERN = r'/home/assos/drupal7/sites/assos.centrale-marseille.fr.\w+'
+#: The error pattern used by the benchmarks.
+ERROR_PATTERN = '(error|warning)'
+#: The group patterns matching the lines written around the groups.
+START_GROUP_PATTERN = '#### (?P<command>.+) - (?P<date>[0-9]{4}-[0-9]{2}-[0-9]{2})'
+END_GROUP_PATTERN = '#### END'
+
+_start_template = '/home/assos/drupal7/sites/assos.centrale-marseille.fr.{}\n'
+_success_line = 'Cron run successful.{}\x1b[1;32;40m\x1b[1m[success]\x1b[0m\n'
+_error_line = '{}\x1b[31;40m\x1b[1m[error]\x1b[0m\n'
+_start_group_template = '#### Drush cron - {}\n'
+_end_group_line = '#### END\n'
+_sites = ['accueil', 'agora', 'bde', 'bda', 'cine', 'forum', 'jazz', 'ski',
+          'theatre', 'voile']
+_words = ['Drush', 'database', 'bootstrap', 'site', 'module', 'cache', 'cron',
+          'configuration', 'the', 'to', 'of', 'could', 'not', 'be', 'executed',
+          'socket', 'version', 'theme', 'PHP', 'URI']
+_error_messages = ["The drush command 'cron' could not be executed.",
+                   'Drush was not able to start (bootstrap) the Drupal database.',
+                   'Command core-cron needs a higher bootstrap level to run.']
+
+
+class LogGenerator:
+    """Writes a log made of blocks of *block_length* lines.
+
+    A block contains an error with the probability *error_density*. If
+    *group_length* is given, the blocks are wrapped in groups of this number of
+    blocks. The lines are about *line_length* characters long.
+    """
+
+    def __init__(self, block_length=20, error_density=0.05, group_length=None,
+                 line_length=70, seed=0):
+        self._block_length = max(block_length, 2)
+        self._error_density = error_density
+        self._group_length = group_length
+        self._line_length = line_length
+        self._random = random.Random(seed)
+        self._date = datetime.date(2014, 9, 14)
+
+    def write(self, output, size):
+        """Write blocks to the file output until at least size characters are
+        written. Returns the number of lines written.
+        """
+        written = 0
+        lines = 0
+        block_number = 0
+        while written < size:
+            block = []
+            if self._group_length and block_number % self._group_length == 0:
+                block.append(_start_group_template.format(self._date))
+                self._date += datetime.timedelta(days=1)
+            block.extend(self._block())
+            block_number += 1
+            if self._group_length and block_number % self._group_length == 0:
+                block.append(_end_group_line)
+            output.writelines(block)
+            written += sum(len(line) for line in block)
+            lines += len(block)
+        if self._group_length and block_number % self._group_length:
+            output.write(_end_group_line)
+            lines += 1
+        return lines
+
+    def _block(self):
+        """Returns the lines of a block."""
+        site = self._random.choice(_sites) + str(self._random.randrange(100))
+        lines = [_start_template.format(site)]
+        error_position = None
+        if self._random.random() < self._error_density:
+            error_position = self._random.randrange(1, self._block_length)
+        for position in range(1, self._block_length):
+            if position == error_position:
+                message = self._random.choice(_error_messages)
+                lines.append(_error_line.format(self._pad(message)))
+            elif position == 1:
+                lines.append(_success_line.format(self._pad('')[20:]))
+            else:
+                lines.append(self._text_line())
+        return lines
+
+    def _text_line(self):
+        """Returns a line of words without error."""
+        words = []
+        length = 0
+        while length < self._line_length:
+            word = self._random.choice(_words)
+            words.append(word)
+            length += len(word) + 1
+        return ' '.join(words)[:self._line_length] + '\n'
+
+    def _pad(self, text):
+        """Pads text with spaces like drush aligns its status."""
+        return text.ljust(self._line_length - 1)
+
+
+def add_arguments(parser):
+    """Add the options describing the log to the argparse parser."""
+    parser.add_argument('--size', type=int, default=100 * 1024 * 1024,
+                        help='The approximate size of the log in bytes. '
+                        'Default is 100 MiB.')
+    parser.add_argument('--block-length', type=int, default=20,
+                        help='The number of lines of a block. Default is 20.')
+    parser.add_argument('--error-density', type=float, default=0.05,
+                        help='The proportion of blocks containing an error. '
+                        'Default is 0.05.')
+    parser.add_argument('--group-length', type=int,
+                        help='Wrap this number of blocks in a group. By '
+                        'default, no group is written.')
+    parser.add_argument('--line-length', type=int, default=70,
+                        help='The approximate length of the lines. Default is '
+                        '70.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='The seed of the random generator. Default is 0.')
+
+
+def generate(file_name, args):
+    """Write the log described by the options of :py:func:`add_arguments` in
+    file_name. Returns the number of lines written.
+    """
+    generator = LogGenerator(args.block_length, args.error_density,
+                             args.group_length, args.line_length, args.seed)
+    with open(file_name, 'w', encoding='utf-8') as output:
+        return generator.write(output, args.size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a log shaped like '
+                                     'the fixtures of the tests.')
+    parser.add_argument('output', help='The file to write.')
+    add_arguments(parser)
+    args = parser.parse_args()
+    generate(args.output, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+
+"""Runs the benchmarks of unlog on a log made by generate.py and reports the
+number of lines and megabytes processed per second and the peak memory of each
+of them.
+
+Each benchmark runs in its own process so its peak memory doesn't depend on
+the other ones. The results can be saved in a JSON file with --output and
+compared to the results of another commit with --compare: the command exits
+with 1 if a benchmark is slower than the threshold.
+
+usage: run.py [-h] [--unlog-dir UNLOG_DIR] [--log LOG] [--repeat REPEAT]
+              [--output OUTPUT] [--compare COMPARE] [--threshold THRESHOLD]
+              [--size SIZE] [--block-length BLOCK_LENGTH]
+              [--error-density ERROR_DENSITY] [--group-length GROUP_LENGTH]
+              [--line-length LINE_LENGTH] [--seed SEED]
+              [benchmark [benchmark ...]]
+
+To compare a commit with the current tree, run the benchmarks of the current
+tree on the code of the commit checked out in another directory:
+
+    git worktree add /tmp/unlog-old <commit>
+    python3 benchmarks/run.py --unlog-dir /tmp/unlog-old/unlog -o old.json
+    python3 benchmarks/run.py --compare old.json
+
+The benchmarks use the older API of the code when it lacks the current one, or
+are skipped if it lacks what they measure.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate
+
+#: The directory containing the code of unlog benchmarked by default.
+UNLOG_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'unlog')
+#: The number of sections of the configuration file used by the config
+#: benchmark.
+CONFIG_SECTIONS = 500
+#: The number of file names resolved by the config benchmark.
+CONFIG_FILES = 20000
+#: The number of lines of the report built by the mail benchmark.
+MAIL_REPORT_LINES = 200000
+
+
+class Unavailable(Exception):
+    """Raised by a benchmark when the code benchmarked lacks what it
+    measures.
+    """
+
+
+_filter_options = {'start_pattern': generate.START_PATTERN,
+                   'error_pattern': generate.ERROR_PATTERN,
+                   'start_group_pattern': generate.START_GROUP_PATTERN,
+                   'end_group_pattern': generate.END_GROUP_PATTERN}
+
+
+def bench_filter(log):
+    """Filter.process_file on the lines of the log opened in text mode."""
+    from filter import Filter
+
+    with open(log, 'r', encoding='utf-8') as log_file:
+        Filter(**_filter_options).process_file(log_file)
+    return _count_lines(log), os.path.getsize(log)
+
+
+def bench_scanner(log):
+    """Scanner.process_file, used for the files given on the command line,
+    or Filter.process_file on the code that reads them line by line.
+    """
+    from filter import Filter
+    try:
+        from scanner import Scanner
+    except ImportError:
+        return bench_filter(log)
+
+    with open(log, 'rb') as log_file:
+        Scanner(Filter(**_filter_options)).process_file(log_file)
+    return _count_lines(log), os.path.getsize(log)
+
+
+def bench_stdin(log):
+    """unlog reading the log on its stdin, in a process of its own."""
+    command = [sys.executable, os.path.join(_unlog_dir, 'main.py'),
+               '--start-pattern', _filter_options['start_pattern'],
+               '--error-pattern', _filter_options['error_pattern'],
+               '--start-group', _filter_options['start_group_pattern'],
+               '--end-group', _filter_options['end_group_pattern']]
+    with open(log, 'rb') as log_file:
+        subprocess.run(command, stdin=log_file, stdout=subprocess.DEVNULL,
+                       check=True)
+    return _count_lines(log), os.path.getsize(log)
+
+
+def bench_config(log):
+    """Config.get_filters, or Config.get_filter on older code, resolving
+    file names against many glob sections.
+    """
+    import config as config_module
+    from config import Config
+
+    if not hasattr(config_module, 'SectionMatcher'):
+        # Globbing each section on the disk for each file would take hours.
+        raise Unavailable('the sections are globbed on the disk')
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_file = os.path.join(directory, 'unlog.conf')
+        with open(config_file, 'w', encoding='utf-8') as config:
+            config.write('[DEFAULT]\nstart pattern = {}\n'
+                         .format(generate.START_PATTERN.replace('%', '%%')))
+            for i in range(CONFIG_SECTIONS):
+                if i % 2:
+                    config.write('[/var/log/site{}/cron.log]\n'.format(i))
+                else:
+                    config.write('[/var/log/**/site{}/*.log]\n'.format(i))
+        args = argparse.Namespace(config_file=config_file,
+                                  use_config_section=None)
+        config = Config(args)
+        get_filters = getattr(config, 'get_filters', None) or config.get_filter
+        for i in range(CONFIG_FILES):
+            site = i % CONFIG_SECTIONS
+            if site % 2:
+                file_name = '/var/log/site{}/cron.log'.format(site)
+            else:
+                file_name = '/var/log/www/site{}/access.log'.format(site)
+            get_filters(file_name)
+    return CONFIG_FILES, 0
+
+
+def bench_mail(log):
+    """prepare_message on a report made of the lines of the log."""
+    try:
+        from mail import prepare_message
+        from report import MailReport
+    except ImportError:
+        raise Unavailable('no mail and report modules')
+
+    report = MailReport()
+    with open(log, 'r', encoding='utf-8') as log_file:
+        for line, _ in zip(log_file, range(MAIL_REPORT_LINES)):
+            report.append(line)
+    msg = prepare_message(report, 'Unlog report', 'unlog@localhost',
+                          'admin@localhost')
+    msg.as_bytes()
+    return report.line_count, report.size
+
+
+#: The benchmarks by name, in the order they are run.
+BENCHMARKS = {'filter': bench_filter,
+              'scanner': bench_scanner,
+              'stdin': bench_stdin,
+              'config': bench_config,
+              'mail': bench_mail}
+_unlog_dir = UNLOG_DIR
+_line_counts = {}
+
+
+def _count_lines(log):
+    if log not in _line_counts:
+        with open(log, 'rb') as log_file:
+            _line_counts[log] = sum(block.count(b'\n') for block in
+                                    iter(lambda: log_file.read(1 << 20), b''))
+    return _line_counts[log]
+
+
+def run_benchmark(name, log):
+    """Run the benchmark name on log in this process and returns its result,
+    or the reason why it was skipped. The output of unlog is discarded.
+    """
+    _count_lines(log)
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            start = time.perf_counter()
+            lines, size = BENCHMARKS[name](log)
+            seconds = time.perf_counter() - start
+        except Unavailable as e:
+            return {'skipped': str(e)}
+        finally:
+            sys.stdout = stdout
+    peak_memory = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return {'seconds': seconds,
+            'lines': lines,
+            'bytes': size,
+            'lines_per_second': lines / seconds,
+            'mb_per_second': size / seconds / 1024 / 1024,
+            # In KiB.
+            'peak_memory': peak_memory}
+
+
+def run_in_subprocess(name, log, unlog_dir):
+    """Run the benchmark name in a new process and returns its result."""
+    command = [sys.executable, os.path.abspath(__file__), '--unlog-dir',
+               unlog_dir, '--child', name, '--log', log]
+    process = subprocess.run(command, stdout=subprocess.PIPE, check=True,
+                             universal_newlines=True)
+    return json.loads(process.stdout)
+
+
+def run_benchmarks(names, log, repeat, unlog_dir):
+    """Run each benchmark repeat times and keep the fastest run. The skipped
+    benchmarks are left out of the results.
+    """
+    results = {}
+    for name in names:
+        result = run_in_subprocess(name, log, unlog_dir)
+        if 'skipped' in result:
+            print('{:<8} skipped: {}'.format(name, result['skipped']))
+            continue
+        runs = [result] + [run_in_subprocess(name, log, unlog_dir)
+                           for _ in range(repeat - 1)]
+        results[name] = min(runs, key=lambda result: result['seconds'])
+        print_result(name, results[name])
+    return results
+
+
+def print_result(name, result, reference=None):
+    mb_per_second = '{:10.1f}'.format(result['mb_per_second']) \
+                    if result['bytes'] else '{:>10}'.format('-')
+    line = '{:<8} {:8.3f} s {:12.0f} lines/s {} MB/s {:8.1f} MiB'.format(
+        name, result['seconds'], result['lines_per_second'], mb_per_second,
+        result['peak_memory'] / 1024)
+    if reference is not None:
+        line += ' {:+7.1%} time {:+7.1%} memory'.format(
+            _change(result, reference, 'seconds'),
+            _change(result, reference, 'peak_memory'))
+    print(line)
+
+
+def _change(result, reference, key):
+    return result[key] / reference[key] - 1
+
+
+def compare(results, reference_file, threshold):
+    """Print the change of each benchmark compared to the results saved in
+    reference_file. Returns True if no benchmark is slower than threshold.
+    """
+    with open(reference_file, 'r', encoding='utf-8') as reference:
+        reference = json.load(reference)
+    print('\nCompared to {}:'.format(reference.get('commit') or
+                                     reference_file))
+    if reference['log'] != results['log']:
+        print('Warning: the logs differ, the results may not be comparable.')
+    ok = True
+    for name, result in results['benchmarks'].items():
+        reference_result = reference['benchmarks'].get(name)
+        if reference_result is None:
+            print('{:<8} not in the reference'.format(name))
+            continue
+        print_result(name, result, reference_result)
+        if _change(result, reference_result, 'seconds') > threshold:
+            ok = False
+    return ok
+
+
+def _get_commit(unlog_dir):
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=unlog_dir, universal_newlines=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the benchmarks of '
+                                     'unlog.')
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help='The benchmarks to run among {}. Default: all.'
+                        .format(', '.join(BENCHMARKS)))
+    parser.add_argument('--unlog-dir', default=UNLOG_DIR,
+                        help='The directory containing the code of unlog to '
+                        'benchmark. Default: the unlog directory of this '
+                        'tree.')
+    parser.add_argument('--log', help='Use this log made by generate.py '
+                        'instead of generating one.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Run each benchmark this number of times and keep '
+                        'the fastest. Default: 3.')
+    parser.add_argument('-o', '--output', help='Save the results in this JSON '
+                        'file.')
+    parser.add_argument('--compare', help='Compare the results with the ones '
+                        'saved in this JSON file.')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='With --compare, exit with 1 if a benchmark is '
+                        'slower than this ratio. Default: 0.1.')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    generate.add_arguments(parser)
+    parser.set_defaults(size=32 * 1024 * 1024, group_length=50)
+    args = parser.parse_args()
+
+    global _unlog_dir
+    _unlog_dir = os.path.abspath(args.unlog_dir)
+    sys.path.insert(0, _unlog_dir)
+    if args.child:
+        print(json.dumps(run_benchmark(args.child, args.log)))
+        return
+
+    names = args.benchmarks or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark {}'.format(name))
+    with tempfile.TemporaryDirectory() as directory:
+        log = args.log
+        if log is None:
+            log = os.path.join(directory, 'benchmark.log')
+            generate.generate(log, args)
+        results = {'commit': _get_commit(_unlog_dir),
+                   'python': platform.python_version(),
+                   'log': {'size': os.path.getsize(log),
+                           'lines': _count_lines(log)},
+                   'benchmarks': run_benchmarks(names, log, args.repeat,
+                                                _unlog_dir)}
+    if args.log is None:
+        results['log'].update(block_length=args.block_length,
+                              error_density=args.error_density,
+                              group_length=args.group_length,
+                              line_length=args.line_length, seed=args.seed)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=2)
+    if args.compare and not compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
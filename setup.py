@@ -18,7 +18,8 @@ setup(
     name = "unlog",
     version = "1.0.0",
     packages = ['unlog'],
-    requires=['sh', 'glob2'],
+    requires=['sh'],
+    python_requires='>=3.7',
     tests_require=['pytest'],
     cmdclass = {'test': PyTest},
     author = "Julien Enselme",
@@ -32,9 +33,12 @@ Intended Audience :: Developers
 License :: OSI Approved :: MIT License
 Operating System :: OS Independent
 Programming Language :: Python :: 3
-Programming Language :: Python :: 3.2
-Programming Language :: Python :: 3.3
-Programming Language :: Python :: 3.4
+Programming Language :: Python :: 3.7
+Programming Language :: Python :: 3.8
+Programming Language :: Python :: 3.9
+Programming Language :: Python :: 3.10
+Programming Language :: Python :: 3.11
+Programming Language :: Python :: 3.12
 Topic :: System :: Logging""".split('\n'),
     long_description="""Python script to ease the unloging of file when we need
     to get line in the file from a starting line to an end line.
@@ -1,5 +1,27 @@
 from sh import python3, cat
 from io import StringIO
+import bz2
+import email
+import gzip
+import lzma
+import os
+import pty
+import random
+import re
+import select
+import socketserver
+import subprocess
+import sys
+import threading
+import tempfile
+import time
+
+from unlog.api import iter_blocks_from_file
+from unlog.config import SectionMatcher, translate
+from unlog.mail import prepare_message
+from unlog.prefilter import WindowSearch, fold_case, prefiltered_search
+from unlog.report import MailReport
+from unlog.scanner import is_line_local
 
 
 path2main = 'unlog/main.py'
@@ -32,6 +54,21 @@ def test_basic_filter_pipe():
         assert correctly_filtered_output.read() == output.getvalue()
 
 
+def test_filter_pipe_crlf():
+    "Lines ended by \\r\\n are read like in a file opened in text mode."
+    with open(program_output, 'r') as program_output_file:
+        crlf_output = program_output_file.read().replace('\n', '\r\n')
+
+    output = StringIO()
+    python3(path2main,
+            start_pattern=start_pattern,
+            error_pattern=error_pattern,
+            _in=crlf_output, _out=output)
+
+    with open(program_output_filtered, 'r') as correctly_filtered_output:
+        assert correctly_filtered_output.read() == output.getvalue()
+
+
 def test_filter_pipe_config():
     output = StringIO()
     python3(cat(program_output), path2main, config=config_file,
@@ -50,6 +87,16 @@ def test_basic_filter_config():
         assert correctly_filtered_output.read() == output.getvalue()
 
 
+def test_config_same_section_twice():
+    "Each file processed with the same section gets its own filter."
+    output = StringIO()
+    python3(path2main, 'test/program_output_config',
+            'test/program_output_config', config=config_file, _out=output)
+
+    with open(program_output_filtered, 'r') as correctly_filtered_output:
+        assert correctly_filtered_output.read() * 2 == output.getvalue()
+
+
 def test_use_config_section():
     output = StringIO()
     python3(path2main, program_output, u='TEST',
@@ -59,6 +106,46 @@ def test_use_config_section():
         assert correctly_filtered_output.read() == output.getvalue()
 
 
+def test_translate():
+    "The section globs match the paths like glob2 would."
+    cases = [('/a/**/*.log', '/a/f.log', True),
+             ('/a/**/*.log', '/a/b/c/f.log', True),
+             ('/a/**/*.log', '/a/.h/b/f.log', True),
+             ('/a/**/*.log', '/a/b/f.txt', False),
+             ('/a/**', '/a/c/.f.log', True),
+             ('/a/**', '/a/f', True),
+             ('/a/**', '/b/f', False),
+             ('/a/*.log', '/a/f.log', True),
+             ('/a/*.log', '/a/.f.log', False),
+             ('/a/*.log', '/a/b/f.log', False),
+             ('/a/?', '/a/f', True),
+             ('/a/?', '/a/.', False),
+             ('/a/[!]x]', '/a/f', True),
+             ('/a/[!]x]', '/a/]', False),
+             ('/a/[!]x]', '/a/x', False),
+             ('/a/[]x]', '/a/]', True),
+             ('/a/[x', '/a/[x', True)]
+    for pattern, path, matches in cases:
+        assert bool(re.match(translate(pattern), path)) == matches, \
+            (pattern, path)
+
+
+def test_section_matcher():
+    "The first section matching a file is used, a glob or the file name."
+    home = os.path.expanduser('~')
+    matcher = SectionMatcher(['~/**/*.log', '/var/log/exact.log',
+                              '/var/log/*.log', 'logs/*.txt', '/var/log/**'])
+    assert matcher.match(home + '/.drush/cron.log') == '~/**/*.log'
+    assert matcher.match('/var/log/exact.log') == '/var/log/exact.log'
+    assert matcher.match('/var/log/other.log') == '/var/log/*.log'
+    assert matcher.match('/var/log/a/f.gz') == '/var/log/**'
+    assert matcher.match(os.getcwd() + '/logs/f.txt') == 'logs/*.txt'
+    assert matcher.match('/tmp/f.txt') is None
+
+    matcher = SectionMatcher(['/var/log/*.log', '/var/log/exact.log'])
+    assert matcher.match('/var/log/exact.log') == '/var/log/*.log'
+
+
 def test_mail():
     output = StringIO()
     python3(path2main, 'test/program_output_mail', config=config_file, _err=output)
@@ -66,6 +153,239 @@ def test_mail():
     with open('test/program_output_filtered_mail', 'r') as correctly_filtered_output:
         assert correctly_filtered_output.read() == output.getvalue()
 
+def test_mail_max_size():
+    "A report bigger than the limit is truncated and attached compressed."
+    output = StringIO()
+    python3(path2main, 'test/program_output_mail', config=config_file,
+            mail_max_size=200, _err=output)
+
+    message = email.message_from_string(
+        output.getvalue().split('DEBUG: Message content:\n\n', 1)[1])
+    body, attachment = message.get_payload()
+    with open('test/program_output_filtered_mail', 'r') as correctly_filtered_output:
+        report = correctly_filtered_output.read().split('\n\n', 2)[2]
+    assert 'The report is truncated' in body.get_payload()
+    assert len(body.get_payload()) < len(report)
+    assert attachment.get_filename() == 'unlog-report.txt.gz'
+    assert gzip.decompress(attachment.get_payload(decode=True)).decode() \
+        == report
+
+
+def test_mail_max_size_spooled():
+    "A report spooled to disk can be truncated and attached whole."
+    report = MailReport(memory_limit=100)
+    with open(program_output, 'r') as log:
+        report.extend(log)
+    message = prepare_message(report, 'Unlog report', 'unlog@localhost',
+                              'jenselme@ec-m.fr', 200)
+
+    body, attachment = message.get_payload()
+    with open(program_output, 'r') as program_output_file:
+        report = program_output_file.read()
+    assert 'The report is truncated' in body.get_payload()
+    assert report.startswith(body.get_payload().split('\n[...', 1)[0])
+    assert gzip.decompress(attachment.get_payload(decode=True)).decode() \
+        == report
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    "Accepts all the messages sent with SMTP and records them."
+    allow_reuse_address = True
+
+    def __init__(self, port=0):
+        super().__init__(('localhost', port), SMTPStandInHandler)
+        self.connections = 0
+        self.messages = []
+
+    @property
+    def address(self):
+        return 'localhost:{}'.format(self.server_address[1])
+
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.connections += 1
+        self.wfile.write(b'220 localhost\r\n')
+        for line in iter(self.rfile.readline, b''):
+            command = line[:4].upper()
+            if command == b'DATA':
+                self.wfile.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                data = []
+                for data_line in iter(self.rfile.readline, b'.\r\n'):
+                    data.append(data_line)
+                self.server.messages.append(b''.join(data).decode())
+            elif command == b'QUIT':
+                self.wfile.write(b'221 Bye\r\n')
+                return
+            self.wfile.write(b'250 OK\r\n')
+
+
+def test_mail_digest():
+    "All the reports are sent in one email over a single connection."
+    server = SMTPStandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        python3(path2main, 'test/program_output_mail', 'test/program_output_mail',
+                config=config_file, digest=True, mail_server=server.address)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert server.connections == 1
+    assert len(server.messages) == 1
+    message = server.messages[0]
+    assert message.count('FILE: ') == 2
+    with open('test/program_output_filtered_mail', 'r') as correctly_filtered_output:
+        report = correctly_filtered_output.read().split('\n\n', 2)[2]
+    assert message.replace('\r\n', '\n').count(report.rstrip('\n')) == 2
+
+
+def test_error_classes():
+    "Each block is tagged with the most severe error class of its lines."
+    for scan in ([], ['--no-scan']):
+        output = StringIO()
+        python3(path2main, program_output, *scan,
+                '--error-class', 'timeout', 'timed out',
+                '--error-class', 'error', '(error|warning)',
+                start_pattern=start_pattern, _out=output)
+
+        lines = output.getvalue().splitlines(True)
+        assert [line for line in lines if line.startswith('CLASS: ')] == \
+            ['CLASS: error\n', 'CLASS: timeout\n']
+        with open(program_output_filtered, 'r') as correctly_filtered_output:
+            assert correctly_filtered_output.read() == ''.join(
+                line for line in lines if not line.startswith('CLASS: '))
+
+
+def test_error_classes_stream():
+    "A block is tagged with its most severe class even in stream mode."
+    output = StringIO()
+    python3(path2main, '--stream',
+            '--error-class', 'critical', 'critical',
+            '--error-class', 'warning', 'warning',
+            start_pattern='^start',
+            _in='start a\nwarning one\ncritical two\n', _out=output)
+
+    assert output.getvalue() == \
+        'CLASS: critical\nstart a\nwarning one\ncritical two\n'
+
+
+def test_error_classes_mail():
+    "The blocks of an error class with an address are sent to it."
+    server = SMTPStandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    output = StringIO()
+    try:
+        python3(path2main, program_output, config=config_file,
+                use_config_section='CLASSES', mail_server=server.address,
+                _out=output)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert output.getvalue().startswith('CLASS: error\n')
+    assert 'timed out' not in output.getvalue()
+    assert len(server.messages) == 1
+    message = server.messages[0]
+    assert 'Subject: Unlog report [timeout]' in message
+    assert 'To: oncall@ec-m.fr' in message
+    assert 'CLASS: timeout' in message
+
+
+def test_dedupe():
+    "Each distinct block is output once with its occurrences."
+    with open(program_output, 'r') as log:
+        log_lines = log.readlines()
+    with open(program_output_filtered, 'r') as correctly_filtered_output:
+        expected_blocks = correctly_filtered_output.read()
+    with tempfile.NamedTemporaryFile('w') as twice:
+        twice.writelines(log_lines * 2)
+        twice.flush()
+        for options in ([], ['--no-scan']):
+            output = StringIO()
+            python3(path2main, twice.name, '--dedupe', *options,
+                    start_pattern=start_pattern, _out=output)
+
+            lines = output.getvalue().splitlines(True)
+            assert [line for line in lines if line.startswith('SEEN: ')] == \
+                ['SEEN: 2 times, first at line {}, last at line {}\n'.format(
+                    first, first + len(log_lines)) for first in (79, 120)]
+            assert expected_blocks == ''.join(
+                line for line in lines if not line.startswith('SEEN: '))
+
+        output = StringIO()
+        python3(path2main, twice.name, '--dedupe', '--dedupe-size', '1',
+                start_pattern=start_pattern, _out=output)
+        assert output.getvalue().count('SEEN: 1 times') == 4
+
+
+def test_fan_out():
+    "Several sections are applied to a file or stdin read once."
+    with open(program_output_filtered, 'r') as correctly_filtered_output:
+        filtered = correctly_filtered_output.read()
+    with open('test/program_output_filtered_elided', 'r') as elided_output:
+        elided = elided_output.read()
+    assert filtered != elided
+    expected = 'SECTION: TEST\n{}SECTION: ELIDED\n{}'.format(filtered, elided)
+
+    output = StringIO()
+    python3(cat(program_output), path2main, config=config_file,
+            use_config_section='TEST,ELIDED', _out=output)
+    assert output.getvalue() == expected
+
+    for scan in ([], ['--no-scan']):
+        output = StringIO()
+        stats = StringIO()
+        python3(path2main, program_output, '--stats', *scan,
+                config=config_file, _out=output, _err=stats)
+        assert output.getvalue() == expected
+        assert '  lines read: 141\n' in stats.getvalue()
+
+    with tempfile.TemporaryDirectory() as directory:
+        state = os.path.join(directory, 'state')
+        process = python3(path2main, program_output, config=config_file,
+                          state=state, _ok_code=[2])
+        assert process.exit_code == 2
+        assert not os.path.exists(state)
+
+    with open(program_output, 'rb') as program_output_file:
+        data = program_output_file.read()
+    with tempfile.NamedTemporaryFile(suffix='.gz') as compressed:
+        compressed.write(gzip.compress(data))
+        compressed.flush()
+        output = StringIO()
+        python3(path2main, compressed.name, config=config_file,
+                use_config_section='TEST,ELIDED', _out=output)
+        assert output.getvalue() == expected
+
+
+def test_mail_queue():
+    "The emails that couldn't be sent are queued and sent by a later run."
+    server = SMTPStandIn()
+    mail_server = server.address
+    # Nothing listens on the port of the server until it is started again.
+    server.server_close()
+
+    with tempfile.TemporaryDirectory() as mail_queue:
+        errors = StringIO()
+        python3(path2main, 'test/program_output_mail', config=config_file,
+                mail_server=mail_server, mail_queue=mail_queue, _err=errors)
+        assert errors.getvalue() == ''
+        assert len(os.listdir(mail_queue)) == 1
+
+        server = SMTPStandIn(int(mail_server.split(':')[1]))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            python3(path2main, flush_mail_queue=True, mail_queue=mail_queue)
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert os.listdir(mail_queue) == []
+
+    assert len(server.messages) == 1
+    assert 'Subject: Pytest unlog' in server.messages[0]
+
+
 def test_mail_empty_mail():
     output = StringIO()
     python3(path2main, 'test/program_output_mail_empty', config=config_file, _err=output)
@@ -128,3 +448,363 @@ def test_filter_empty_group():
 
     with open(filtered_output_file, 'r') as correctly_filtered_output:
         assert correctly_filtered_output.read() == output.getvalue()
+
+
+def test_output_terminal():
+    "On a terminal, a block is output as soon as it is complete."
+    master, slave = pty.openpty()
+    process = subprocess.Popen([sys.executable, path2main, '-s', '^start'],
+                               stdin=subprocess.PIPE, stdout=slave)
+    os.close(slave)
+    try:
+        process.stdin.write(b'start\nerror\nstart\n')
+        process.stdin.flush()
+        assert select.select([master], [], [], 5)[0]
+        assert os.read(master, 1024) == b'start\r\nerror\r\n'
+    finally:
+        process.stdin.close()
+        process.wait()
+        os.close(master)
+
+
+def test_stream():
+    output = StringIO()
+    python3(path2main, program_output,
+            start_pattern=start_pattern,
+            error_pattern=error_pattern,
+            stream=True,
+            _out=output)
+
+    with open(program_output_filtered, 'r') as correctly_filtered_output:
+        assert correctly_filtered_output.read() == output.getvalue()
+
+
+def test_block_memory_limit():
+    for binary in ([], ['--binary']):
+        output = StringIO()
+        python3(path2main, program_output, *binary,
+                start_pattern=start_pattern,
+                error_pattern=error_pattern,
+                block_memory_limit=10,
+                _out=output)
+
+        with open(program_output_filtered, 'r') as correctly_filtered_output:
+            assert correctly_filtered_output.read() == output.getvalue()
+
+
+def test_block_head_tail():
+    output = StringIO()
+    python3(path2main, program_output,
+            start_pattern=start_pattern,
+            error_pattern=error_pattern,
+            block_head=2,
+            block_tail=1,
+            _out=output)
+
+    with open('test/program_output_filtered_elided', 'r') as correctly_filtered_output:
+        assert correctly_filtered_output.read() == output.getvalue()
+
+
+def test_binary():
+    output = StringIO()
+    python3(path2main, program_output,
+            start_pattern=start_pattern,
+            error_pattern=error_pattern,
+            binary=True,
+            _out=output)
+
+    with open(program_output_filtered, 'r') as correctly_filtered_output:
+        assert correctly_filtered_output.read() == output.getvalue()
+
+
+def test_binary_invalid_utf8():
+    output = StringIO()
+    python3(path2main, 'test/program_output_invalid_utf8',
+            start_pattern=start_pattern,
+            error_pattern=error_pattern,
+            binary=True,
+            _out=output)
+
+    with open('test/program_output_filtered_invalid_utf8', 'r') as correctly_filtered_output:
+        assert correctly_filtered_output.read() == output.getvalue()
+
+
+def test_no_scan():
+    output = StringIO()
+    python3(path2main, program_output,
+            start_pattern=start_pattern,
+            error_pattern=error_pattern,
+            no_scan=True,
+            _out=output)
+
+    with open(program_output_filtered, 'r') as correctly_filtered_output:
+        assert correctly_filtered_output.read() == output.getvalue()
+
+    output = StringIO()
+    python3(path2main, 'test/program_output_group', config=config_file,
+            no_scan=True, _out=output)
+
+    with open('test/program_output_filtered_group', 'r') as correctly_filtered_output:
+        assert correctly_filtered_output.read() == output.getvalue()
+
+
+def test_jobs():
+    output = StringIO()
+    python3(path2main, 'test/program_output_group',
+            'test/program_output_config', 'test/program_output_group',
+            config=config_file, jobs=2, _out=output)
+
+    expected_output = ''
+    for filtered_output_file in ['test/program_output_filtered_group',
+                                 program_output_filtered,
+                                 'test/program_output_filtered_group']:
+        with open(filtered_output_file, 'r') as correctly_filtered_output:
+            expected_output += correctly_filtered_output.read()
+    assert expected_output == output.getvalue()
+
+
+def test_split_file():
+    output = StringIO()
+    python3(path2main, program_output,
+            start_pattern=start_pattern,
+            error_pattern=error_pattern,
+            jobs=3, split_size=500,
+            _out=output)
+
+    with open(program_output_filtered, 'r') as correctly_filtered_output:
+        assert correctly_filtered_output.read() == output.getvalue()
+
+    output = StringIO()
+    python3(path2main, 'test/program_output_group', config=config_file,
+            jobs=3, split_size=500, _out=output)
+
+    with open('test/program_output_filtered_group', 'r') as correctly_filtered_output:
+        assert correctly_filtered_output.read() == output.getvalue()
+
+
+def test_follow():
+    with open(program_output, 'r') as program_output_file:
+        lines = program_output_file.readlines()
+
+    output = StringIO()
+    with tempfile.NamedTemporaryFile('w') as log:
+        log.writelines(lines[:len(lines) // 2])
+        log.flush()
+        process = python3(path2main, log.name,
+                          start_pattern=start_pattern,
+                          error_pattern=error_pattern,
+                          follow=True, follow_interval=0.1, idle_timeout=0.2,
+                          _out=output, _bg=True)
+        time.sleep(1)
+        log.writelines(lines[len(lines) // 2:])
+        log.flush()
+        time.sleep(1)
+        process.terminate()
+        process.wait()
+
+    with open(program_output_filtered, 'r') as correctly_filtered_output:
+        assert correctly_filtered_output.read() == output.getvalue()
+
+
+def test_state():
+    with open(program_output, 'r') as program_output_file:
+        lines = program_output_file.readlines()
+    # The last block is only output once a new block starts.
+    last_line = '/home/assos/drupal7/sites/assos.centrale-marseille.fr.end\n'
+
+    output = StringIO()
+    with tempfile.TemporaryDirectory() as directory:
+        log_name = '{}/log'.format(directory)
+        state_name = '{}/state'.format(directory)
+        for part in (lines[:len(lines) // 2], lines[len(lines) // 2:],
+                     [], [last_line]):
+            with open(log_name, 'a') as log:
+                log.writelines(part)
+            python3(path2main, log_name,
+                    start_pattern=start_pattern,
+                    error_pattern=error_pattern,
+                    state=state_name,
+                    _out=output)
+
+    with open(program_output_filtered, 'r') as correctly_filtered_output:
+        assert correctly_filtered_output.read() == output.getvalue()
+
+
+def test_compressed():
+    with open(program_output, 'rb') as program_output_file:
+        data = program_output_file.read()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for module in (gzip, bz2, lzma):
+            log_name = '{}/log.{}'.format(directory, module.__name__)
+            with module.open(log_name, 'wb') as log:
+                log.write(data)
+            output = StringIO()
+            python3(path2main, log_name,
+                    start_pattern=start_pattern,
+                    error_pattern=error_pattern,
+                    _out=output)
+
+            with open(program_output_filtered, 'r') as correctly_filtered_output:
+                assert correctly_filtered_output.read() == output.getvalue()
+
+            # A corrupted archive is reported without traceback.
+            corrupted = bytearray(module.compress(data))
+            corrupted[20:28] = bytes(byte ^ 0x55 for byte in corrupted[20:28])
+            with open(log_name, 'wb') as log:
+                log.write(corrupted)
+            errors = StringIO()
+            python3(path2main, log_name,
+                    start_pattern=start_pattern,
+                    error_pattern=error_pattern,
+                    _err=errors)
+            assert errors.getvalue().startswith(log_name + ': ')
+            assert 'Traceback' not in errors.getvalue()
+
+
+def test_stats():
+    "The stats are printed on stderr and written for Prometheus."
+    file = 'test/program_output_group'
+    with open(file, 'r') as program_output_file:
+        line_count = len(program_output_file.readlines())
+    with tempfile.TemporaryDirectory() as directory:
+        stats_file = os.path.join(directory, 'unlog.prom')
+        for scan in (True, False):
+            output = StringIO()
+            stats = StringIO()
+            python3(path2main, file, config=config_file, stats=True,
+                    stats_file=stats_file, no_scan=not scan, _out=output,
+                    _err=stats)
+
+            with open('test/program_output_filtered_group', 'r') as correctly_filtered_output:
+                assert correctly_filtered_output.read() == output.getvalue()
+            stats = stats.getvalue()
+            assert '  lines read: {}\n'.format(line_count) in stats
+            assert '  bytes read: {}\n'.format(os.path.getsize(file)) in stats
+            assert '  blocks matched: 2\n' in stats
+            assert '  lines emitted: {}\n'.format(
+                output.getvalue().count('\n')) in stats
+            assert '  groups: 2\n' in stats
+            assert '  error: ' in stats
+            with open(stats_file, 'r') as prometheus_file:
+                prometheus = prometheus_file.read()
+            assert 'unlog_lines_read {}\n'.format(line_count) in prometheus
+            assert 'unlog_pattern_seconds{pattern="error"} ' in prometheus
+            assert '# TYPE unlog_phase_seconds gauge\n' in prometheus
+
+
+def test_command():
+    "The commands are run concurrently and their exit code is kept."
+    with open(program_output_filtered, 'r') as correctly_filtered_output:
+        filtered = correctly_filtered_output.read()
+
+    output = StringIO()
+    # The options must come before --exec.
+    python3(path2main, '--start-pattern', start_pattern,
+            '--error-pattern', error_pattern, '--exec', 'cat', program_output,
+            _out=output)
+    assert 'GROUP: cat {}\n{}END GROUP: cat {}\n\n'.format(
+        program_output, filtered, program_output) == output.getvalue()
+
+    # -- still ends the options before a file.
+    output = StringIO()
+    with tempfile.TemporaryDirectory() as directory:
+        file = os.path.join(directory, '-program_output')
+        with open(file, 'w') as dash_file, open(program_output) as log:
+            dash_file.write(log.read())
+        python3(os.path.abspath(path2main), '--start-pattern', start_pattern,
+                '--error-pattern', error_pattern, '--', '-program_output',
+                _out=output, _cwd=directory)
+    assert filtered == output.getvalue()
+
+    output = StringIO()
+    process = python3(path2main,
+                      '--command', 'sleep 0.5; cat {}; exit 3'.format(program_output),
+                      '--command', 'cat {} >&2'.format(program_output),
+                      start_pattern=start_pattern,
+                      error_pattern=error_pattern,
+                      _out=output, _ok_code=[3])
+    assert process.exit_code == 3
+    assert 'GROUP: sleep 0.5; cat {0}; exit 3\n{1}END GROUP: sleep 0.5; cat '\
+        '{0}; exit 3\n\nGROUP: cat {0} >&2\n{1}END GROUP: cat {0} >&2\n\n'\
+        .format(program_output, filtered) == output.getvalue()
+
+
+def test_iter_blocks():
+    "The blocks are given to Python code with their position in the file."
+    file = 'test/program_output_group'
+    with open(file, 'rb') as program_output_file:
+        data = program_output_file.read()
+    lines = data.decode().splitlines(True)
+
+    groups = []
+    for block in iter_blocks_from_file(
+            file, start_pattern=start_pattern,
+            start_group_pattern='#### (?P<command>.+) - '
+            '(?P<date>[0-9]{4}-[0-9]{2}-[0-9]{2})',
+            end_group_pattern='#### END'):
+        groups.append(block.group)
+        text = data[block.start_offset:block.end_offset].decode()
+        assert text.startswith(lines[block.start_line - 1])
+        assert list(block.lines) == text.splitlines(True)
+    assert groups == ['Drush cron - 2014-09-14', 'Drush cron - 2014-09-15']
+
+
+def test_prefilter():
+    "The literal prefilter finds the same matches as the patterns alone."
+    patterns = [r'(error|warning)', r'(?i)(error|warning)', r'(?i)Kiss',
+                r'(?i)ıs', r'/home/\w+/sites.\w', r'^#### (?P<c>.+) - [0-9]{2}',
+                r'(?i)(ab)+c?', r'err(or)?|warn', r'(?i:err)or', r'(?i)k\b',
+                r'(?i)\bSİ', r'a{2,}b*', r'(?:ab|cd)(ef|gh)', r'(?i)é',
+                r'(?is)s.*i', r'$', r'(?i)ſ']
+    alphabet = 'abcdefghiksrorwnIKSEÉéRWO #-/:0İıſKK̇K'
+    words = ['error', 'warning', 'kiss', 'KİSS', 'erRor', 'ab', 'cdgh', 'aab',
+             '#### x - 12', '/home/u/sites.x', 'warn', 'Eror', 'sİ', 'ıS']
+    rng = random.Random(0)
+    for binary in (False, True):
+        for source in patterns:
+            if binary and not source.isascii():
+                continue
+            pattern = re.compile(source.encode() if binary else source)
+            search = prefiltered_search(pattern)
+            window_pattern = re.compile(pattern.pattern, pattern.flags | re.M)
+            window_search = WindowSearch(window_pattern)
+            for _ in range(200):
+                lines = [''.join(rng.choice(alphabet) if rng.random() < 0.7
+                                 else rng.choice(words)
+                                 for _ in range(rng.randint(0, 6))) + '\n'
+                         for _ in range(rng.randint(1, 8))]
+                if binary:
+                    lines = [line.encode() for line in lines]
+                for line in lines:
+                    expected, found = pattern.search(line), search(line)
+                    assert (expected and expected.span()) == \
+                        (found and found.span()), (source, line)
+                if not is_line_local(pattern):
+                    continue
+                buffer = lines[0][:0].join(lines)
+                folded = fold_case(buffer)
+                for position in range(len(buffer) + 1):
+                    expected = window_pattern.search(buffer, position)
+                    found = window_search(buffer, position, folded)
+                    assert (expected and expected.span()) == \
+                        (found and found.span()), (source, buffer, position)
+
+
+def test_startup_imports():
+    "The mail, config and parallel machinery is only loaded when needed."
+    output = StringIO()
+    import_times = StringIO()
+    python3('-X', 'importtime', path2main, program_output,
+            start_pattern=start_pattern,
+            error_pattern=error_pattern,
+            _out=output, _err=import_times)
+
+    imported = {line.split('|')[-1].strip()
+                for line in import_times.getvalue().splitlines()
+                if line.startswith('import time:')}
+    for module in ('smtplib', 'email', 'subprocess', 'configparser',
+                   'multiprocessing', 'tempfile'):
+        assert module not in imported
+    with open(program_output_filtered, 'r') as correctly_filtered_output:
+        assert correctly_filtered_output.read() == output.getvalue()
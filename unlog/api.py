@@ -0,0 +1,149 @@
+"""Gives the blocks matching the error pattern to Python code instead of
+printing them.
+
+For instance::
+
+    for block in iter_blocks_from_file('/var/log/cron.log',
+                                       start_pattern='^Running'):
+        handle(block.group, block.start_line, ''.join(block.lines))
+"""
+try:
+    from filter import Filter
+except ImportError:
+    from unlog.filter import Filter
+
+
+class Block:
+    """A block of lines matching the error pattern.
+
+    * *lines* - The list of the lines of the block, bytes if the filter works
+      in binary mode. If the filter only keeps the head and the tail of the
+      blocks, the elided lines are replaced by a single line.
+    * *group* - The message of the group of the block (command and date) or
+      None if it isn't in a group.
+    * *start_line* - The number of the first line of the block, starting at
+      1.
+    * *start_offset*, *end_offset* - The offsets in bytes of the start and of
+      the end of the block in the input, GROUP and END GROUP lines excluded.
+    * *error_class* - The most severe error class matched by the block or None
+      if the filter doesn't use error classes.
+    """
+    __slots__ = ('lines', 'group', 'start_line', 'start_offset', 'end_offset',
+                 'error_class')
+
+    def __init__(self, lines, group, start_line, start_offset, end_offset,
+                 error_class=None):
+        self.lines = lines
+        self.group = group
+        self.start_line = start_line
+        self.start_offset = start_offset
+        self.end_offset = end_offset
+        self.error_class = error_class
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __repr__(self):
+        return '<Block group={!r} start_line={} lines={}>'.format(
+            self.group, self.start_line, len(self.lines))
+
+
+def iter_blocks(lines, output_filter=None, **filter_options):
+    """Yields a :py:class:`Block` for each block of lines matching the error
+    pattern, as soon as the line ending it is read.
+
+    **PARAMETERS**
+
+    * *lines* - An iterable of lines ending with a new line: str, or bytes if
+      the filter works in binary mode.
+    * *output_filter* - The :py:class:`unlog.filter.Filter` to use. It is
+      created from *filter_options*, the arguments of
+      :py:class:`unlog.filter.Filter`, if None.
+
+    The offsets of the blocks are computed from the size of the lines encoded
+    with the encoding of the filter.
+    """
+    output_filter = output_filter or Filter(**filter_options)
+    if output_filter.binary:
+        sized_lines = ((line, len(line)) for line in lines)
+    else:
+        encoding = output_filter.log_encoding
+        sized_lines = ((line, len(line.encode(encoding, 'replace')))
+                       for line in lines)
+    return _iter_blocks(sized_lines, output_filter)
+
+
+def iter_blocks_from_file(file_name, output_filter=None, log_encoding='utf-8',
+                          **filter_options):
+    """Yields a :py:class:`Block` for each block of the file file_name
+    matching the error pattern, like :py:func:`iter_blocks`.
+
+    **PARAMETERS**
+
+    * *file_name* - The file to read.
+    * *output_filter* - The :py:class:`unlog.filter.Filter` to use. It is
+      created from *filter_options* if None.
+    * *log_encoding* - The encoding of the file if the filter doesn't work on
+      bytes. Default: 'utf-8'.
+    """
+    output_filter = output_filter or Filter(log_encoding=log_encoding,
+                                            **filter_options)
+    if output_filter.binary:
+        with open(file_name, 'rb') as file:
+            yield from _iter_blocks(((line, len(line)) for line in file),
+                                    output_filter)
+        return
+
+    # The new lines are not translated so the size of the lines is exact.
+    with open(file_name, 'r', encoding=log_encoding, newline='') as file:
+        yield from _iter_blocks(((_translate(line),
+                                  len(line.encode(log_encoding)))
+                                 for line in file), output_filter)
+
+
+def _translate(line):
+    """Returns the line with its new line translated like in a file opened in
+    text mode.
+    """
+    if line.endswith('\r\n'):
+        return line[:-2] + '\n'
+    elif line.endswith('\r'):
+        return line[:-1] + '\n'
+    return line
+
+
+def _iter_blocks(sized_lines, output_filter):
+    """Yields the blocks found by output_filter in the iterable of tuples
+    containing a line and its size in bytes.
+    """
+    matching_blocks = []
+    output_filter.set_block_handler(
+        lambda lines, group: matching_blocks.append(
+            (lines, group, output_filter.error_class)))
+    try:
+        process_line = output_filter.process_line
+        block_start = output_filter.block_start
+        start_line = line_number = 1
+        start_offset = offset = 0
+        for line, size in sized_lines:
+            process_line(line)
+            # The matching block ended before this line.
+            for lines, group, error_class in matching_blocks:
+                yield Block(lines, group, start_line, start_offset, offset,
+                            error_class)
+            matching_blocks.clear()
+            if output_filter.block_start != block_start:
+                block_start = output_filter.block_start
+                if block_start[1]:
+                    start_line, start_offset = line_number + 1, offset + size
+                else:
+                    start_line, start_offset = line_number, offset
+            line_number += 1
+            offset += size
+
+        output_filter.finish()
+        for lines, group, error_class in matching_blocks:
+            yield Block(lines, group, start_line, start_offset, offset,
+                        error_class)
+    finally:
+        output_filter.set_block_handler(None)
@@ -0,0 +1,123 @@
+from collections import deque
+
+
+class BlockBuffer:
+    """Holds the lines of the block being read by the Filter.
+
+    By default the lines are kept in a list. If *memory_limit* is given, the
+    lines are written to a temporary file once their total size exceeds it and
+    are read back from it when the buffer is iterated. If *head* or *tail* is
+    given, only the first *head* and the last *tail* lines are kept and the
+    other ones are replaced by a single line telling how many lines were
+    elided.
+    """
+
+    #: This template will be filled by the number of lines that were elided.
+    _elided_template = '[... {} lines elided ...]\n'
+
+    def __init__(self, memory_limit=None, head=None, tail=None, binary=False):
+        """**PARAMETERS**
+
+        * *memory_limit* - The maximum number of characters kept in memory
+          before spilling the lines to a temporary file. Default: None (no
+          limit).
+        * *head* - The number of lines to keep at the start of the block.
+          Default: None.
+        * *tail* - The number of lines to keep at the end of the block.
+          Default: None.
+        * *binary* - True if the lines are bytes. Default: False.
+        """
+        self._memory_limit = memory_limit
+        self._binary = binary
+        self._elide = head is not None or tail is not None
+        self._head_size = head or 0
+        self._tail_size = tail or 0
+        self._spill_file = None
+        self._lines = []
+        self.clear()
+        if not self._elide and memory_limit is None:
+            # Nothing to check: append directly to the list.
+            self.append = self._lines.append
+
+    def append(self, line):
+        """Add a line at the end of the block."""
+        if self._elide:
+            self._append_elided(line)
+            return
+
+        if self._spilled:
+            self._spill_file.write(line)
+            return
+
+        self._lines.append(line)
+        self._size += len(line)
+        if self._memory_limit is not None and self._size > self._memory_limit:
+            self._spill()
+
+    def _append_elided(self, line):
+        """Keep the line if it belongs to the head or the tail of the block."""
+        if len(self._lines) < self._head_size:
+            self._lines.append(line)
+            return
+
+        if len(self._tail) == self._tail_size:
+            self._elided += 1
+        if self._tail_size:
+            self._tail.append(line)
+
+    def _spill(self):
+        """Move the lines held in memory to the temporary file."""
+        if self._spill_file is None:
+            self._spill_file = self._open_spill_file()
+        self._spill_file.writelines(self._lines)
+        self._lines.clear()
+        self._spilled = True
+
+    def _open_spill_file(self):
+        """Returns the temporary file used to store the lines.
+
+        Lines are only split on \\n when read back, so they are returned
+        exactly as they were appended.
+        """
+        import tempfile
+
+        if self._binary:
+            return tempfile.TemporaryFile('w+b')
+        return tempfile.TemporaryFile('w+', encoding='utf-8',
+                                      errors='surrogatepass', newline='\n')
+
+    def __iter__(self):
+        if self._spilled:
+            self._spill_file.flush()
+            self._spill_file.seek(0)
+            return iter(self._spill_file)
+        elif self._elided:
+            return self._iter_elided()
+        else:
+            return iter(self._lines + list(self._tail))
+
+    def _iter_elided(self):
+        yield from self._lines
+        elided_line = self._elided_template.format(self._elided)
+        yield elided_line.encode('ascii') if self._binary else elided_line
+        yield from self._tail
+
+    def __bool__(self):
+        return bool(self._lines) or bool(self._tail) or self._spilled
+
+    def clear(self):
+        """Remove all the lines of the buffer."""
+        self._lines.clear()
+        self._tail = deque(maxlen=self._tail_size)
+        self._elided = 0
+        self._size = 0
+        self._spilled = False
+        if self._spill_file is not None:
+            self._spill_file.seek(0)
+            self._spill_file.truncate()
+
+    def close(self):
+        """Remove the temporary file if one was created."""
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
@@ -0,0 +1,121 @@
+"""Runs commands and filters their output, like ``command 2>&1 | unlog`` would
+but without losing their exit code. This module is only imported when unlog
+runs commands.
+"""
+import asyncio
+import io
+import shlex
+import sys
+
+try:
+    from reader import LineReader
+except ImportError:
+    from unlog.reader import LineReader
+
+
+class Command:
+    """A command whose stdout and stderr are read concurrently and given to
+    its own :py:class:`unlog.filter.Filter` in a group named after the
+    command.
+    """
+    #: Number of bytes read at once from stdout and stderr.
+    READ_SIZE = 1024 * 1024
+    #: Exit code used when the command cannot be started, like a shell does.
+    NOT_FOUND_EXIT_CODE = 127
+
+    def __init__(self, command, output_filter, log_encoding='utf-8',
+                 buffer_output=True):
+        """**PARAMETERS**
+
+        * *command* - The command to run: a list containing the program and
+          its arguments, or a str run by the shell.
+        * *output_filter* - The :py:class:`unlog.filter.Filter` to feed.
+        * *log_encoding* - The encoding of the output of the command if the
+          filter doesn't work on bytes. Default: 'utf-8'.
+        * *buffer_output* - Keep the output of the filter until :py:meth:`run`
+          returns instead of writing it to stdout as it comes. Default: True.
+        """
+        self._command = command
+        self._filter = output_filter
+        self._log_encoding = log_encoding
+        self._output = None
+        if buffer_output:
+            self._output = io.StringIO()
+            output_filter.set_output(self._output)
+        #: The exit code of the command once it ended, as given by a shell.
+        self.exit_code = None
+
+    @property
+    def name(self):
+        """The command as it would be typed in a shell."""
+        if isinstance(self._command, str):
+            return self._command
+        return ' '.join(shlex.quote(arg) for arg in self._command)
+
+    async def run(self):
+        """Run the command until it ends.
+
+        **RETURN** - the output of the filter if it is buffered, else ''.
+        """
+        self._filter.start_group(self.name)
+        try:
+            process = await self._start()
+        except OSError as e:
+            sys.stderr.write('Cannot run {}: {}\n'.format(self.name, e))
+            self.exit_code = self.NOT_FOUND_EXIT_CODE
+        else:
+            await asyncio.gather(self._read(process.stdout),
+                                 self._read(process.stderr))
+            returncode = await process.wait()
+            # A command killed by a signal exits with 128 + the signal.
+            self.exit_code = returncode if returncode >= 0 else 128 - returncode
+        self._filter.end_group()
+        self._filter.finish()
+        return self._output.getvalue() if self._output is not None else ''
+
+    def _start(self):
+        """Start the command with its stdout and stderr in pipes."""
+        if isinstance(self._command, str):
+            return asyncio.create_subprocess_shell(
+                self._command, stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE)
+        return asyncio.create_subprocess_exec(
+            *self._command, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE)
+
+    async def _read(self, stream):
+        """Give the lines of stream to the filter as they come. The lines of
+        stdout and stderr are interleaved like with ``2>&1``, but never cut.
+        """
+        reader = LineReader(self._filter.binary, self._log_encoding, 'replace')
+        process_line = self._filter.process_line
+        while True:
+            data = await stream.read(self.READ_SIZE)
+            if not data:
+                break
+            for line in reader.feed(data):
+                process_line(line)
+        for line in reader.finish():
+            process_line(line)
+
+
+def run_commands(commands):
+    """Run the :py:class:`Command` commands concurrently. The output of the
+    first command is written as it comes, the one of each other command as
+    soon as it and the previous commands ended, so it comes in the order of
+    the commands.
+
+    **RETURN** - the exit code of the first command that failed or 0.
+    """
+    return asyncio.run(_run_commands(commands))
+
+
+async def _run_commands(commands):
+    runs = [asyncio.ensure_future(command.run()) for command in commands]
+    for run in runs:
+        sys.stdout.write(await run)
+        sys.stdout.flush()
+    for command in commands:
+        if command.exit_code:
+            return command.exit_code
+    return 0
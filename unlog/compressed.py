@@ -0,0 +1,58 @@
+import importlib
+import io
+import os
+
+#: The magic bytes starting the compressed files that can be read and the
+#: module of the standard library reading them.
+COMPRESSIONS = [(b'\x1f\x8b', 'gzip'),
+                (b'BZh', 'bz2'),
+                (b'\xfd7zXZ\x00', 'lzma')]
+#: Size of the buffer holding the decompressed data.
+BUFFER_SIZE = 1024 * 1024
+
+
+def get_compression(file_name):
+    """Returns the name of the module able to decompress the file or None if
+    the file is not a compressed regular file. Only the first bytes of the
+    file are read.
+    """
+    if not os.path.isfile(file_name):
+        return None
+    with open(file_name, 'rb') as file:
+        magic = file.read(max(len(magic) for magic, _ in COMPRESSIONS))
+    for compression_magic, module_name in COMPRESSIONS:
+        if magic.startswith(compression_magic):
+            return module_name
+
+
+def open_decompressed(file_name, compression, log_encoding=None):
+    """Open a compressed file for reading. The data is decompressed as it is
+    read, without temporary file.
+
+    **PARAMETERS**
+
+    * *file_name* - The path of the compressed file.
+    * *compression* - The name of the module returned by
+      :py:func:`get_compression`.
+    * *log_encoding* - If given, the file is opened in text mode with this
+      encoding. Otherwise it is opened in binary mode.
+    """
+    module = importlib.import_module(compression)
+    file = io.BufferedReader(module.open(file_name, 'rb'),
+                             buffer_size=BUFFER_SIZE)
+    if log_encoding is None:
+        return file
+    return io.TextIOWrapper(file, encoding=log_encoding)
+
+
+def get_decompression_errors(compression):
+    """Returns the tuple of the exceptions raised when reading a corrupted or
+    truncated file compressed with compression.
+    """
+    errors = (OSError, EOFError)
+    if compression == 'gzip':
+        import zlib
+        # A corrupted deflate stream raises the error of zlib itself.
+        return errors + (zlib.error,)
+    module = importlib.import_module(compression)
+    return errors + (getattr(module, 'LZMAError', OSError),)
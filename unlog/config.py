@@ -1,5 +1,5 @@
-import glob2 as glob
 import os
+import re
 import configparser
 import sys
 
@@ -16,7 +16,21 @@ class Config():
 
     #: keys that are present in the config file but that must be ignored when creating the Filter object.
     CONFIG_FILTER_KEYS_EXCLUDED = ['files', 'config_file', 'use_config_section',
-                                   'include', 'log_encoding', ]
+                                   'include', 'scan', 'jobs',
+                                   'split_size', 'follow', 'follow_interval',
+                                   'idle_timeout', 'state', 'digest',
+                                   'mail_queue', 'flush_mail_queue', 'stats',
+                                   'stats_file', 'commands', ]
+    #: keys of the config file whose value must be converted to a boolean.
+    CONFIG_FILTER_BOOLEAN_KEYS = ['stream', 'binary', 'dedupe', ]
+    #: keys of the config file whose value must be converted to an integer.
+    CONFIG_FILTER_INTEGER_KEYS = ['block_memory_limit', 'block_head',
+                                  'block_tail', 'mail_max_size',
+                                  'dedupe_size', ]
+    #: keys of the config file followed by the name of an error class, eg
+    #: ``error pattern.critical``, and the Filter argument collecting them.
+    CONFIG_FILTER_ERROR_CLASS_KEYS = {'error_pattern': 'error_classes',
+                                      'mail_to': 'error_class_mail_to', }
 
     def __init__(self, command_line_args):
         """**PARAMETERS**
@@ -28,6 +42,9 @@ class Config():
         self._use_config_section = self._args.use_config_section
         self._config = configparser.ConfigParser()
         self._config.read(config_file)
+        self._section_matcher = None
+        # The Filter of each section, cloned for each file.
+        self._filters = {}
 
     def __getitem__(self, key):
         return self._config[key]
@@ -35,36 +52,60 @@ class Config():
     def __contains__(self, element):
         return element in self._config
 
-    def get_filter(self, section_name=''):
-        """Returns the Filter association with the asked section if it exits.
+    def get_filters(self, section_name=''):
+        """Returns a list of tuples containing the name of each section to
+        apply to section_name and a clone of its Filter.
+
+        Several sections apply if ``--use-config-section`` gives several names
+        separated by commas or if the section found for section_name has a
+        ``use sections`` key listing them.
+
+        The Filter of a section is created once and a clone of it is returned
+        for each file.
+        """
+        if self._use_config_section:
+            config_sections = self._use_config_section.split(',')
+        else:
+            config_section = self._get_config_section(section_name)
+            config_sections = [config_section] if config_section else []
+
+        named_filters = []
+        for config_section in config_sections:
+            config_section = config_section.strip()
+            if config_section in self._config\
+            and 'use sections' in self._config[config_section]:
+                used_sections = self._config[config_section]['use sections']
+                named_filters.extend(
+                    (used_section.strip(),
+                     self._get_section_filter(section_name,
+                                              used_section.strip()))
+                    for used_section in used_sections.split(','))
+            else:
+                named_filters.append(
+                    (config_section,
+                     self._get_section_filter(section_name, config_section)))
+        return named_filters
+
+    def _get_section_filter(self, section_name, config_section):
+        """Returns a clone of the Filter of config_section. Exit with error
+        code 1 if it doesn't exist.
         """
-        config_section = self._get_config_section(section_name)
-        if config_section:
+        if config_section not in self._filters:
+            if config_section not in self._config:
+                sys.stderr.write('The section {} used for {} doesn\'t exist\n'
+                                 .format(config_section, section_name or 'stdin'))
+                sys.exit(1)
             config_filter = self._get_config_filter(section_name, config_section)
-            return Filter(**config_filter)
+            self._filters[config_section] = Filter(**config_filter)
+        return self._filters[config_section].clone()
 
     def _get_config_section(self, section_name):
         """Returns the name of the config_section and takes into account ~ ($HOME)
         and blobs.
         """
-        if self._use_config_section:
-            return self._use_config_section
-
-        for config_section in self._config:
-            config_section_user_expanded = os.path.expanduser(config_section)
-            possible_section_names = self._expand_glob(config_section_user_expanded)
-            if section_name in possible_section_names:
-                return config_section
-
-    def _expand_glob(self, config_section_user_expanded):
-        """If the glob pattern is relative, expand it to be absolute."""
-        possible_section_names = list()
-        for possible_section_name in glob.glob(config_section_user_expanded):
-            if possible_section_name[0] != '/':
-                possible_section_name = '{}/{}'\
-                    .format(os.getcwd(), possible_section_name)
-            possible_section_names.append(possible_section_name)
-        return possible_section_names
+        if self._section_matcher is None:
+            self._section_matcher = SectionMatcher(self._config)
+        return self._section_matcher.match(section_name)
 
     def _get_config_filter(self, section_name, config_section):
         """Returns a dict containing the config for the Filter.
@@ -72,13 +113,37 @@ class Config():
         Key of the in _config sections contains spaces. We need to replace them
         with _ in order to pass the dict to the constructor of Filter so that
         named argument correctly match.
+
+        The keys of the error classes are collected in the order of the
+        config file, which is the order of their severity.
         """
         config = self._config[config_section]
-        self._include_config(section_name, config)
+        sections = [config]
+        if 'include' in config:
+            sections.append(self._get_included_section(section_name,
+                                                        config['include']))
         config_filter = dict()
-        for key, item in config.items():
-            new_key = key.replace(' ', '_')
-            config_filter[new_key] = item
+        error_classes = {}
+        for section in sections:
+            for key, item in section.items():
+                new_key = key.replace(' ', '_')
+                # The keys of config take precedence over the included ones.
+                if key == 'include' or new_key in config_filter:
+                    continue
+                base_key, _, error_class = new_key.partition('.')
+                if error_class\
+                and base_key in self.CONFIG_FILTER_ERROR_CLASS_KEYS:
+                    error_classes.setdefault(base_key, {})\
+                        .setdefault(error_class, item)
+                    continue
+                if new_key in self.CONFIG_FILTER_BOOLEAN_KEYS:
+                    item = section.getboolean(key)
+                elif new_key in self.CONFIG_FILTER_INTEGER_KEYS:
+                    item = section.getint(key)
+                config_filter[new_key] = item
+        for base_key, argument in self.CONFIG_FILTER_ERROR_CLASS_KEYS.items():
+            if base_key in error_classes:
+                config_filter[argument] = error_classes[base_key]
 
         for key, item in self._args.__dict__.items():
             if item is not None and key not in self.CONFIG_FILTER_KEYS_EXCLUDED:
@@ -86,26 +151,115 @@ class Config():
 
         return config_filter
 
-    def _include_config(self, section_name, config):
-        """If the current config has an include directive, we include it now.
-        """
-        if 'include' in config:
-            section_to_include = config['include']
-            self._include_section(section_name, section_to_include, config)
-            # Remove the 'include' key from the dict not to pass it to the
-            # constructor of Filter.
-            del config['include']
-
-    def _include_section(self, section_name, section_to_include, config):
-        """Add the key of the section to include to config with its values unless
-        config already has a key for it.
+    def _get_included_section(self, section_name, section_to_include):
+        """Returns the section to include in the section used for section_name.
+        Exit with error code 1 if it doesn't exist.
         """
         if section_to_include in self._config:
-            for key, item in self._config[section_to_include].items():
-                if key not in config:
-                    config[key] = item
+            return self._config[section_to_include]
+        sys.stderr.write('The include directive {} of {} doesn\'t match any'
+                         ' of the section\n'\
+                         .format(section_to_include, section_name))
+        sys.exit(1)
+
+
+class SectionMatcher:
+    """Finds the section of the config file matching a file without looking at
+    the file system.
+
+    The section names are globs like the ones of :py:mod:`glob`: ``*`` and
+    ``?`` don't match ``/`` nor a leading ``.``, ``**`` matches any number of
+    directories, hidden ones included, and ``[...]`` matches a character of a
+    set. ``~`` is expanded and relative names are relative to the current
+    directory. The names are translated to regular expressions once. If several
+    sections match a file, the first one in the config file is used.
+    """
+    #: The characters that make a section name a glob.
+    _magic_characters = re.compile(r'[*?[]')
+
+    def __init__(self, sections):
+        """**PARAMETERS**
+
+        * *sections* - The names of the sections in the order of the config
+          file.
+        """
+        # Sections without glob are found directly from the file name.
+        self._paths = {}
+        self._patterns = []
+        for index, section in enumerate(sections):
+            path = os.path.expanduser(section)
+            if not path.startswith('/'):
+                path = '{}/{}'.format(os.getcwd(), path)
+            if self._magic_characters.search(path):
+                self._patterns.append((index, re.compile(translate(path)),
+                                       section))
+            else:
+                self._paths.setdefault(path, (index, section))
+
+    def match(self, file_name):
+        """Returns the name of the first section matching the absolute path
+        file_name or None.
+        """
+        path_index, path_section = self._paths.get(file_name, (None, None))
+        for index, pattern, section in self._patterns:
+            if path_index is not None and index > path_index:
+                break
+            if pattern.match(file_name):
+                return section
+        return path_section
+
+
+def translate(pattern):
+    """Returns a regular expression matching the paths matched by the glob
+    pattern.
+    """
+    parts = []
+    components = pattern.split('/')
+    for position, component in enumerate(components):
+        is_last = position == len(components) - 1
+        if component == '**':
+            # Any number of directories, hidden ones included like with
+            # glob2, and the file itself if last.
+            parts.append(r'(?:[^/]+/)*' if not is_last
+                         else r'(?:[^/]+(?:/|\Z))*')
+            continue
+        if component and component[0] in '*?[':
+            parts.append(r'(?!\.)')
+        parts.append(_translate_component(component))
+        if not is_last:
+            parts.append('/')
+    return ''.join(parts) + r'\Z'
+
+
+def _translate_component(component):
+    """Translate a glob matching a single name."""
+    parts = []
+    index = 0
+    while index < len(component):
+        character = component[index]
+        index += 1
+        if character == '*':
+            parts.append('[^/]*')
+        elif character == '?':
+            parts.append('[^/]')
+        elif character == '[':
+            # Like fnmatch, a ] right after [ or [! belongs to the set.
+            end = index
+            if component[end:end + 1] == '!':
+                end += 1
+            if component[end:end + 1] == ']':
+                end += 1
+            end = component.find(']', end)
+            if end == -1:
+                parts.append(r'\[')
+                continue
+            characters = component[index:end].replace('\\', '\\\\')
+            if characters.startswith('!'):
+                characters = '^' + characters[1:]
+            elif characters.startswith('^'):
+                characters = '\\' + characters
+            parts.append('[{}]'.format(characters))
+            index = end + 1
         else:
-            sys.stderr.write('The include directive {} of {} doesn\'t match any'
-                             ' of the section\n'\
-                             .format(section_to_include, section_name))
-            sys.exit(1)
+            parts.append(re.escape(character))
+    return ''.join(parts)
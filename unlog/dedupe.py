@@ -0,0 +1,97 @@
+"""Folds the blocks repeating the same message. This module is only imported
+when the blocks are deduplicated.
+"""
+import collections
+import hashlib
+
+
+class DedupedBlock:
+    """A distinct block: the lines of its first occurrence, how many times it
+    was seen and the line numbers where its first and last occurrences start.
+    """
+    __slots__ = ('lines', 'error_class', 'report', 'count', 'first_line',
+                 'last_line')
+
+    def __init__(self, lines, line_number, error_class=None, report=None):
+        self.lines = lines
+        self.error_class = error_class
+        self.report = report
+        self.count = 1
+        self.first_line = self.last_line = line_number
+
+
+class BlockDeduplicator:
+    """Keeps the distinct blocks seen so far, identified by the fingerprint of
+    their text once the parts matching the mask are replaced, eg the dates,
+    the numbers or the paths.
+
+    At most *max_blocks* blocks are kept. The least recently seen block is
+    then given to *write_block* to make room for a new one: a block seen again
+    afterwards is written again, with the count of its next occurrences.
+    """
+    #: Default number of distinct blocks kept.
+    MAX_BLOCKS = 1000
+    #: Number of bytes of the fingerprints.
+    _fingerprint_size = 16
+
+    def __init__(self, write_block, mask=None, binary=False, max_blocks=None):
+        """**PARAMETERS**
+
+        * *write_block* - The function called with each
+          :py:class:`DedupedBlock` that leaves the deduplicator.
+        * *mask* - A compiled regular expression matching the parts of the
+          blocks that don't make them different. Default: None.
+        * *binary* - True if the lines are bytes. Default: False.
+        * *max_blocks* - The number of distinct blocks kept. Default:
+          :py:attr:`MAX_BLOCKS`.
+        """
+        self._write_block = write_block
+        self._mask = mask
+        self._binary = binary
+        self._placeholder = b'*' if binary else '*'
+        self._max_blocks = max_blocks or self.MAX_BLOCKS
+        self._blocks = collections.OrderedDict()
+
+    def add(self, lines, line_number, error_class=None, report=None):
+        """Record an occurrence of the block made of lines starting at
+        line_number.
+
+        **RETURN** - True if the block repeats a block already kept.
+        """
+        lines = list(lines)
+        fingerprint = self.fingerprint(lines)
+        block = self._blocks.get(fingerprint)
+        if block is not None:
+            block.count += 1
+            block.last_line = line_number
+            self._blocks.move_to_end(fingerprint)
+            return True
+
+        self._blocks[fingerprint] = DedupedBlock(lines, line_number,
+                                                 error_class, report)
+        if len(self._blocks) > self._max_blocks:
+            self._write_block(self._blocks.popitem(last=False)[1])
+        return False
+
+    def fingerprint(self, lines):
+        """Returns the digest of the lines once masked."""
+        text = (b'' if self._binary else '').join(lines)
+        if self._mask is not None:
+            text = self._mask.sub(self._placeholder, text)
+        if not self._binary:
+            text = text.encode('utf-8', 'surrogatepass')
+        return hashlib.blake2b(text,
+                               digest_size=self._fingerprint_size).digest()
+
+    def flush(self):
+        """Give all the blocks kept to *write_block*, in the order of their
+        first occurrence, and forget them.
+        """
+        blocks = sorted(self._blocks.values(),
+                        key=lambda block: block.first_line)
+        self._blocks.clear()
+        for block in blocks:
+            self._write_block(block)
+
+    def __len__(self):
+        return len(self._blocks)
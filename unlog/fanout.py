@@ -0,0 +1,155 @@
+"""Processes an input with several filters while reading it once. This module
+is only imported when several config sections apply to the same input.
+"""
+import mmap
+import os
+import shutil
+import stat
+import sys
+import tempfile
+
+try:
+    from reader import CHUNK_SIZE, LineReader
+    from scanner import Scanner, iter_windows
+except ImportError:
+    from unlog.reader import CHUNK_SIZE, LineReader
+    from unlog.scanner import Scanner, iter_windows
+
+
+class FanOut:
+    """Gives each chunk of an input read once to several
+    :py:class:`unlog.filter.Filter`, each getting the lines it expects: bytes
+    in binary mode or str decoded like in a file opened in text mode. If they
+    all can be used with a :py:class:`unlog.scanner.Scanner`, a regular file
+    is mapped in memory and each window of it is scanned by the scanner of
+    each filter instead.
+
+    The output of each filter is kept in a temporary file until the end of the
+    input. It is then written after a SECTION line naming the filter, in the
+    order of the filters. The reports sent by email are sent by each filter as
+    usual.
+    """
+    #: This template will be filled by the name of the filter.
+    _section_template = 'SECTION: {}\n'
+    #: Number of characters of the output of a filter kept in memory.
+    OUTPUT_MEMORY_LIMIT = 1024 * 1024
+
+    def __init__(self, named_filters, log_encoding='utf-8', scan=True):
+        """**PARAMETERS**
+
+        * *named_filters* - A list of tuples containing the name of a filter,
+          eg its config section, and the filter.
+        * *log_encoding* - The encoding of the input for the filters that
+          don't work on bytes. Default: 'utf-8'.
+        * *scan* - Scan the regular files when possible. Default: True.
+        """
+        self._names = [name for name, _ in named_filters]
+        self._filters = [output_filter for _, output_filter in named_filters]
+        self._log_encoding = log_encoding
+        self._scan = scan
+        self._stats = self._filters[0].stats
+        self._outputs = []
+        for output_filter in self._filters[1:]:
+            # The lines are counted once, by the first filter.
+            if output_filter.stats is not None:
+                output_filter.set_stats(output_filter.stats, count_input=False)
+        for output_filter in self._filters:
+            output = tempfile.SpooledTemporaryFile(
+                self.OUTPUT_MEMORY_LIMIT, 'w+', encoding='utf-8',
+                errors='surrogatepass', newline='\n')
+            output_filter.set_output(output)
+            self._outputs.append(output)
+
+    def process_file(self, file):
+        """Process a file opened in binary mode until its end, or until
+        reading it fails, and write the outputs.
+        """
+        if self._can_scan(file):
+            self._scan_file(file)
+            return
+
+        stats = self._stats
+        read = getattr(file, 'read1', file.read)
+        chunks = iter(lambda: read(CHUNK_SIZE), b'')
+        if stats is not None:
+            chunks = stats.iter_timed(chunks)
+
+        # A reader per mode: the lines are cut and decoded once.
+        readers = {}
+        for output_filter in self._filters:
+            if output_filter.binary not in readers:
+                readers[output_filter.binary] = (
+                    LineReader(output_filter.binary, self._log_encoding), [])
+            readers[output_filter.binary][1].append(output_filter.process_line)
+
+        try:
+            for data in chunks:
+                for reader, process_lines in readers.values():
+                    for line in reader.feed(data):
+                        for process_line in process_lines:
+                            process_line(line)
+            for reader, process_lines in readers.values():
+                for line in reader.finish():
+                    for process_line in process_lines:
+                        process_line(line)
+        finally:
+            # What was read is output even if reading failed.
+            self.finish()
+
+    def _can_scan(self, file):
+        """Returns True if file is a regular file and all the filters give the
+        same result with a :py:class:`unlog.scanner.Scanner`.
+        """
+        try:
+            file_stat = os.fstat(file.fileno())
+        except (AttributeError, OSError, ValueError):
+            return False
+        return self._scan and stat.S_ISREG(file_stat.st_mode)\
+            and all(Scanner.can_scan(output_filter, self._log_encoding)
+                    for output_filter in self._filters)
+
+    def _scan_file(self, file):
+        """Give each window of the regular file to the scanners of the filters
+        and write the outputs.
+        """
+        stats = self._stats
+        if stats is not None:
+            # The lines are counted here, the scanners skipping most of them.
+            for output_filter in self._filters:
+                output_filter.set_stats(stats, count_input=False)
+            previous = stats.switch('read')
+        scanners = [Scanner(output_filter, self._log_encoding)
+                    for output_filter in self._filters]
+        size = os.fstat(file.fileno()).st_size
+        try:
+            if not size:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for window_start, window_end in iter_windows(
+                        data, 0, size, Scanner.WINDOW_SIZE):
+                    if stats is not None:
+                        stats.switch('read')
+                    window = data[window_start:window_end]
+                    if stats is not None:
+                        stats.lines_read += window.count(b'\n')
+                    for scanner in scanners:
+                        scanner.scan_window(window, window_end == size)
+                if stats is not None:
+                    stats.lines_read += data[size - 1:size] != b'\n'
+                    stats.bytes_read += size
+        finally:
+            if stats is not None:
+                stats.switch(previous)
+            self.finish()
+
+    def finish(self):
+        """Finish the filters and write their outputs on stdout."""
+        for output_filter in self._filters:
+            output_filter.finish()
+        for name, output in zip(self._names, self._outputs):
+            if output.tell():
+                sys.stdout.write(self._section_template.format(name))
+                output.seek(0)
+                shutil.copyfileobj(output, sys.stdout)
+            output.close()
+        sys.stdout.flush()
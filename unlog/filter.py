@@ -1,9 +1,109 @@
+import codecs
+import copy
 import re
-import sys
-import smtplib
-from email.mime.text import MIMEText
 from builtins import len
-from subprocess import Popen, PIPE
+
+try:
+    from block import BlockBuffer
+    from output import OutputSink
+    from prefilter import prefiltered_search
+    from report import MailReport
+except ImportError:
+    from unlog.block import BlockBuffer
+    from unlog.output import OutputSink
+    from unlog.prefilter import prefiltered_search
+    from unlog.report import MailReport
+
+
+class LineClassifier:
+    """Finds the roles of a line with as few regular expression evaluations as
+    possible.
+
+    A line can start a group, start a block, end a group, be ignored because it
+    contains a group pattern and contain an error. Each pattern is evaluated at
+    most once per line: a group pattern is searched only once and the match is
+    considered to be at the start of the line if it begins at position 0, which
+    is what ``match`` would have returned. The start pattern is not evaluated
+    on lines starting a group and the error pattern is not evaluated on ignored
+    lines. The patterns are only evaluated on the lines containing one of the
+    literals they require, see :py:mod:`unlog.prefilter`.
+    """
+    #: The line matches the start group pattern at its beginning.
+    GROUP_START = 1
+    #: The line matches the start pattern.
+    START = 2
+    #: The line contains a group pattern and must not be added to the block.
+    IGNORE = 4
+    #: The line matches the end group pattern at its beginning.
+    GROUP_END = 8
+    #: The line matches the error pattern.
+    ERROR = 16
+
+    def __init__(self, start_pattern, error_pattern, start_group_pattern=None,
+                 end_group_pattern=None, stats=None):
+        """**PARAMETERS**
+
+        * *start_pattern* - The compiled start pattern.
+        * *error_pattern* - The compiled error pattern.
+        * *start_group_pattern* - The compiled start group pattern or None.
+        * *end_group_pattern* - The compiled end group pattern or None. Groups
+          are only detected if both group patterns are given.
+        * *stats* - The :py:class:`unlog.stats.Stats` measuring the time spent
+          in each pattern or None. Default: None.
+        """
+        self._patterns = (start_pattern, error_pattern, start_group_pattern,
+                          end_group_pattern)
+        timed = stats.timed if stats is not None else lambda search, _: search
+        self._start_search = timed(prefiltered_search(start_pattern), 'start')
+        self._error_search = timed(prefiltered_search(error_pattern), 'error')
+        if start_group_pattern is not None and end_group_pattern is not None:
+            self._start_group_search = timed(
+                prefiltered_search(start_group_pattern), 'start_group')
+            self._end_group_search = timed(
+                prefiltered_search(end_group_pattern), 'end_group')
+            self.classify = self._classify_with_groups
+        else:
+            self.classify = self._classify
+
+    def __reduce__(self):
+        # The prefiltered searches can't be pickled: the copies sent to other
+        # processes build their own, without the stats.
+        return LineClassifier, self._patterns
+
+    def classify(self, line, check_error=True):
+        """Returns a tuple containing the roles of the line as an int made of the
+        flags of this class and the match of the start group pattern if the
+        line starts a group.
+
+        If *check_error* is False, the error pattern is only evaluated on the
+        lines starting a new block.
+        """
+        return self._classify(line, check_error)
+
+    def _classify(self, line, check_error=True):
+        if self._start_search(line):
+            if self._error_search(line):
+                return self.START | self.ERROR, None
+            return self.START, None
+        elif check_error and self._error_search(line):
+            return self.ERROR, None
+        return 0, None
+
+    def _classify_with_groups(self, line, check_error=True):
+        start_group_match = self._start_group_search(line)
+        end_group_match = self._end_group_search(line)
+        if start_group_match is None and end_group_match is None:
+            return self._classify(line, check_error)
+
+        roles = self.IGNORE
+        if end_group_match is not None and end_group_match.start() == 0:
+            roles |= self.GROUP_END
+        if start_group_match is not None and start_group_match.start() == 0:
+            return roles | self.GROUP_START, start_group_match
+        elif self._start_search(line):
+            roles |= self.START
+        return roles, None
+
 
 class Filter:
     """Defines how to filter.
@@ -12,11 +112,34 @@ class Filter:
     _start_group_template = 'GROUP: {}\n'
     #: This template will be filled by the date and the command. 
     _end_group_template = 'END GROUP: {}\n\n'
+    #: This template will be filled by the error class of the block.
+    _error_class_template = 'CLASS: {}\n'
+    #: This template will be filled by the subject and the error class.
+    _error_class_subject_template = '{} [{}]'
+    #: This template will be filled by the number of occurrences of a block
+    #: and the lines where the first and the last ones start.
+    _dedupe_template = 'SEEN: {} times, first at line {}, last at line {}\n'
+    #: The parts of the blocks ignored by default when deduplicating them:
+    #: UUIDs, dates and times, hexadecimal identifiers, paths and numbers.
+    DEFAULT_DEDUPE_MASKS = (
+        r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}',
+        r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(?::\d{2}(?:[.,]\d+)?)?'
+        r'(?:Z|[+-]\d{2}:?\d{2})?',
+        r'\d{1,2}:\d{2}:\d{2}(?:[.,]\d+)?',
+        r'\b(?:0x[0-9a-f]+|(?=[0-9a-f]*\d)[0-9a-f]{6,})\b',
+        r'(?:/[\w.@~+-]+)+/?',
+        r'\d+',
+    )
 
     def __init__(self, error_pattern="(error|warning)", start_pattern=r".*",
                  no_mail=False, mail_to=None, mail_from='unlog@localhost',
                  mail_subject='Unlog report', start_group_pattern=None,
-                 end_group_pattern=None, mail_server='localhost'):
+                 end_group_pattern=None, mail_server='localhost', stream=False,
+                 block_memory_limit=None, block_head=None, block_tail=None,
+                 binary=False, log_encoding='utf-8', decode_errors='replace',
+                 mail_max_size=None, error_classes=None,
+                 error_class_mail_to=None, dedupe=False, dedupe_masks=None,
+                 dedupe_size=None):
         """**PARAMETERS**
 
     * *error_pattern* - A regular expression that match the lines containing the
@@ -33,41 +156,502 @@ class Filter:
     * *end_group_pattern* - An optional regual expression matching the end of a
       log group. Default: None.
     * *mail_server* - The SMTP server to use. Can also be sendmail.
+    * *stream* - Once a line of the current block matches the error pattern,
+      output the following lines of the block as they come instead of
+      buffering them. Default: False.
+    * *block_memory_limit* - The number of characters of a block kept in
+      memory. Beyond it, the block is stored in a temporary file. Default: None
+      (no limit).
+    * *block_head* - Only keep this number of lines at the start of a block.
+      Default: None (keep all the lines).
+    * *block_tail* - Only keep this number of lines at the end of a block.
+      Default: None (keep all the lines).
+    * *binary* - Process the lines as bytes instead of str. The patterns are
+      encoded with *log_encoding* and only the lines that are output are
+      decoded. Default: False.
+    * *log_encoding* - The encoding of the log. Only used if *binary* is True.
+      Default: 'utf-8'.
+    * *decode_errors* - How to handle decoding errors of the output lines if
+      *binary* is True. See :py:meth:`bytes.decode`. Default: 'replace'.
+    * *mail_max_size* - The maximum number of characters of the report put in
+      the body of the email. A bigger report is truncated and attached
+      compressed with gzip. Default: 1 MiB.
+    * *error_classes* - A dict, or a list of tuples, giving the regular
+      expression matching the lines of each class of errors, from the most to
+      the least severe. It replaces *error_pattern*: a block matches if a line
+      matches one of them and is tagged with the most severe class matched by
+      its lines. The stream mode is then not used. Default: None.
+    * *error_class_mail_to* - A dict giving the email address to which the
+      blocks of an error class are sent, in a report of their own. The blocks
+      of the other classes are output like without classes. Default: None.
+    * *dedupe* - Output each distinct matching block once, at the end of the
+      input, after a SEEN line giving its number of occurrences and the lines
+      where the first and the last ones start. The GROUP and END GROUP lines
+      are not output and the stream mode is not used. Default: False.
+    * *dedupe_masks* - A list of regular expressions, or a str with one per
+      line, matching the parts of the blocks that don't make them different.
+      Default: :py:attr:`DEFAULT_DEDUPE_MASKS`.
+    * *dedupe_size* - The number of distinct blocks kept in memory. Beyond it,
+      the least recently seen block is output. Default: 1000.
         """
-        self._stack = []
-        self._mail_lines = []
-        self._error_pattern = re.compile(error_pattern, re.I)
-        self._start_pattern = re.compile(start_pattern, re.I)
+        self._binary = bool(binary)
+        self._log_encoding = log_encoding or 'utf-8'
+        self._decode_errors = decode_errors or 'replace'
+        self._block_options = {'memory_limit': self._to_int(block_memory_limit),
+                               'head': self._to_int(block_head),
+                               'tail': self._to_int(block_tail),
+                               'binary': self._binary}
+        self._dedupe = bool(dedupe)
+        # A block must be complete to be deduplicated or tagged with its most
+        # severe error class: it can't be output before its end.
+        self._stream = bool(stream) and not self._dedupe and not error_classes
+        if isinstance(dedupe_masks, str):
+            dedupe_masks = dedupe_masks.splitlines()
+        dedupe_masks = [mask.strip() for mask in dedupe_masks or []
+                        if mask.strip()] or self.DEFAULT_DEDUPE_MASKS
+        # The masks are replaced in a single pass over the block.
+        self._dedupe_mask = self._compile('|'.join(
+            '(?:{})'.format(mask) for mask in dedupe_masks), re.I)\
+            if self._dedupe else None
+        self._dedupe_size = self._to_int(dedupe_size)
+        error_classes = dict(error_classes or {})
+        self._error_classes = [(name, self._compile(pattern, re.I))
+                               for name, pattern in error_classes.items()]
+        if error_classes:
+            # A single search finds the lines matching any class: the class is
+            # only looked for on these lines.
+            error_pattern = '|'.join('(?:{})'.format(pattern)
+                                     for pattern in error_classes.values())
+        self._error_pattern = self._compile(error_pattern, re.I)
+        self._start_pattern = self._compile(start_pattern, re.I)
         self._no_mail = no_mail
         self._mail_to = mail_to
+        self._mail_max_size = self._to_int(mail_max_size)
         self._mail_from = mail_from
         self._mail_subject = mail_subject
-        self._start_group_pattern = re.compile(start_group_pattern) \
+        self._error_class_mail_to = {} if no_mail\
+            else dict(error_class_mail_to or {})
+        self._start_group_pattern = self._compile(start_group_pattern) \
                                     if start_group_pattern else None
-        self._end_group_pattern = re.compile(end_group_pattern) \
+        self._end_group_pattern = self._compile(end_group_pattern) \
                                     if end_group_pattern else None
-        self._group_message = ''
         self._mail_server = mail_server
+        # Shared with the clones so the output stays in order.
+        self._output = OutputSink()
+        self._mail_digest = None
+        self._mail_sender = None
+        self._report_title = None
+        self._block_handler = None
+        self.set_stats(None)
+        self._reset_state()
+
+    def _reset_state(self):
+        """Initialize what changes while lines are processed."""
+        self._stack = BlockBuffer(**self._block_options)
+        self._stack_append = self._stack.append
+        self._stack_matches = False
+        self._streaming = False
+        self._report = MailReport()
+        self._error_class_reports = {name: MailReport() for name
+                                     in self._error_class_mail_to}
+        self._stack_class = 0
+        self._error_class_counts = {name: 0 for name, _ in self._error_classes}
+        self._group_message = ''
+        self._in_group = False
+        self._blocks_started = 0
+        self._block_starts_after_line = False
+        self._groups_started = 0
+        self._group_headers_to_skip = 0
+        self._deduplicator = self._create_deduplicator()\
+            if self._dedupe else None
+        self._line_number = 0
+        self._block_line = 1
+
+    def _create_deduplicator(self):
+        """Returns the :py:class:`unlog.dedupe.BlockDeduplicator` folding
+        the matching blocks.
+        """
+        try:
+            from dedupe import BlockDeduplicator
+        except ImportError:
+            from unlog.dedupe import BlockDeduplicator
+        return BlockDeduplicator(self._write_deduped_block, self._dedupe_mask,
+                                 self._binary, self._dedupe_size)
+
+    def clone(self):
+        """Returns a new filter with the same configuration as this one, ready
+        to process a new input. The compiled patterns are shared, which makes
+        it much cheaper than creating a new filter.
+        """
+        clone = copy.copy(self)
+        clone._mail_digest = self._mail_digest
+        clone._mail_sender = self._mail_sender
+        if self._stats is not None:
+            # The instrumented process_line is bound to this filter.
+            clone.set_stats(self._stats, self._count_input)
+        else:
+            clone._bind_process_line()
+        clone._reset_state()
+        return clone
+
+    def __getstate__(self):
+        # The digest and the sender belong to the process that created them:
+        # the copies of the filter sent to other processes don't take them.
+        state = self.__dict__.copy()
+        state['_mail_digest'] = None
+        state['_mail_sender'] = None
+        # Neither do the stats, whose timers can't be pickled.
+        if self._stats is not None:
+            state['_stats'] = None
+            state.pop('process_line', None)
+            state['_classifier'] = LineClassifier(self._start_pattern,
+                                                  self._error_pattern,
+                                                  self._start_group_pattern,
+                                                  self._end_group_pattern)
+            state['_classify'] = state['_classifier'].classify
+        return state
+
+    def set_stats(self, stats, count_input=True):
+        """Count what is processed and measure the time spent in the patterns
+        with stats.
+
+        **PARAMETERS**
+
+        * *stats* - The :py:class:`unlog.stats.Stats` to update or None to
+          stop measuring. It can be shared by several filters.
+        * *count_input* - Count the lines and bytes processed. False when
+          another filter processes the same lines and counts them. Default:
+          True.
+        """
+        self._stats = stats
+        self._count_input = count_input
+        self._classifier = LineClassifier(self._start_pattern,
+                                          self._error_pattern,
+                                          self._start_group_pattern,
+                                          self._end_group_pattern, stats)
+        self._classify = self._classifier.classify
+        self._output.set_stats(stats)
+        self._bind_process_line()
+
+    def _bind_process_line(self):
+        """Use the process_line counting the lines or measuring the time
+        spent if needed.
+        """
+        if self._stats is not None:
+            self.process_line = self._process_line_with_stats
+        elif self._dedupe:
+            self.process_line = self._process_numbered_line
+        else:
+            self.__dict__.pop('process_line', None)
+
+    @property
+    def stats(self):
+        """The :py:class:`unlog.stats.Stats` given to :py:meth:`set_stats` or
+        None.
+        """
+        return self._stats
+
+    @property
+    def binary(self):
+        """True if the lines to process must be bytes."""
+        return self._binary
+
+    @property
+    def dedupes(self):
+        """True if the matching blocks are deduplicated, which requires to
+        number the lines.
+        """
+        return self._dedupe
+
+    @property
+    def log_encoding(self):
+        """The encoding of the log."""
+        return self._log_encoding
+
+    def set_output(self, stream):
+        """Write the output to the text file stream instead of stdout. The
+        clones made afterwards share it.
+        """
+        self._output = OutputSink(stream=stream)
+        self._output.set_stats(self._stats)
+
+    def set_block_handler(self, block_handler):
+        """Give the blocks matching the error pattern to block_handler instead
+        of printing them or adding them to the report.
+
+        **PARAMETERS**
+
+        * *block_handler* - A function called with the list of the lines of
+          each matching block and the message of its group, None if the block
+          isn't in a group. The lines are bytes in binary mode. The GROUP and
+          END GROUP lines are not output and the stream mode is not used. If
+          None, the blocks are printed again. The error class of the block is
+          given by :py:attr:`error_class` while block_handler runs.
+        """
+        self._block_handler = block_handler
+
+    @property
+    def start_pattern(self):
+        """The compiled start pattern."""
+        return self._start_pattern
+
+    @property
+    def hit_patterns(self):
+        """The compiled patterns whose matching lines can produce an output:
+        the error pattern and the group patterns if they are used.
+        """
+        return [self._error_pattern] + list(self.group_patterns or [])
+
+    @property
+    def group_patterns(self):
+        """A tuple containing the compiled start and end group patterns or None
+        if groups are not used.
+        """
+        if self._has_group_patterns():
+            return self._start_group_pattern, self._end_group_pattern
+
+    @property
+    def mail_lines(self):
+        """The lines of the report to send by email."""
+        return list(self._report)
+
+    @property
+    def error_class_mail_lines(self):
+        """A dict giving the lines of the report of each error class sent to
+        its own address.
+        """
+        return {name: list(report)
+                for name, report in self._error_class_reports.items()}
+
+    @property
+    def block_start(self):
+        """Changes each time a new block starts: a tuple containing the number
+        of blocks started so far and True if the current block starts after the
+        last processed line instead of with it.
+        """
+        return self._blocks_started, self._block_starts_after_line
+
+    @property
+    def groups_started(self):
+        """The number of groups started so far."""
+        return self._groups_started
+
+    @property
+    def error_class(self):
+        """The name of the most severe error class matched by the current
+        block or None if it doesn't match or no error classes are used.
+        """
+        if self._stack_matches and self._error_classes:
+            return self._error_classes[self._stack_class][0]
+
+    @property
+    def error_class_counts(self):
+        """A dict giving the number of matching blocks of each error class
+        so far.
+        """
+        return dict(self._error_class_counts)
+
+    def get_state(self):
+        """Returns what must be given to :py:meth:`restore_state` to continue
+        after the last processed line with a new filter, the current block
+        being processed again.
+        """
+        return {'group_message': self._group_message,
+                'streaming': self._streaming}
+
+    def restore_state(self, group_message='', streaming=False,
+                      skip_group_headers=0):
+        """Continue the work of another filter.
+
+        **PARAMETERS**
+
+        * *group_message* - The message of the current group.
+        * *streaming* - True if the lines of the current block must be output
+          as they come because it was already output.
+        * *skip_group_headers* - The number of next GROUP lines already output
+          and that must not be output again.
+        """
+        self._group_message = group_message
+        self._streaming = self._stack_matches = streaming
+        self._group_headers_to_skip = skip_group_headers
+
+    def add_mail_lines(self, lines, error_class=None):
+        """Add lines produced by another filter with the same configuration to
+        the report to send by email, or to the report of error_class if it
+        isn't None.
+        """
+        if error_class is not None:
+            self._error_class_reports[error_class].extend(lines)
+        else:
+            self._report.extend(lines)
+
+    def _compile(self, pattern, flags=0):
+        """Compile the pattern as bytes in binary mode and as str otherwise."""
+        if self._binary:
+            pattern = pattern.encode(self._log_encoding)
+        return re.compile(pattern, flags)
+
+    def _decode(self, data):
+        """Returns the bytes read in binary mode as str."""
+        return data.decode(self._log_encoding, self._decode_errors)
+
+    def _decode_lines(self, lines):
+        """Returns an iterator decoding the lines read in binary mode one by
+        one, so that a block spilled to disk is never loaded at once.
+        """
+        return codecs.iterdecode(lines, self._log_encoding, self._decode_errors)
+
+    @staticmethod
+    def _to_int(value):
+        """Returns value as an int unless it is None."""
+        return int(value) if value is not None else None
 
     def process_file(self, file):
         """Loop over each line of a file and process them with
         :py:meth:`process_line`.
         """
+        if self._stats is not None:
+            file = self._stats.iter_timed(file)
         for line in file:
             self.process_line(line)
+        self.finish()
+
+    def finish(self, complete=True):
+        """Must be called at the end of the input: prints the stack, sends the
+        report by email and empties both so the filter starts afresh on the
+        next input.
+
+        If *complete* is False, the last block is not printed because it will
+        be processed again once complete.
+        """
         # We must print the stack when we reach the end of a file so that the
         # errors located at the end are displayed.
-        self.print_stack()
+        if complete:
+            self.print_stack()
+            self._count_block()
+        if self._deduplicator is not None:
+            self._deduplicator.flush()
+            if complete:
+                self._line_number = 0
+                self._block_line = 1
+        self._output.flush()
+        self.send_mail()
+        self._reset_stack()
+        self._clear_reports()
+
+    def flush(self):
+        """Used when no new line is expected soon: outputs the current block if
+        it matches, the next lines of the block being output as they come like
+        in stream mode, and sends the report by email.
+        """
+        if self._stack_matches and not self._streaming\
+        and self._block_handler is None and self._deduplicator is None\
+        and not self._error_classes:
+            self.print_stack()
+            self._stack.clear()
+            self._streaming = True
+        if self._deduplicator is not None:
+            self._deduplicator.flush()
+        self._output.flush()
         self.send_mail()
+        self._clear_reports()
 
     def process_line(self, line):
-        """Calls :py:meth:`check_start` for each line and add the line to the
-        stack unless it must be ignored. Finally call :py:meth:`check_end`.
+        """Classify the line with the :py:class:`LineClassifier`, start a group
+        or a block if needed and add the line to the stack unless it must be
+        ignored. Finally end the group if the line matches the end group
+        pattern.
+
+        This does the same as calling :py:meth:`check_start`, adding the line to
+        the stack and calling :py:meth:`check_end` but evaluates each pattern
+        at most once.
+        """
+        roles, start_group_match = self._classify(
+            line, not self._stack_matches or self._stack_class > 0)
+        if not roles:
+            # Most of the lines neither start nor end anything nor contain an
+            # error: add them as fast as possible.
+            if self._streaming:
+                self._output_line(line)
+            else:
+                self._stack_append(line)
+            return
+
+        if roles & LineClassifier.GROUP_START:
+            self._start_group(start_group_match)
+        elif roles & LineClassifier.START:
+            self.print_stack()
+            self._start_block(after_line=False)
+        if not roles & LineClassifier.IGNORE:
+            self._append_line(line, roles & LineClassifier.ERROR)
+        if roles & LineClassifier.GROUP_END:
+            self._end_group()
+
+    def _process_line_with_stats(self, line):
+        """Count the line and process it with :py:meth:`process_line`, the time
+        it takes being added to the filter phase.
+        """
+        stats = self._stats
+        if self._dedupe:
+            self._line_number += 1
+        if self._count_input:
+            stats.lines_read += 1
+            if self._binary:
+                stats.bytes_read += len(line)
+            else:
+                stats.bytes_read += len(line.encode(self._log_encoding,
+                                                    'replace'))
+        previous = stats.switch('filter')
+        try:
+            Filter.process_line(self, line)
+        finally:
+            stats.switch(previous)
+
+    def _process_numbered_line(self, line):
+        """Count the line, to know where the blocks start, and process it
+        with :py:meth:`process_line`.
+        """
+        self._line_number += 1
+        Filter.process_line(self, line)
+
+    def skip_lines(self, count):
+        """Count lines that were read but not given to
+        :py:meth:`process_line`, to keep the line numbers right.
+        """
+        self._line_number += count
+
+    def _append_line(self, line, is_error):
+        """Add the line to the stack and record whether it matches the error
+        pattern so the stack never has to be searched again. In stream mode,
+        the stack is output as soon as it matches and the next lines of the
+        block are output directly.
+        """
+        if self._streaming:
+            self._output_line(line)
+            return
+
+        self._stack.append(line)
+        if is_error and self._error_classes:
+            self._update_error_class(line)
+        if is_error and not self._stack_matches:
+            self._stack_matches = True
+            if self._stream and self._block_handler is None:
+                self.print_stack()
+                self._stack.clear()
+                self._streaming = True
+                self._output.flush()
+
+    def _update_error_class(self, line):
+        """Tag the block with the error class of the line if it is more severe
+        than the one of the block. While the block isn't tagged with the most
+        severe class, the error pattern is evaluated on all its lines.
         """
-        self.check_start(line)
-        if not self._must_ignore_line(line):
-            self._stack.append(line)
-        self.check_end(line)
+        error_classes = self._error_classes[:self._stack_class]\
+            if self._stack_matches else self._error_classes
+        for index, (_, pattern) in enumerate(error_classes):
+            if pattern.search(line):
+                self._stack_class = index
+                return
 
     def check_start(self, line):
         """Checks if the current line match the start group or start pattern. Empty
@@ -75,100 +659,257 @@ class Filter:
         """
         if self._has_group_patterns()\
         and self._start_group_pattern.match(line):
-            m = self._start_group_pattern.match(line)
-            self._group_message = ' - '.join(m.groups())
-            start_group_message = self._start_group_template.format(self._group_message)
-            if self._must_display_sdout():
-                sys.stdout.write(start_group_message)
-            else:
-                self._mail_lines.append(start_group_message)
+            self._start_group(self._start_group_pattern.match(line))
         elif self._start_pattern.search(line):
             self.print_stack()
-            self._stack = []
+            self._start_block(after_line=False)
+
+    def _start_group(self, start_group_match):
+        """Displays the GROUP line built from the groups of the match of the
+        start group pattern.
+        """
+        groups = start_group_match.groups()
+        if self._binary:
+            groups = [self._decode(group) for group in groups]
+        self.start_group(' - '.join(groups))
+
+    def start_group(self, group_message):
+        """Start a group named group_message, like a line matching the start
+        group pattern does.
+        """
+        self._group_message = group_message
+        self._in_group = True
+        self._groups_started += 1
+        if self._group_headers_to_skip:
+            self._group_headers_to_skip -= 1
+            return
+        if self._stats is not None:
+            self._stats.groups += 1
+        start_group_message = self._start_group_template.format(self._group_message)
+        if self._block_handler is not None or self._deduplicator is not None:
+            return
+        elif self._must_display_sdout():
+            self._output.write(start_group_message)
+        else:
+            self._report.append_group_start(start_group_message)
+        for report in self._error_class_reports.values():
+            report.append_group_start(start_group_message)
 
     def print_stack(self):
-        """Prints the stack to stdout or add the line the _email_lines list.
+        """Prints the stack to stdout or add the line to the report if it
+        matches, or gives it to the block handler if one is set. With error
+        classes, the stack is preceded by a CLASS line and goes to the report
+        of its class if it has one.
         """
-        if self.match() and self._must_display_sdout():
-            for line in self._stack:
-                sys.stdout.write(line)
-        elif self.match():
-            self._mail_lines.extend(self._stack)
+        if not self.match():
+            return
+        elif self._block_handler is not None:
+            self._block_handler(list(self._stack),
+                                self._group_message if self._in_group else None)
+            return
+
+        report = self._block_report()
+        if self._deduplicator is not None:
+            if self._deduplicator.add(self._stack, self._block_line,
+                                      self.error_class, report)\
+            and self._stats is not None:
+                self._stats.blocks_deduplicated += 1
+            return
+
+        write = self._output.write if report is None else report.append
+        if self._error_classes and not self._streaming:
+            write(self._error_class_template.format(self.error_class))
+        lines = self._decode_lines(self._stack) if self._binary else self._stack
+        if report is None:
+            self._output.writelines(lines)
+            self._output.end_block()
+        else:
+            report.extend(lines)
+
+    def _write_deduped_block(self, block):
+        """Prints the :py:class:`unlog.dedupe.DedupedBlock` block after its
+        SEEN line or adds it to its report.
+        """
+        report = block.report
+        write = self._output.write if report is None else report.append
+        if block.error_class is not None:
+            write(self._error_class_template.format(block.error_class))
+        write(self._dedupe_template.format(block.count, block.first_line,
+                                           block.last_line))
+        lines = self._decode_lines(block.lines) if self._binary else block.lines
+        if report is None:
+            self._output.writelines(lines)
+        else:
+            report.extend(lines)
+
+    def flush_output(self):
+        """Write the output waiting in the buffer to stdout."""
+        self._output.flush()
 
     def match(self):
         """Returns True if at least a line of the stack matche the error pattern.
+
+        The lines are checked when they are added to the stack by
+        :py:meth:`process_line`.
+        """
+        return self._stack_matches
+
+    def _reset_stack(self):
+        """Empty the stack to start a new block."""
+        self._stack.clear()
+        self._stack_matches = False
+        self._stack_class = 0
+        self._streaming = False
+
+    def _start_block(self, after_line):
+        """Empty the stack for the block starting with the current line or,
+        if *after_line* is True, after it.
         """
-        for line in self._stack:
-            if self._error_pattern.search(line):
-                return True
+        self._count_block()
+        self._reset_stack()
+        self._blocks_started += 1
+        self._block_starts_after_line = after_line
+        self._block_line = self._line_number + after_line
+
+    def _count_block(self):
+        """Count the current block in the error class counts if it matches
+        and in the stats if it isn't empty.
+        """
+        if self._stack_matches and self._error_classes:
+            self._error_class_counts[self.error_class] += 1
+            if self._stats is not None:
+                self._stats.count_error_class(self.error_class)
+        if self._stats is not None and (self._stack or self._stack_matches):
+            self._stats.blocks_seen += 1
+            if self._stack_matches:
+                self._stats.blocks_matched += 1
+
+    def _output_line(self, line):
+        """Prints the line to stdout or add it to the report.
+        """
+        if self._binary:
+            line = self._decode(line)
+        report = self._block_report()
+        if report is None:
+            self._output.write(line)
+        else:
+            report.append(line)
+
+    def _block_report(self):
+        """Returns the report to which the current block must be added or
+        None if it must be printed.
+        """
+        if self._error_class_reports:
+            report = self._error_class_reports.get(self.error_class)
+            if report is not None:
+                return report
+        return None if self._must_display_sdout() else self._report
+
+    def _clear_reports(self):
+        """Remove all the lines of the reports."""
+        self._report.clear()
+        for report in self._error_class_reports.values():
+            report.clear()
 
     def _must_display_sdout(self):
         """Returns True must the output must be displayed on stdout.
         """
         return self._no_mail or self._mail_to is None
 
+    @property
+    def mails_reports(self):
+        """True if reports are sent by email instead of being printed."""
+        return not self._must_display_sdout() or bool(self._error_class_mail_to)
+
+    def set_mail_sender(self, mail_sender):
+        """Send the emails with the :py:class:`unlog.mail.MailSender`
+        mail_sender instead of sending them before returning.
+        """
+        self._mail_sender = mail_sender
+
+    def set_mail_digest(self, mail_digest, report_title=None):
+        """Add the reports to mail_digest instead of sending them.
+
+        **PARAMETERS**
+
+        * *mail_digest* - The :py:class:`unlog.mail.Digest` that will send the
+          reports.
+        * *report_title* - The name of what is processed, written before the
+          report in the digest. Default: None.
+        """
+        self._mail_digest = mail_digest
+        self._report_title = report_title
+
     def send_mail(self):
         """Send the msg using the localhost as SMTP server. If no SMTP server is
-        available on localhost, it will crash.
+        available on localhost, it will crash. The reports of the error classes
+        are sent to their own address with the class in the subject.
+
+        If a digest is used, the reports are added to it instead.
         """
         if self._must_send_email():
-            msg = self._prepare_message()
+            self._send_report(self._report, self._mail_to, self._mail_subject)
+        for name, report in self._error_class_reports.items():
+            if report:
+                self._send_report(report, self._error_class_mail_to[name],
+                                  self._error_class_subject_template.format(
+                                      self._mail_subject, name))
+
+    def _send_report(self, report, mail_to, subject):
+        """Send report to mail_to, measuring it if stats are used."""
+        if self._stats is not None:
+            previous = self._stats.switch('mail')
+            try:
+                self._send_mail(report, mail_to, subject)
+            finally:
+                self._stats.switch(previous)
+            self._stats.lines_emitted += report.line_count
+        else:
+            self._send_mail(report, mail_to, subject)
+
+    def _send_mail(self, report, mail_to, subject):
+        if self._mail_digest is not None:
+            self._mail_digest.add(report, self._report_title, mail_to,
+                                  self._mail_from, subject, self._mail_server,
+                                  self._mail_max_size)
+        else:
+            msg = self._prepare_message(report, mail_to, subject)
             self._send_message(msg)
+            if self._stats is not None:
+                self._stats.mails_sent += 1
 
     def _must_send_email(self):
         """Returns True if the output must be send by email.
 
         If there is no data to unlog, no email is send.
         """
-        self._filter_mail_lines()
-        return not self._must_display_sdout() and self._mail_lines
-
-    def _filter_mail_lines(self):
-        """Remove the start and end group lines if the group is empty."""
-        # Remove the dict from the templates to use startwith.
-        start_group = self._start_group_template[:-3]
-        end_group = self._end_group_template[:-4]
-        for index in range(len(self._mail_lines) - 1):
-            if self._mail_lines[index].startswith(start_group) and\
-            self._mail_lines[index + 1].startswith(end_group):
-                self._mail_lines[index] = ''
-                self._mail_lines[index + 1] = ''
-        self._remove_empty_string_in_mail_lines()
-
-    def _remove_empty_string_in_mail_lines(self):
-        self._mail_lines = [line for line in self._mail_lines if line]
+        return not self._must_display_sdout() and bool(self._report)
 
-    def _prepare_message(self):
-        """Prepare the _stack so it can be send by email.
+    def _prepare_message(self, report, mail_to, subject):
+        """Prepare the report so it can be send by email.
 
-        **RETURN** - a MIMEText containing the message.
+        **RETURN** - a MIMEText containing the message or, if the report is too
+        big, a multipart message with the start of the report and the whole
+        report compressed as attachment.
         """
-        msg = MIMEText(''.join(self._mail_lines))
-        msg['Subject'] = self._mail_subject
-        msg['From'] = self._mail_from
-        msg['To'] = self._mail_to
-
-        return msg
+        try:
+            from mail import prepare_message
+        except ImportError:
+            from unlog.mail import prepare_message
+        return prepare_message(report, subject, self._mail_from, mail_to,
+                               self._mail_max_size)
 
     def _send_message(self, msg):
         """Send a MIMEText message or print an error to stderr in case of failure.
         """
+        if self._mail_sender is not None:
+            self._mail_sender.send([msg], self._mail_server)
+            return
         try:
-            if self._mail_server.endswith('/sendmail'):
-                # Use sendmail instead of an SMTP server
-                p = Popen(["/usr/sbin/sendmail", "-t", "-oi"], stdin=PIPE)
-                p.communicate(msg.as_string())
-            else:
-                s = smtplib.SMTP(self._mail_server)
-                err = s.send_message(msg)
-                if err:
-                    print(err)
-                s.quit()
-        except Exception as e:
-            sys.stderr.write('Sending email failed with the following message:\n')
-            sys.stderr.write(str(e))
-            sys.stderr.write('\n')
-            sys.stderr.write('DEBUG: Message content:\n\n{}'.format(str(msg)))
+            from mail import send_message
+        except ImportError:
+            from unlog.mail import send_message
+        send_message(msg, self._mail_server)
 
     def _must_ignore_line(self, line):
         """Returns True if the line must not be appended to the _stack.
@@ -190,10 +931,26 @@ class Filter:
         displays it.
         """
         if self._has_group_patterns() and self._end_group_pattern.match(line):
-            end_group_message = self._end_group_template.format(self._group_message)
-            self.print_stack()
-            self._stack = []
-            if self._must_display_sdout():
-                sys.stdout.write(end_group_message)
-            else:
-                self._mail_lines.append(end_group_message)
+            self._end_group()
+
+    def end_group(self):
+        """End the current group, like a line matching the end group pattern
+        does.
+        """
+        self._end_group()
+
+    def _end_group(self):
+        """Prints the stack and displays the END GROUP line.
+        """
+        end_group_message = self._end_group_template.format(self._group_message)
+        self.print_stack()
+        self._start_block(after_line=True)
+        self._in_group = False
+        if self._block_handler is not None or self._deduplicator is not None:
+            return
+        elif self._must_display_sdout():
+            self._output.write(end_group_message)
+        else:
+            self._report.append_group_end(end_group_message)
+        for report in self._error_class_reports.values():
+            report.append_group_end(end_group_message)
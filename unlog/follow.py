@@ -0,0 +1,158 @@
+import os
+import signal
+import sys
+import time
+
+try:
+    from reader import LineReader
+except ImportError:
+    from unlog.reader import LineReader
+
+
+class FollowedFile:
+    """A file read as it grows, like ``tail -F`` does.
+
+    The new lines are given to a :py:class:`unlog.filter.Filter` which keeps
+    its state between reads. If the file is replaced (its inode changes) the
+    end of the old file is read before reopening the file from the start. If
+    it is truncated, it is read again from the start.
+    """
+    #: Number of bytes read at once.
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, file_name, output_filter, log_encoding='utf-8'):
+        """**PARAMETERS**
+
+        * *file_name* - The path of the file to follow.
+        * *output_filter* - The :py:class:`unlog.filter.Filter` to feed.
+        * *log_encoding* - The encoding of the file if the filter doesn't work
+          on bytes. Default: 'utf-8'.
+        """
+        self._file_name = file_name
+        self._filter = output_filter
+        self._line_reader = LineReader(output_filter.binary, log_encoding)
+        self._file = None
+        self._position = 0
+        self._open()
+
+    def _open(self):
+        """Open the file if it exists. Returns True on success."""
+        try:
+            self._file = open(self._file_name, 'rb')
+        except IOError:
+            self._file = None
+            return False
+        self._position = 0
+        self._line_reader.reset()
+        return True
+
+    def read(self):
+        """Give all the complete lines written since the last call to the
+        filter. Returns True if data was read.
+        """
+        if self._file is None:
+            return False
+
+        has_read = False
+        chunks = iter(lambda: self._file.read(self.READ_SIZE), b'')
+        if self._filter.stats is not None:
+            chunks = self._filter.stats.iter_timed(chunks)
+        for data in chunks:
+            has_read = True
+            self._position += len(data)
+            for line in self._line_reader.feed(data):
+                self._filter.process_line(line)
+        return has_read
+
+    def check_rotation(self):
+        """Reopen the file if it was replaced or truncated."""
+        try:
+            file_stat = os.stat(self._file_name)
+        except OSError:
+            # The file was moved and not recreated yet: keep the old one.
+            return
+
+        if self._file is None:
+            self._open()
+            return
+
+        opened_stat = os.fstat(self._file.fileno())
+        if (file_stat.st_ino, file_stat.st_dev)\
+        != (opened_stat.st_ino, opened_stat.st_dev):
+            self.read()
+            self._process_pending()
+            self._file.close()
+            self._open()
+        elif file_stat.st_size < self._position:
+            self._file.seek(0)
+            self._position = 0
+            self._line_reader.reset()
+
+    def _process_pending(self):
+        """Give the incomplete last line to the filter."""
+        for line in self._line_reader.finish():
+            self._filter.process_line(line)
+
+    def flush(self):
+        """Output the current block if it is known to contain an error."""
+        self._filter.flush()
+
+    def close(self):
+        """Process what remains and close the file."""
+        if self._file is not None:
+            self.read()
+            self._process_pending()
+            self._file.close()
+            self._file = None
+        self._filter.finish()
+
+
+class Follower:
+    """Follows several files until interrupted with Ctrl-C."""
+
+    def __init__(self, followed_files, interval=1, idle_timeout=5):
+        """**PARAMETERS**
+
+        * *followed_files* - The list of :py:class:`FollowedFile` to follow.
+        * *interval* - The number of seconds to wait when no file has new data.
+          Default: 1.
+        * *idle_timeout* - The number of seconds without new data after which
+          the current blocks are flushed. Default: 5.
+        """
+        self._followed_files = followed_files
+        self._interval = interval
+        self._idle_timeout = idle_timeout
+
+    def follow(self):
+        """Read the files until interrupted by Ctrl-C or SIGTERM."""
+        signal.signal(signal.SIGTERM, _interrupt)
+        last_read = time.monotonic()
+        flushed = False
+        try:
+            while True:
+                has_read = False
+                for followed_file in self._followed_files:
+                    has_read = followed_file.read() or has_read
+                    followed_file.check_rotation()
+
+                now = time.monotonic()
+                if has_read:
+                    last_read = now
+                    flushed = False
+                elif not flushed and now - last_read >= self._idle_timeout:
+                    for followed_file in self._followed_files:
+                        followed_file.flush()
+                    flushed = True
+                else:
+                    time.sleep(self._interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for followed_file in self._followed_files:
+                followed_file.close()
+            sys.stdout.flush()
+
+
+def _interrupt(signum, frame):
+    """Stop following the files like Ctrl-C does."""
+    raise KeyboardInterrupt()
@@ -0,0 +1,311 @@
+"""Builds and sends the email reports. This module is only imported when a
+report must be sent so that the mail machinery isn't loaded when the output is
+printed.
+"""
+import email
+import gzip
+import io
+import json
+import os
+import queue
+import sys
+import smtplib
+import threading
+import time
+import uuid
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from subprocess import Popen, PIPE
+
+try:
+    from report import MailReport
+except ImportError:
+    from unlog.report import MailReport
+
+#: Default maximum number of characters of the report put in the body.
+MAIL_MAX_SIZE = 1024 * 1024
+#: Added to the body of the email when the report is truncated. It will be
+#: filled with the number of lines and characters of the whole report.
+_truncated_template = '\n[... The report is truncated. The whole report ({} ' \
+    'lines, {} characters) is attached. ...]\n'
+#: Name of the attached report.
+REPORT_FILE_NAME = 'unlog-report.txt.gz'
+
+
+def prepare_message(report, mail_subject, mail_from, mail_to,
+                    mail_max_size=None):
+    """Prepare the report so it can be send by email.
+
+    **PARAMETERS**
+
+    * *report* - The :py:class:`unlog.report.MailReport` to send.
+    * *mail_subject*, *mail_from*, *mail_to* - The headers of the message.
+    * *mail_max_size* - The maximum number of characters of the report put in
+      the body. Beyond it, the body only contains the first lines of the
+      report and the whole report is attached compressed with gzip. Default:
+      :py:data:`MAIL_MAX_SIZE`.
+
+    **RETURN** - a MIMEText containing the message or a MIMEMultipart if the
+    report is too big.
+    """
+    mail_max_size = mail_max_size or MAIL_MAX_SIZE
+    if report.size <= mail_max_size:
+        msg = MIMEText(''.join(report))
+    else:
+        msg = MIMEMultipart()
+        msg.attach(MIMEText(_truncated_body(report, mail_max_size)))
+        attachment = MIMEApplication(_compress(report), 'gzip')
+        attachment.add_header('Content-Disposition', 'attachment',
+                              filename=REPORT_FILE_NAME)
+        msg.attach(attachment)
+    msg['Subject'] = mail_subject
+    msg['From'] = mail_from
+    msg['To'] = mail_to
+
+    return msg
+
+
+def _truncated_body(report, mail_max_size):
+    """Returns the first lines of the report that fit in mail_max_size
+    characters followed by a summary of the report.
+    """
+    lines = []
+    size = 0
+    for line in report:
+        size += len(line)
+        if size > mail_max_size:
+            break
+        lines.append(line)
+    lines.append(_truncated_template.format(report.line_count, report.size))
+    return ''.join(lines)
+
+
+def _compress(report):
+    """Returns the report encoded in UTF-8 and compressed with gzip."""
+    compressed = io.BytesIO()
+    with gzip.GzipFile(fileobj=compressed, mode='wb') as gzip_file:
+        text = io.TextIOWrapper(gzip_file, encoding='utf-8',
+                                errors='backslashreplace', newline='\n')
+        text.writelines(report)
+        text.flush()
+        text.detach()
+    return compressed.getvalue()
+
+
+def send_message(msg, mail_server):
+    """Send a MIMEText message or print an error to stderr in case of failure.
+    """
+    report_failures(send_messages([msg], mail_server))
+
+
+def send_messages(msgs, mail_server):
+    """Send messages over a single connection to the SMTP server, or with
+    sendmail.
+
+    **RETURN** - the list of the tuples containing a message that couldn't be
+    sent and the exception raised.
+    """
+    failures = []
+    if mail_server.endswith('/sendmail'):
+        for msg in msgs:
+            try:
+                # Use sendmail instead of an SMTP server
+                p = Popen(["/usr/sbin/sendmail", "-t", "-oi"], stdin=PIPE)
+                p.communicate(msg.as_bytes())
+            except Exception as e:
+                failures.append((msg, e))
+        return failures
+
+    try:
+        s = smtplib.SMTP(mail_server)
+    except Exception as e:
+        return [(msg, e) for msg in msgs]
+    try:
+        for msg in msgs:
+            try:
+                err = s.send_message(msg)
+                if err:
+                    print(err)
+            except Exception as e:
+                failures.append((msg, e))
+    finally:
+        try:
+            s.quit()
+        except Exception:
+            pass
+    return failures
+
+
+def report_failures(failures):
+    """Print the errors and the messages that couldn't be sent to stderr."""
+    for msg, e in failures:
+        sys.stderr.write('Sending email failed with the following message:\n')
+        sys.stderr.write(str(e))
+        sys.stderr.write('\n')
+        sys.stderr.write('DEBUG: Message content:\n\n{}'.format(str(msg)))
+
+
+class MailQueue:
+    """A directory holding the messages that couldn't be sent so they can be
+    sent later by :py:meth:`flush`.
+
+    Each message is stored in a JSON file with the SMTP server to use, the
+    number of failed attempts and the time of the next attempt. The delay
+    between two attempts doubles after each failure, from
+    :py:attr:`RETRY_DELAY` to :py:attr:`MAX_RETRY_DELAY` seconds.
+    """
+    #: Number of seconds to wait after the first failed retry.
+    RETRY_DELAY = 60
+    #: Maximum number of seconds between two attempts.
+    MAX_RETRY_DELAY = 24 * 60 * 60
+
+    def __init__(self, directory):
+        """**PARAMETERS**
+
+        * *directory* - The directory holding the messages. It is created if
+          needed.
+        """
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, msg, mail_server, attempts=0, file_name=None):
+        """Store a message that couldn't be sent. It will be sent by the next
+        :py:meth:`flush` if it is its first failure.
+        """
+        delay = 0
+        if attempts:
+            delay = min(self.RETRY_DELAY * 2 ** (attempts - 1),
+                        self.MAX_RETRY_DELAY)
+        if file_name is None:
+            file_name = '{:.6f}-{}.json'.format(time.time(), uuid.uuid4().hex)
+        queued = {'mail_server': mail_server,
+                  'attempts': attempts,
+                  'next_attempt': time.time() + delay,
+                  'message': msg.as_string()}
+        path = os.path.join(self._directory, file_name)
+        with open(path + '.tmp', 'w', encoding='utf-8') as queue_file:
+            json.dump(queued, queue_file)
+        os.replace(path + '.tmp', path)
+
+    def flush(self):
+        """Try to send the messages whose next attempt is due. The messages
+        that are sent are removed from the queue.
+        """
+        now = time.time()
+        due = {}
+        for file_name in sorted(os.listdir(self._directory)):
+            if not file_name.endswith('.json'):
+                continue
+            path = os.path.join(self._directory, file_name)
+            try:
+                with open(path, 'r', encoding='utf-8') as queue_file:
+                    queued = json.load(queue_file)
+            except (IOError, ValueError) as e:
+                sys.stderr.write('Cannot read the queued message {}: {}\n'
+                                 .format(path, e))
+                continue
+            if queued['next_attempt'] <= now:
+                msg = email.message_from_string(queued['message'])
+                due.setdefault(queued['mail_server'], []).append(
+                    (file_name, msg, queued['attempts']))
+
+        for mail_server, queued_msgs in due.items():
+            failed = {id(msg) for msg, _ in send_messages(
+                [msg for _, msg, _ in queued_msgs], mail_server)}
+            for file_name, msg, attempts in queued_msgs:
+                if id(msg) in failed:
+                    self.put(msg, mail_server, attempts + 1, file_name)
+                else:
+                    os.unlink(os.path.join(self._directory, file_name))
+
+
+class MailSender:
+    """Sends the messages in a background thread so the processing of the logs
+    doesn't wait for the mail server.
+
+    The messages that couldn't be sent are put in the :py:class:`MailQueue` if
+    one is given and printed on stderr otherwise.
+    """
+
+    def __init__(self, mail_queue=None):
+        """**PARAMETERS**
+
+        * *mail_queue* - The :py:class:`MailQueue` keeping the messages that
+          couldn't be sent. Default: None.
+        """
+        self._mail_queue = mail_queue
+        self._messages = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def send(self, msgs, mail_server):
+        """Send the messages with mail_server in the background."""
+        self._messages.put((msgs, mail_server))
+
+    def _run(self):
+        for msgs, mail_server in iter(self._messages.get, None):
+            failures = send_messages(msgs, mail_server)
+            if self._mail_queue is None:
+                report_failures(failures)
+                continue
+            for msg, e in failures:
+                try:
+                    self._mail_queue.put(msg, mail_server)
+                except IOError:
+                    report_failures([(msg, e)])
+
+    def close(self):
+        """Wait until all the messages are sent."""
+        self._messages.put(None)
+        self._thread.join()
+
+
+class Digest:
+    """Collects the reports of a run and sends them at its end.
+
+    The reports with the same recipient, sender and subject are sent in a
+    single email, the report of each file starting with a FILE line. The
+    emails sent with the same SMTP server are sent over a single connection.
+    """
+    #: This template will be filled by the title of the report.
+    _title_template = 'FILE: {}\n'
+
+    def __init__(self):
+        # The digests in the order of their first report, by server and
+        # headers.
+        self._digests = {}
+
+    def add(self, report, title, mail_to, mail_from, mail_subject,
+            mail_server, mail_max_size=None):
+        """Add a copy of the lines of the :py:class:`unlog.report.MailReport`
+        report to the digest of its recipient, sender and subject.
+        """
+        key = (mail_server, mail_to, mail_from, mail_subject)
+        if key not in self._digests:
+            self._digests[key] = (MailReport(), mail_max_size)
+        digest_report = self._digests[key][0]
+        if title is not None:
+            digest_report.append(self._title_template.format(title))
+        digest_report.extend(report)
+
+    def send(self, mail_sender=None):
+        """Send the digests, grouped by SMTP server, with the
+        :py:class:`MailSender` mail_sender or right now if it is None.
+
+        **RETURN** - the number of emails sent.
+        """
+        msgs_by_server = {}
+        for key, (report, mail_max_size) in self._digests.items():
+            mail_server, mail_to, mail_from, mail_subject = key
+            msg = prepare_message(report, mail_subject, mail_from, mail_to,
+                                  mail_max_size)
+            msgs_by_server.setdefault(mail_server, []).append(msg)
+            report.clear()
+        self._digests.clear()
+        for mail_server, msgs in msgs_by_server.items():
+            if mail_sender is not None:
+                mail_sender.send(msgs, mail_server)
+            else:
+                report_failures(send_messages(msgs, mail_server))
+        return sum(len(msgs) for msgs in msgs_by_server.values())
@@ -2,14 +2,25 @@
 
 """
 usage: main.py [-h] [--start-pattern START_PATTERN]
-               [--error-pattern ERROR_PATTERN] [--config CONFIG_FILE]
+               [--error-pattern ERROR_PATTERN]
+               [--error-class NAME PATTERN] [--config CONFIG_FILE]
                [--use-config-section USE_CONFIG_SECTION] [--mail-to MAIL_TO]
                [--mail-from MAIL_FROM] [--mail-subject MAIL_SUBJECT]
-               [--mail-server SMTP_SERVER]
+               [--mail-server SMTP_SERVER] [--mail-max-size MAIL_MAX_SIZE]
                [--no-mail] [--start-group START_GROUP_PATTERN]
                [--end-group END_GROUP_PATTERN]
-               [--encoding ENCODING]
-               [files [files ...]]
+               [--encoding ENCODING] [--stream]
+               [--block-memory-limit BLOCK_MEMORY_LIMIT]
+               [--block-head BLOCK_HEAD] [--block-tail BLOCK_TAIL]
+               [--binary] [--decode-errors DECODE_ERRORS]
+               [--dedupe] [--dedupe-mask DEDUPE_MASK]
+               [--dedupe-size DEDUPE_SIZE] [--no-scan]
+               [--jobs JOBS] [--split-size SPLIT_SIZE]
+               [--follow] [--follow-interval FOLLOW_INTERVAL]
+               [--idle-timeout IDLE_TIMEOUT] [--state STATE] [--digest]
+               [--mail-queue MAIL_QUEUE] [--flush-mail-queue] [--stats]
+               [--stats-file STATS_FILE] [--command COMMAND]
+               [files [files ...]] [--exec COMMAND [ARGS ...]]
 
 Filter print the line of the output from a starting pattern only if it
 contains an error pattern.
@@ -25,11 +36,18 @@ optional arguments:
   --error-pattern ERROR_PATTERN, -e ERROR_PATTERN
                         The error pattern. Only group of lines containing this
                         pattern will be printed
+  --error-class NAME PATTERN
+                        A class of errors and the pattern of its lines, to
+                        give instead of the error pattern. Can be given
+                        several times, from the most to the least severe
+                        class. Each block is tagged with the most severe
+                        class matched by its lines.
   --config CONFIG_FILE, -c CONFIG_FILE
                         Use a different config file from ~/.unlog
   --use-config-section USE_CONFIG_SECTION, -u USE_CONFIG_SECTION
                         Unlog will use the provided config section to process
-                        the file or stdin.
+                        the file or stdin. Several sections separated by
+                        commas are applied to the input read once.
   --mail-to MAIL_TO, -t MAIL_TO
                         Send the report by email to the provided address
                         instead of printing the result to the command line. If
@@ -44,6 +62,10 @@ optional arguments:
   --mail-server
                         The SMTP server to use. Can also be sendmail. Default is
                         localhost.
+  --mail-max-size MAIL_MAX_SIZE
+                        The maximum number of characters of the report in the
+                        body of the email. A bigger report is truncated and
+                        attached compressed with gzip. Default is 1 MiB.
   --no-mail             Print the output to stdout, even if a mail address is
                         provided.
   --start-group START_GROUP_PATTERN
@@ -53,6 +75,83 @@ optional arguments:
                         will be ignored.
   --encoding ENCODING
                         The encoding of the file to unlog. By default it is UTF-8.
+  --stream              Output the lines of a block as soon as it is known to
+                        contain an error instead of waiting for its end.
+  --block-memory-limit BLOCK_MEMORY_LIMIT
+                        The number of characters of a block to keep in memory.
+                        Bigger blocks are stored in a temporary file.
+  --block-head BLOCK_HEAD
+                        Only keep this number of lines at the start of a
+                        block.
+  --block-tail BLOCK_TAIL
+                        Only keep this number of lines at the end of a block.
+  --binary              Match the patterns on the raw bytes of the log and only
+                        decode the lines that are output.
+  --decode-errors DECODE_ERRORS
+                        How to handle the invalid characters of the output
+                        lines in binary mode: strict, replace, ignore or
+                        backslashreplace. Default is replace.
+  --dedupe              Output each distinct block once, at the end of the
+                        input, with its number of occurrences and the lines
+                        where the first and the last ones start. The blocks
+                        are compared once the parts matching the dedupe masks
+                        are ignored. The groups are not output.
+  --dedupe-mask DEDUPE_MASK
+                        A pattern matching a part of the blocks that doesn't
+                        make them different. Can be given several times.
+                        Default is the dates, times, UUIDs, hexadecimal
+                        identifiers, paths and numbers.
+  --dedupe-size DEDUPE_SIZE
+                        The number of distinct blocks kept in memory. Beyond
+                        it, the least recently seen block is output. Default
+                        is 1000.
+  --no-scan             Read the files line by line instead of searching the
+                        errors in the whole file first.
+  --jobs JOBS, -j JOBS
+                        The number of files to process in parallel. The output
+                        is still in the order of the files. Default is 1.
+  --split-size SPLIT_SIZE
+                        With several jobs, files bigger than this number of
+                        bytes are split in parts of this size processed in
+                        parallel. Default is 64 MiB.
+  --follow, -F          Keep reading the files as they grow, like tail -F,
+                        until interrupted.
+  --follow-interval FOLLOW_INTERVAL
+                        The number of seconds to wait for new data when
+                        following files. Default is 1.
+  --idle-timeout IDLE_TIMEOUT
+                        When following files, output the current block if it
+                        contains an error after this number of seconds
+                        without new data. Default is 5.
+  --state STATE         Record in this file where the processing of each file
+                        stopped so the next run only reads the new lines. The
+                        last block of a file is output by the run that sees
+                        its end.
+  --digest              Send the reports at the end of the run: the reports
+                        with the same recipient, sender and subject are sent
+                        in a single email.
+  --mail-queue MAIL_QUEUE
+                        Keep the emails that couldn't be sent in this
+                        directory instead of printing them on stderr.
+  --flush-mail-queue    Try to send the emails kept in the directory given by
+                        --mail-queue before processing the files, if any.
+  --stats               Print on stderr at exit what was read and output and
+                        the time spent in each pattern and phase. The files
+                        are then processed one after the other.
+  --stats-file STATS_FILE
+                        Write the stats to this file in the Prometheus text
+                        format, eg for the textfile collector of the node
+                        exporter.
+  --command COMMAND     Run this command with the shell and filter its
+                        output instead of reading stdin. Can be given several
+                        times to run several commands concurrently.
+  --exec COMMAND [ARGS ...]
+                        Run this command without shell. Everything after
+                        --exec is the command and its arguments, so it must
+                        be the last option.
+
+The output of each command is filtered in a group named after it and unlog
+exits with the exit code of the first command that failed.
 """
 
 import argparse
@@ -75,11 +174,20 @@ def main():
                         default=r'(error|warning)',
                         help='The error pattern. Only group of lines containing '
                         'this pattern will be printed')
+    parser.add_argument('--error-class', dest='error_classes', nargs=2,
+                        action='append', metavar=('NAME', 'PATTERN'),
+                        help='A class of errors and the pattern of its lines, '
+                        'to give instead of the error pattern. Can be given '
+                        'several times, from the most to the least severe '
+                        'class. Each block is tagged with the most severe '
+                        'class matched by its lines.')
     parser.add_argument('--config', '-c', dest='config_file', default='~/.unlog',
                         help='Use a different config file from ~/.unlog')
     parser.add_argument('--use-config-section', '-u', dest='use_config_section',
                         help='Unlog will use the provided config section to '
-                        'process the file or stdin.')
+                        'process the file or stdin. Several sections '
+                        'separated by commas are applied to the input read '
+                        'once.')
     parser.add_argument('--mail-to', '-t', dest='mail_to',
                         help='Send the report by email to the provided address '
                         'instead of printing the result to the command line. If'
@@ -95,6 +203,10 @@ def main():
     parser.add_argument('--mail-server', dest='mail_server', default='localhost',
                         help='The SMTP server to use. Can also be sendmail.'
                         ' Default is localhost.')
+    parser.add_argument('--mail-max-size', dest='mail_max_size', type=int,
+                        help='The maximum number of characters of the report in'
+                        ' the body of the email. A bigger report is truncated '
+                        'and attached compressed with gzip. Default is 1 MiB.')
     parser.add_argument('--no-mail', dest='no_mail', action='store_true',
                         help='Print the output to stdout, even if a mail address'
                         ' is provided.')
@@ -105,7 +217,104 @@ def main():
                         'pattern will be ignored.')
     parser.add_argument('--encoding', dest='log_encoding', default='utf-8',
                         help='The encoding of the file to unlog')
+    parser.add_argument('--stream', dest='stream', action='store_true',
+                        default=None,
+                        help='Output the lines of a block as soon as it is known'
+                        ' to contain an error instead of waiting for its end.')
+    parser.add_argument('--block-memory-limit', dest='block_memory_limit',
+                        type=int,
+                        help='The number of characters of a block to keep in '
+                        'memory. Bigger blocks are stored in a temporary file.')
+    parser.add_argument('--block-head', dest='block_head', type=int,
+                        help='Only keep this number of lines at the start of a '
+                        'block.')
+    parser.add_argument('--block-tail', dest='block_tail', type=int,
+                        help='Only keep this number of lines at the end of a '
+                        'block.')
+    parser.add_argument('--binary', dest='binary', action='store_true',
+                        default=None,
+                        help='Match the patterns on the raw bytes of the log and'
+                        ' only decode the lines that are output.')
+    parser.add_argument('--decode-errors', dest='decode_errors',
+                        help='How to handle the invalid characters of the output'
+                        ' lines in binary mode: strict, replace, ignore or '
+                        'backslashreplace. Default is replace.')
+    parser.add_argument('--dedupe', dest='dedupe', action='store_true',
+                        default=None,
+                        help='Output each distinct block once, at the end of '
+                        'the input, with its number of occurrences and the '
+                        'lines where the first and the last ones start. The '
+                        'blocks are compared once the parts matching the '
+                        'dedupe masks are ignored. The groups are not output.')
+    parser.add_argument('--dedupe-mask', dest='dedupe_masks', action='append',
+                        help='A pattern matching a part of the blocks that '
+                        'doesn\'t make them different. Can be given several '
+                        'times. Default is the dates, times, UUIDs, '
+                        'hexadecimal identifiers, paths and numbers.')
+    parser.add_argument('--dedupe-size', dest='dedupe_size', type=int,
+                        help='The number of distinct blocks kept in memory. '
+                        'Beyond it, the least recently seen block is output. '
+                        'Default is 1000.')
+    parser.add_argument('--no-scan', dest='scan', action='store_false',
+                        help='Read the files line by line instead of searching '
+                        'the errors in the whole file first.')
+    parser.add_argument('--jobs', '-j', dest='jobs', type=int, default=1,
+                        help='The number of files to process in parallel. The '
+                        'output is still in the order of the files. Default is '
+                        '1.')
+    parser.add_argument('--split-size', dest='split_size', type=int,
+                        help='With several jobs, files bigger than this number '
+                        'of bytes are split in parts of this size processed in '
+                        'parallel. Default is 64 MiB.')
+    parser.add_argument('--follow', '-F', dest='follow', action='store_true',
+                        help='Keep reading the files as they grow, like tail '
+                        '-F, until interrupted.')
+    parser.add_argument('--follow-interval', dest='follow_interval', type=float,
+                        default=1,
+                        help='The number of seconds to wait for new data when '
+                        'following files. Default is 1.')
+    parser.add_argument('--idle-timeout', dest='idle_timeout', type=float,
+                        default=5,
+                        help='When following files, output the current block if'
+                        ' it contains an error after this number of seconds '
+                        'without new data. Default is 5.')
+    parser.add_argument('--state', dest='state',
+                        help='Record in this file where the processing of each'
+                        ' file stopped so the next run only reads the new '
+                        'lines. The last block of a file is output by the run '
+                        'that sees its end.')
+    parser.add_argument('--digest', dest='digest', action='store_true',
+                        help='Send the reports at the end of the run: the '
+                        'reports with the same recipient, sender and subject '
+                        'are sent in a single email.')
+    parser.add_argument('--mail-queue', dest='mail_queue',
+                        help='Keep the emails that couldn\'t be sent in this '
+                        'directory instead of printing them on stderr.')
+    parser.add_argument('--flush-mail-queue', dest='flush_mail_queue',
+                        action='store_true',
+                        help='Try to send the emails kept in the directory '
+                        'given by --mail-queue before processing the files, if '
+                        'any.')
+    parser.add_argument('--stats', dest='stats', action='store_true',
+                        help='Print on stderr at exit what was read and output '
+                        'and the time spent in each pattern and phase. The '
+                        'files are then processed one after the other.')
+    parser.add_argument('--stats-file', dest='stats_file',
+                        help='Write the stats to this file in the Prometheus '
+                        'text format, eg for the textfile collector of the '
+                        'node exporter.')
+    parser.add_argument('--command', dest='commands', action='append',
+                        help='Run this command with the shell and filter its '
+                        'output instead of reading stdin. Can be given several '
+                        'times to run several commands concurrently.')
+    parser.add_argument('--exec', dest='commands', action='append',
+                        nargs=argparse.REMAINDER,
+                        help='Run this command without shell. Everything after '
+                        '--exec is the command and its arguments, so it must be '
+                        'the last option.')
     args = parser.parse_args()
+    if args.commands and [] in args.commands:
+        parser.error('--exec requires a command')
 
     Unlog(args)
 
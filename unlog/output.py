@@ -0,0 +1,100 @@
+import sys
+import time
+
+
+class OutputSink:
+    """Batches the text written to stdout, or to *stream* if given.
+
+    The text is kept in a buffer and written to stdout at once when the buffer
+    exceeds *buffer_size* characters, when text is added *flush_interval*
+    seconds after the last write to stdout, when a block ends and stdout is a
+    terminal or when :py:meth:`flush` is called.
+    ``sys.stdout`` is looked up when the buffer is written so a redirection of
+    stdout applies to the text already buffered.
+    """
+    #: Default number of characters kept before writing them.
+    BUFFER_SIZE = 1024 * 1024
+    #: Default maximum number of seconds the text stays in the buffer.
+    FLUSH_INTERVAL = 1
+
+    def __init__(self, buffer_size=None, flush_interval=None, stream=None):
+        """**PARAMETERS**
+
+        * *buffer_size* - The number of characters kept before writing them.
+          Default: :py:attr:`BUFFER_SIZE`.
+        * *flush_interval* - The number of seconds after which the text is
+          written even if the buffer isn't full. Default:
+          :py:attr:`FLUSH_INTERVAL`.
+        * *stream* - The text file to write to instead of stdout. Default:
+          None.
+        """
+        self._stream = stream
+        self._buffer_size = buffer_size or self.BUFFER_SIZE
+        self._flush_interval = flush_interval or self.FLUSH_INTERVAL
+        self._buffer = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+        self._stats = None
+
+    def set_stats(self, stats):
+        """Count the lines written and the time spent writing them in the
+        :py:class:`unlog.stats.Stats` stats, or stop if it is None.
+        """
+        self._stats = stats
+
+    def write(self, text):
+        """Add text to the buffer."""
+        self._buffer.append(text)
+        self._size += len(text)
+        self._check_flush()
+
+    def writelines(self, lines):
+        """Add each line of the iterable lines to the buffer."""
+        buffer_append = self._buffer.append
+        size = self._size
+        buffer_size = self._buffer_size
+        for line in lines:
+            buffer_append(line)
+            size += len(line)
+            if size >= buffer_size:
+                self._size = size
+                self.flush()
+                size = 0
+        self._size = size
+        self._check_flush()
+
+    def end_block(self):
+        """Called when a whole block was added: write the buffer if the output
+        is a terminal, where it must be seen as soon as it is complete.
+        """
+        if self._buffer and (self._stream or sys.stdout).isatty():
+            self.flush()
+
+    def _check_flush(self):
+        """Write the buffer if it is full or too old."""
+        if self._size >= self._buffer_size\
+        or time.monotonic() - self._last_flush >= self._flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write the buffer to stdout and flush stdout."""
+        if self._stats is not None:
+            previous = self._stats.switch('output')
+            try:
+                self._flush()
+            finally:
+                self._stats.switch(previous)
+        else:
+            self._flush()
+
+    def _flush(self):
+        stream = self._stream or sys.stdout
+        if self._buffer:
+            text = ''.join(self._buffer)
+            stream.write(text)
+            self._buffer.clear()
+            self._size = 0
+            if self._stats is not None:
+                self._stats.lines_emitted += text.count('\n')
+        stream.flush()
+        self._last_flush = time.monotonic()
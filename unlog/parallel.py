@@ -0,0 +1,164 @@
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+
+try:
+    from scanner import Scanner, decode, is_ascii_compatible, split_lines
+except ImportError:
+    from unlog.scanner import Scanner, decode, is_ascii_compatible, split_lines
+
+
+class FileSplitter:
+    """Splits a file in ranges of bytes that can be processed independently by
+    copies of the same :py:class:`unlog.filter.Filter`.
+
+    Each range starts at a line where a new filter is in the same state as a
+    filter that processed all the previous lines: a line matching the start
+    pattern or, if groups are used, a line starting a group right after the end
+    of the previous one. Processing the ranges one after the other thus gives
+    the same output as processing the whole file.
+    """
+    #: Default size of a range in bytes.
+    RANGE_SIZE = 64 * 1024 * 1024
+    #: Number of bytes read at once when reading a range line by line.
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, output_filter, log_encoding='utf-8', range_size=None):
+        """**PARAMETERS**
+
+        * *output_filter* - The :py:class:`unlog.filter.Filter` that will
+          process the ranges.
+        * *log_encoding* - The encoding of the file if the filter doesn't work
+          on bytes. Default: 'utf-8'.
+        * *range_size* - The approximate size of the ranges. Default:
+          :py:attr:`RANGE_SIZE`.
+        """
+        self._binary = output_filter.binary
+        self._log_encoding = log_encoding
+        self._start_search = output_filter.start_pattern.search
+        self._group_patterns = output_filter.group_patterns
+        self._range_size = range_size or self.RANGE_SIZE
+
+    @staticmethod
+    def can_split(output_filter, log_encoding='utf-8'):
+        """Returns True if the lines can be found from any offset of the file,
+        ie if a new line is always the byte \\\\n, and if the blocks aren't
+        deduplicated, which requires to see all of them in one process.
+        """
+        return not output_filter.dedupes\
+            and (output_filter.binary or is_ascii_compatible(log_encoding))
+
+    def split(self, file):
+        """Returns the list of the (start, end) offsets of the ranges of a
+        regular file opened in binary mode.
+        """
+        size = os.fstat(file.fileno()).st_size
+        ranges = []
+        start = 0
+        while start < size:
+            end = self._find_split_point(file, start + self._range_size, size)
+            ranges.append((start, end))
+            start = end
+        return ranges
+
+    def _find_split_point(self, file, position, size):
+        """Returns the offset of the first line starting after position from
+        which a new filter can be used or the size of the file if there is
+        none.
+        """
+        if position >= size:
+            return size
+
+        # Skip the end of the line containing position.
+        file.seek(position - 1)
+        previous_line = None
+        offset = position - 1 + len(file.readline())
+        for line in iter(file.readline, b''):
+            if self._is_split_point(previous_line, line):
+                return offset
+            previous_line = line
+            offset += len(line)
+        return size
+
+    def _is_split_point(self, previous_line, line):
+        """Returns True if a new filter can start at line."""
+        if self._group_patterns is None:
+            return bool(self._start_search(self._text_lines(line)[0]))
+
+        if previous_line is None:
+            return False
+        start_group_pattern, end_group_pattern = self._group_patterns
+        return bool(end_group_pattern.match(self._text_lines(previous_line)[-1])
+                    and start_group_pattern.match(self._text_lines(line)[0]))
+
+    def _text_lines(self, line):
+        """Returns the lines seen by the filter for a line read in binary mode:
+        a line can contain several lines ended by \\\\r in text mode.
+        """
+        if self._binary:
+            return [line]
+        return split_lines(decode(line, self._log_encoding))
+
+    def iter_lines(self, file, start, end):
+        """Yields the lines seen by the filter between the offsets start and end
+        of a file opened in binary mode.
+        """
+        file.seek(start)
+        remaining = end - start
+        carry = b''
+        while remaining > 0:
+            data = carry + file.read(min(self.READ_SIZE, remaining))
+            remaining = end - file.tell()
+            if remaining > 0:
+                lines_end = data.rfind(b'\n') + 1
+                data, carry = data[:lines_end], data[lines_end:]
+            if not self._binary:
+                data = decode(data, self._log_encoding)
+            yield from split_lines(data)
+
+
+def process_file_in_parallel(output_filter, file_name, jobs, log_encoding='utf-8',
+                             scan=True, range_size=None):
+    """Split the file with a :py:class:`FileSplitter` and process each range in
+    a pool of *jobs* processes with a copy of output_filter. The output of the
+    ranges is written in the order of the file and the email report is sent
+    once for the whole file.
+    """
+    splitter = FileSplitter(output_filter, log_encoding, range_size)
+    with open(file_name, 'rb') as file:
+        ranges = splitter.split(file)
+
+    tasks = [(output_filter, splitter, file_name, start, end, log_encoding, scan)
+             for start, end in ranges]
+    with multiprocessing.Pool(jobs) as pool:
+        results = pool.imap(_process_range_job, tasks)
+        for output, mail_lines, error_class_mail_lines in results:
+            sys.stdout.write(output)
+            sys.stdout.flush()
+            output_filter.add_mail_lines(mail_lines)
+            for error_class, lines in error_class_mail_lines.items():
+                output_filter.add_mail_lines(lines, error_class)
+    output_filter.finish()
+
+
+def _process_range_job(task):
+    """Process a range of a file in a worker of the pool used by
+    :py:func:`process_file_in_parallel`.
+
+    **RETURN** - a tuple containing what was written on stdout, the lines
+    to send by email and the ones of the report of each error class.
+    """
+    output_filter, splitter, file_name, start, end, log_encoding, scan = task
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        with open(file_name, 'rb') as file:
+            if scan and Scanner.can_scan(output_filter, log_encoding):
+                Scanner(output_filter, log_encoding).process_range(file, start, end)
+            else:
+                for line in splitter.iter_lines(file, start, end):
+                    output_filter.process_line(line)
+        output_filter.print_stack()
+        output_filter.flush_output()
+    return output.getvalue(), output_filter.mail_lines,\
+        output_filter.error_class_mail_lines
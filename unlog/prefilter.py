@@ -0,0 +1,250 @@
+"""Rejects the lines that cannot match a pattern without evaluating it.
+
+Most patterns can only match a line containing one of a few literal strings:
+``(error|warning)`` needs ``error`` or ``warning`` and a start pattern like
+``/home/assos/drupal7/sites/\\w+`` needs its fixed prefix. Looking for them
+with :py:meth:`str.find` is much faster than evaluating the pattern, above all
+when the case is ignored. The pattern is only evaluated on the lines containing
+one of them, so the results are the same as with the pattern alone.
+"""
+import re
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+
+#: Beyond this number of literals, looking for each of them is slower than
+#: evaluating the pattern.
+MAX_LITERALS = 8
+#: Characters that match an ASCII letter when the case is ignored but whose
+#: lower case isn't the lower case of this letter: U+0131 (dotless i), U+017F
+#: (long s) and the combining dot that U+0130 (dotted I) leaves after i when
+#: lowered. Removing a character can only make more lines look for a match.
+_FOLD_TABLE = {0x131: 'i', 0x17f: 's', 0x307: None}
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+            getattr(sre_constants, 'POSSESSIVE_REPEAT', None))
+
+
+def fold_case(text):
+    """Returns text in lower case, with the characters that the regular
+    expressions consider equal to an ASCII letter when the case is ignored
+    replaced by this letter.
+    """
+    if isinstance(text, bytes) or text.isascii():
+        return text.lower()
+    return text.lower().translate(_FOLD_TABLE)
+
+
+def required_literals(pattern):
+    """Returns a tuple of the strings, or bytes, of which every match of the
+    compiled *pattern* contains at least one, in lower case if the pattern
+    ignores the case. Returns None if no such literals are found.
+    """
+    if pattern.flags & re.LOCALE:
+        return None
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return None
+
+    extractor = _LiteralExtractor(pattern.flags & re.IGNORECASE,
+                                  isinstance(pattern.pattern, bytes))
+    literals = extractor.extract(parsed)
+    if not literals or len(literals) > MAX_LITERALS:
+        return None
+    return tuple(sorted(literals, key=len))
+
+
+class _LiteralExtractor:
+    """Walks a parsed pattern to find the literals of which a match contains
+    at least one.
+    """
+
+    def __init__(self, ignore_case, binary):
+        self._ignore_case = ignore_case
+        self._binary = binary
+
+    def extract(self, items):
+        """Returns the set of literals required by the sequence items or None.
+
+        Each item of the sequence must match, so the literals of any of them
+        will do: the most selective ones are kept.
+        """
+        candidates = []
+        run = []
+        for op, av in items:
+            if op is sre_constants.LITERAL and self._is_safe(av):
+                run.append(av)
+                continue
+            if run:
+                candidates.append({self._to_literal(run)})
+                run = []
+            literals = self._extract_item(op, av)
+            if literals:
+                candidates.append(literals)
+        if run:
+            candidates.append({self._to_literal(run)})
+        if not candidates:
+            return None
+        return max(candidates, key=lambda literals: (
+            min(len(literal) for literal in literals), -len(literals)))
+
+    def _extract_item(self, op, av):
+        if op is sre_constants.SUBPATTERN:
+            add_flags, del_flags, sub_pattern = av[1], av[2], av[3]
+            if (add_flags | del_flags) & (re.IGNORECASE | re.LOCALE):
+                return None
+            return self.extract(sub_pattern)
+        elif op is sre_constants.BRANCH:
+            literals = set()
+            for branch in av[1]:
+                branch_literals = self.extract(branch)
+                if not branch_literals:
+                    return None
+                literals |= branch_literals
+            return literals
+        elif op in _REPEATS:
+            minimum, sub_pattern = av[0], av[2]
+            return self.extract(sub_pattern) if minimum > 0 else None
+        elif op is getattr(sre_constants, 'ATOMIC_GROUP', None):
+            return self.extract(av)
+        return None
+
+    def _is_safe(self, code):
+        """Returns True if a character can be looked for in lines folded with
+        :py:func:`fold_case` when the case is ignored.
+        """
+        return not self._ignore_case or self._binary or code < 128
+
+    def _to_literal(self, codes):
+        if self._binary:
+            literal = bytes(codes)
+        else:
+            literal = ''.join(chr(code) for code in codes)
+        return literal.lower() if self._ignore_case else literal
+
+
+def prefiltered_search(pattern):
+    """Returns a function giving the same result as ``pattern.search(line)``
+    that only evaluates the compiled pattern on the lines containing one of
+    its :py:func:`required_literals`, or ``pattern.search`` if it has none.
+    """
+    search = pattern.search
+    literals = required_literals(pattern)
+    if literals is None:
+        return search
+    elif isinstance(pattern.pattern, bytes):
+        return _bytes_literal_search(search, literals,
+                                     pattern.flags & re.IGNORECASE)
+    elif pattern.flags & re.IGNORECASE:
+        def literal_search(line):
+            folded = fold_case(line)
+            for literal in literals:
+                if literal in folded:
+                    return search(line)
+            return None
+    elif len(literals) == 1:
+        literal = literals[0]
+
+        def literal_search(line):
+            return search(line) if literal in line else None
+    else:
+        def literal_search(line):
+            for literal in literals:
+                if literal in line:
+                    return search(line)
+            return None
+    return literal_search
+
+
+def _bytes_literal_search(search, literals, ignore_case):
+    """Returns the function of :py:func:`prefiltered_search` for a pattern
+    matching bytes. ``in`` is much slower on bytes than on str since it first
+    tries to take the literal as an int: :py:meth:`bytes.find` is used instead.
+    """
+    if ignore_case:
+        def literal_search(line):
+            folded = line.lower()
+            for literal in literals:
+                if folded.find(literal) != -1:
+                    return search(line)
+            return None
+    else:
+        def literal_search(line):
+            for literal in literals:
+                if line.find(literal) != -1:
+                    return search(line)
+            return None
+    return literal_search
+
+
+class WindowSearch:
+    """Searches a pattern that never matches across lines in a buffer made
+    of many lines, only evaluating it on the lines containing one of its
+    :py:func:`required_literals`.
+
+    When the pattern ignores the case, the literals are looked for in the
+    buffer folded with :py:func:`fold_case`, which must be given with the
+    buffer. If it isn't, or if its length differs from the buffer's, the
+    pattern is evaluated on the whole buffer.
+    """
+
+    def __init__(self, pattern):
+        """**PARAMETERS**
+
+        * *pattern* - The compiled pattern. It must be line local, see
+          :py:func:`unlog.scanner.is_line_local`.
+        """
+        self._search = pattern.search
+        self._literals = required_literals(pattern)
+        self._new_line = b'\n' if isinstance(pattern.pattern, bytes) else '\n'
+        #: True if the buffer folded with :py:func:`fold_case` is needed.
+        self.ignore_case = self._literals is not None\
+            and bool(pattern.flags & re.IGNORECASE)
+        # The next position of each literal in the last text searched from
+        # _searched_from, so that each part of a text is only searched once.
+        self._text = None
+        self._searched_from = 0
+        self._next_literals = []
+
+    def __call__(self, buffer, position, folded=None):
+        """Returns the same match as ``pattern.search(buffer, position)``."""
+        if self._literals is None:
+            return self._search(buffer, position)
+        elif self.ignore_case:
+            if folded is None or len(folded) != len(buffer):
+                return self._search(buffer, position)
+            text = folded
+        else:
+            text = buffer
+
+        if text is not self._text or position < self._searched_from:
+            self._text = text
+            self._next_literals = [text.find(literal, position)
+                                   for literal in self._literals]
+        while True:
+            self._searched_from = position
+            self._next_literals = next_literals = [
+                start if start == -1 or start >= position
+                else text.find(literal, position)
+                for start, literal in zip(self._next_literals, self._literals)]
+            found = [start for start in next_literals if start >= 0]
+            if not found:
+                return None
+            literal_start = min(found)
+            line_start = buffer.rfind(self._new_line, 0, literal_start) + 1
+            line_end = buffer.find(self._new_line, literal_start) + 1\
+                or len(buffer)
+            match = self._search(buffer, max(position, line_start), line_end)
+            if match is not None:
+                return match
+            position = line_end
+
+    def forget(self):
+        """Release the last text searched."""
+        self._text = None
+        self._next_literals = []
@@ -0,0 +1,80 @@
+import codecs
+
+try:
+    from scanner import split_lines
+except ImportError:
+    from unlog.scanner import split_lines
+
+
+#: Number of bytes read at once by :py:func:`read_lines`.
+CHUNK_SIZE = 1024 * 1024
+
+
+class LineReader:
+    """Cuts data received by chunks into the lines a file opened in text mode,
+    or in binary mode if *binary* is True, would give.
+
+    The data following the last new line of a chunk is kept until the next
+    chunk comes.
+    """
+
+    def __init__(self, binary=False, encoding='utf-8', errors='strict'):
+        """**PARAMETERS**
+
+        * *binary* - Return the lines as bytes instead of decoding them.
+          Default: False.
+        * *encoding* - The encoding of the data if *binary* is False. Default:
+          'utf-8'.
+        * *errors* - How to handle decoding errors. Default: 'strict'.
+        """
+        self._binary = binary
+        self._encoding = encoding
+        self._errors = errors
+        self.reset()
+
+    def reset(self):
+        """Forget the start of line waiting for its end."""
+        self._pending = b'' if self._binary else ''
+        self._decoder = codecs.getincrementaldecoder(self._encoding)(self._errors)
+
+    def feed(self, data):
+        """Returns the complete lines made from the pending data and the bytes
+        of data.
+        """
+        if self._binary:
+            text = self._pending + data
+            new_line = b'\n'
+        else:
+            text = self._pending + self._decoder.decode(data)
+            new_line = '\n'
+        lines_end = text.rfind(new_line) + 1
+        complete, self._pending = text[:lines_end], text[lines_end:]
+        return split_lines(self._translate(complete))
+
+    def finish(self):
+        """Returns the lines made from the pending data: the last one doesn't
+        end with a new line.
+        """
+        text = self._pending
+        if not self._binary:
+            text += self._decoder.decode(b'', final=True)
+        self.reset()
+        return split_lines(self._translate(text))
+
+    def _translate(self, text):
+        """Translate the new lines like a file opened in text mode does."""
+        if not self._binary and '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        return text
+
+
+def read_lines(stream, binary=False, encoding='utf-8', errors='strict'):
+    """Yields the lines of a binary stream read by chunks of
+    :py:data:`CHUNK_SIZE` bytes. The lines that are available are yielded
+    without waiting for the chunk to be full.
+    """
+    reader = LineReader(binary, encoding, errors)
+    read = getattr(stream, 'read1', stream.read)
+    for data in iter(lambda: read(CHUNK_SIZE), b''):
+        yield from reader.feed(data)
+    yield from reader.finish()
@@ -0,0 +1,100 @@
+class MailReport:
+    """Holds the lines of the report to send by email.
+
+    The lines are kept in memory until their total size exceeds
+    *memory_limit* characters. They are then written to a temporary file and
+    read back from it when the report is iterated, so a huge report doesn't
+    stay in memory.
+
+    The GROUP line of a group is only added to the report once a line of the
+    group is added: the groups without any error don't appear in the report.
+    """
+    #: Default number of characters kept in memory.
+    MEMORY_LIMIT = 1024 * 1024
+
+    def __init__(self, memory_limit=None):
+        """**PARAMETERS**
+
+        * *memory_limit* - The number of characters kept in memory before
+          spooling the report to a temporary file. Default:
+          :py:attr:`MEMORY_LIMIT`.
+        """
+        self._memory_limit = memory_limit or self.MEMORY_LIMIT
+        self._lines = []
+        self._spool_file = None
+        self._group_start = None
+        self.size = 0
+        self.line_count = 0
+
+    def append(self, line):
+        """Add a line at the end of the report."""
+        if self._group_start is not None:
+            group_start, self._group_start = self._group_start, None
+            self.append(group_start)
+
+        self.size += len(line)
+        self.line_count += 1
+        if self._spool_file is not None:
+            self._spool_file.write(line)
+            return
+        self._lines.append(line)
+        if self.size > self._memory_limit:
+            self._spool()
+
+    def extend(self, lines):
+        """Add each line of the iterable lines to the report."""
+        for line in lines:
+            self.append(line)
+
+    def append_group_start(self, line):
+        """Add the GROUP line of a group. It is kept aside until a line of the
+        group is added.
+        """
+        if self._group_start is not None:
+            self.append(self._group_start)
+        self._group_start = line
+
+    def append_group_end(self, line):
+        """Add the END GROUP line of a group unless the group is empty."""
+        if self._group_start is not None:
+            self._group_start = None
+        else:
+            self.append(line)
+
+    def _spool(self):
+        """Move the lines held in memory to a temporary file."""
+        import tempfile
+
+        self._spool_file = tempfile.TemporaryFile(
+            'w+', encoding='utf-8', errors='surrogatepass', newline='\n')
+        self._spool_file.writelines(self._lines)
+        self._lines.clear()
+
+    def __iter__(self):
+        if self._spool_file is not None:
+            self._spool_file.flush()
+            self._spool_file.seek(0)
+            return self._iter_spool_file()
+        return iter(self._lines)
+
+    def _iter_spool_file(self):
+        """Yields the lines of the temporary file then goes back to its end."""
+        # Not yield from: closing the generator early would close the file.
+        try:
+            for line in self._spool_file:
+                yield line
+        finally:
+            self._spool_file.seek(0, 2)
+
+    def __bool__(self):
+        return self.line_count > 0
+
+    def clear(self):
+        """Remove all the lines of the report."""
+        self._lines.clear()
+        self._group_start = None
+        self.size = 0
+        self.line_count = 0
+        if self._spool_file is not None:
+            self._spool_file.close()
+            self._spool_file = None
@@ -0,0 +1,395 @@
+import codecs
+import io
+import mmap
+import os
+import re
+import stat
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+try:
+    from prefilter import WindowSearch, fold_case, prefiltered_search
+except ImportError:
+    from unlog.prefilter import WindowSearch, fold_case, prefiltered_search
+
+#: Categories of character sets that never contain a new line.
+_SAFE_CATEGORIES = (sre_constants.CATEGORY_DIGIT, sre_constants.CATEGORY_WORD)
+#: Positions that behave the same at the edges of a line and around a new line
+#: when the pattern is compiled with re.MULTILINE.
+_SAFE_POSITIONS = (sre_constants.AT_BEGINNING, sre_constants.AT_END,
+                   sre_constants.AT_BOUNDARY, sre_constants.AT_NON_BOUNDARY)
+_NEWLINE = ord('\n')
+
+
+def is_line_local(pattern):
+    """Returns True if searching the compiled *pattern* in a buffer made of
+    several lines finds a match in exactly the lines in which searching each
+    line alone would.
+
+    This is the case if no part of the pattern can match a new line, look
+    behind the start of the line or depend on the start or the end of the
+    whole string. Patterns that can match an empty string are only accepted if
+    they don't contain any anchor or assertion since they then match all the
+    lines.
+    """
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return False
+
+    state = getattr(parsed, 'state', None) or getattr(parsed, 'pattern', None)
+    if state.flags & (re.DOTALL | re.MULTILINE):
+        return False
+
+    checker = _LineLocalChecker()
+    if not checker.check(parsed):
+        return False
+    return parsed.getwidth()[0] > 0 or not checker.has_assertions
+
+
+class _LineLocalChecker:
+    """Walks a parsed pattern to see if it can match across lines."""
+
+    def __init__(self):
+        self.has_assertions = False
+
+    def check(self, items):
+        return all(self._check_item(op, av) for op, av in items)
+
+    def _check_item(self, op, av):
+        if op is sre_constants.LITERAL:
+            return av != _NEWLINE
+        elif op is sre_constants.NOT_LITERAL:
+            return av == _NEWLINE
+        elif op is sre_constants.ANY:
+            return True
+        elif op is sre_constants.IN:
+            return self._check_set(av)
+        elif op is sre_constants.AT:
+            self.has_assertions = True
+            return av in _SAFE_POSITIONS
+        elif op is sre_constants.BRANCH:
+            return all(self.check(branch) for branch in av[1])
+        elif op is sre_constants.SUBPATTERN:
+            add_flags, sub_pattern = av[1], av[3]
+            return not add_flags & (re.DOTALL | re.MULTILINE)\
+                and self.check(sub_pattern)
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+                    getattr(sre_constants, 'POSSESSIVE_REPEAT', None)):
+            return self.check(av[2])
+        elif op is getattr(sre_constants, 'ATOMIC_GROUP', None):
+            return self.check(av)
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            self.has_assertions = True
+            direction, sub_pattern = av
+            return direction > 0 and self.check(sub_pattern)
+        elif op is sre_constants.GROUPREF:
+            return True
+        elif op is sre_constants.GROUPREF_EXISTS:
+            return self.check(av[1]) and (av[2] is None or self.check(av[2]))
+        return False
+
+    def _check_set(self, items):
+        for op, av in items:
+            if op is sre_constants.LITERAL and av == _NEWLINE:
+                return False
+            elif op in (sre_constants.RANGE,
+                        getattr(sre_constants, 'RANGE_UNI_IGNORE', None))\
+            and av[0] <= _NEWLINE <= av[1]:
+                return False
+            elif op is sre_constants.CATEGORY and av not in _SAFE_CATEGORIES:
+                return False
+            elif op is sre_constants.NEGATE:
+                return False
+        return True
+
+
+def is_ascii_compatible(encoding):
+    """Returns True if a new line is encoded as b'\\n' and this byte is never
+    part of another character.
+    """
+    name = codecs.lookup(encoding).name
+    return name in ('utf-8', 'ascii', 'latin-1') or name.startswith('iso8859')\
+        or name.startswith('cp125')
+
+
+def decode(data, log_encoding):
+    """Decode data and translate its new lines like a file opened in text mode
+    does.
+    """
+    text = data.decode(log_encoding)
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+def split_lines(buffer):
+    """Returns the lines of buffer (str or bytes) with their new line. Unlike
+    :py:meth:`str.splitlines`, only \\n ends a line.
+    """
+    new_line = b'\n' if isinstance(buffer, bytes) else '\n'
+    lines = buffer.split(new_line)
+    last_line = lines.pop()
+    lines = [line + new_line for line in lines]
+    if last_line:
+        lines.append(last_line)
+    return lines
+
+
+def iter_windows(data, start, end, size):
+    """Yields the start and end offsets of the windows of about size bytes
+    between start and end in data, each one ending with a new line except the
+    last one.
+    """
+    window_start = start
+    while window_start < end:
+        window_end = data.find(b'\n', window_start + size, end) + 1
+        if window_end == 0:
+            window_end = end
+        yield window_start, window_end
+        window_start = window_end
+
+
+class Scanner:
+    """Processes a file with a :py:class:`unlog.filter.Filter` without going
+    through all its lines.
+
+    The file is memory mapped and read by windows of :py:attr:`WINDOW_SIZE`
+    bytes. In each window, the error and group patterns are searched across the
+    whole window to find the lines that matter. Only these lines and the lines
+    of their blocks, found by looking backwards and forwards for the start
+    pattern, are given to the filter. The lines of the blocks without any
+    error are skipped without being looked at one by one. The output is the
+    same as with :py:meth:`unlog.filter.Filter.process_file`.
+    """
+    #: Approximate number of bytes read at once from the file.
+    WINDOW_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, output_filter, log_encoding='utf-8'):
+        """**PARAMETERS**
+
+        * *output_filter* - The :py:class:`unlog.filter.Filter` to feed.
+        * *log_encoding* - The encoding of the file if the filter doesn't work
+          on bytes. Default: 'utf-8'.
+        """
+        self._filter = output_filter
+        self._log_encoding = log_encoding
+        self._binary = output_filter.binary
+        self._new_line = b'\n' if self._binary else '\n'
+        self._start_search = prefiltered_search(output_filter.start_pattern)
+        self._hit_patterns = [re.compile(pattern.pattern, pattern.flags | re.M)
+                              for pattern in output_filter.hit_patterns]
+        self._window_searches = [WindowSearch(pattern)
+                                 for pattern in self._hit_patterns]
+        self._hit_searches = self._window_searches
+        self._fold_case = any(search.ignore_case
+                              for search in self._window_searches)
+        # The filter numbers the lines: it must know how many are skipped.
+        self._skip_lines = output_filter.skip_lines if output_filter.dedupes\
+            else None
+        self._stats = output_filter.stats
+        if self._stats is not None:
+            self._start_search = self._stats.timed(self._start_search, 'start')
+            self._hit_searches = [
+                self._stats.timed(search, name) for search, name
+                in zip(self._hit_searches, ('error', 'start_group', 'end_group'))]
+        self._carry = self._new_line[:0]
+
+    @staticmethod
+    def can_scan(output_filter, log_encoding='utf-8'):
+        """Returns True if the Scanner gives the same result as
+        :py:meth:`unlog.filter.Filter.process_file` for this filter.
+        """
+        if not output_filter.binary and not is_ascii_compatible(log_encoding):
+            return False
+        return all(is_line_local(pattern)
+                   for pattern in output_filter.hit_patterns)
+
+    def process_file(self, file):
+        """Process a file opened in binary mode. Files that cannot be mapped in
+        memory are processed line by line.
+        """
+        file_stat = os.fstat(file.fileno())
+        if not stat.S_ISREG(file_stat.st_mode):
+            self._filter.process_file(self._wrap_file(file))
+            return
+
+        self.process_range(file, 0, file_stat.st_size)
+        self._filter.finish()
+
+    def process_range(self, file, start, end):
+        """Give the filter the lines of a regular file opened in binary mode
+        between the offsets start, which must be the start of a line, and end.
+        The filter is not finished so the caller decides what to do with the
+        last block.
+        """
+        if end <= start:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            self._scan(data, start, end)
+
+    def _wrap_file(self, file):
+        if self._binary:
+            return file
+        return io.TextIOWrapper(file, encoding=self._log_encoding)
+
+    def _scan(self, data, start, end):
+        """Process each window of data between start and end.
+
+        With stats, all the lines between start and end are counted as read,
+        including the ones skipped without being given to the filter.
+        """
+        stats = self._stats
+        if stats is not None:
+            lines_read, bytes_read = stats.lines_read, stats.bytes_read
+            new_lines = 0
+            previous = stats.switch('scan')
+        self._carry = self._new_line[:0]
+        for window_start, window_end in iter_windows(data, start, end,
+                                                     self.WINDOW_SIZE):
+            if stats is not None:
+                stats.switch('read')
+            window = data[window_start:window_end]
+            if stats is not None:
+                new_lines += window.count(b'\n')
+            self.scan_window(window, window_end == end)
+
+        if stats is not None:
+            stats.switch(previous)
+            # The lines given to the filter were already counted by it.
+            stats.lines_read = lines_read + new_lines\
+                + (data[end - 1:end] != b'\n')
+            stats.bytes_read = bytes_read + end - start
+
+    def scan_window(self, window, is_last):
+        """Give the filter the lines of window, the bytes following the
+        previous window and ending with a new line unless is_last is True,
+        that can change its output.
+        """
+        if self._stats is not None:
+            self._stats.switch('read')
+        window = self._decode(window)
+        if self._stats is not None:
+            self._stats.switch('scan')
+        self._process_window(self._carry + window, is_last)
+
+    def _decode(self, window):
+        """Returns the window as the filter expects it: unchanged in binary mode
+        or decoded like in a file opened in text mode.
+        """
+        if self._binary:
+            return window
+        return decode(window, self._log_encoding)
+
+    def _process_window(self, buffer, is_last):
+        """Give to the filter the lines of buffer that can change its output.
+
+        *position* is the start of the first line that was neither given to the
+        filter nor skipped.
+        """
+        self._carry = buffer[:0]
+        position = 0
+        for hit_start, hit_end in self._iter_hit_lines(buffer):
+            self._process_clean_lines(buffer, position, hit_start)
+            self._filter.process_line(buffer[hit_start:hit_end])
+            position = hit_end
+
+        position = self._complete_matching_block(buffer, position, len(buffer))
+        if is_last or position == len(buffer):
+            self._skip(buffer, position, len(buffer))
+            return
+
+        block_start = self._find_block_start(buffer, position, len(buffer))
+        if block_start is None:
+            block_start = position
+        self._skip(buffer, position, block_start)
+        self._carry = buffer[block_start:]
+        if len(self._carry) > self.WINDOW_SIZE:
+            self._feed(self._carry, 0, len(self._carry))
+            self._carry = buffer[:0]
+
+    def _iter_hit_lines(self, buffer):
+        """Yields the start and end positions of the lines that match at least
+        one of the hit patterns, in the order of the buffer.
+        """
+        searches = self._hit_searches
+        folded = fold_case(buffer) if self._fold_case else None
+        next_hits = [self._find_hit(search, buffer, 0, folded)
+                     for search in searches]
+        while True:
+            hit_start = min(next_hits)
+            if hit_start >= len(buffer):
+                for search in self._window_searches:
+                    search.forget()
+                return
+            hit_end = buffer.find(self._new_line, hit_start) + 1 or len(buffer)
+            yield hit_start, hit_end
+            for index, search in enumerate(searches):
+                if next_hits[index] < hit_end:
+                    next_hits[index] = self._find_hit(search, buffer, hit_end,
+                                                      folded)
+
+    def _find_hit(self, search, buffer, position, folded):
+        """Returns the start of the first line matching from position or the
+        length of the buffer if none matches. *folded* is the buffer folded with
+        :py:func:`unlog.prefilter.fold_case` if a search needs it.
+        """
+        match = search(buffer, position, folded)
+        if match is None or match.start() == len(buffer):
+            return len(buffer)
+        return buffer.rfind(self._new_line, 0, match.start()) + 1
+
+    def _process_clean_lines(self, buffer, start, end):
+        """Handle the lines between two hits: they must be given to the filter
+        if they belong to a block that is output or to the block of the next
+        hit. The other ones are skipped.
+        """
+        start = self._complete_matching_block(buffer, start, end)
+        if start == end:
+            return
+        block_start = self._find_block_start(buffer, start, end)
+        if block_start is None:
+            block_start = start
+        self._skip(buffer, start, block_start)
+        self._feed(buffer, block_start, end)
+
+    def _skip(self, buffer, start, end):
+        """Tell the filter how many lines between start and end are skipped
+        if it numbers the lines.
+        """
+        if self._skip_lines is not None and end > start:
+            self._skip_lines(buffer.count(self._new_line, start, end))
+
+    def _complete_matching_block(self, buffer, start, end):
+        """While the current block of the filter matches, give it the next line.
+        Returns the position of the first line that wasn't given.
+        """
+        while start < end and self._filter.match():
+            line_end = buffer.find(self._new_line, start, end) + 1 or end
+            self._filter.process_line(buffer[start:line_end])
+            start = line_end
+        return start
+
+    def _find_block_start(self, buffer, start, end):
+        """Returns the start of the last line matching the start pattern between
+        start and end or None.
+        """
+        line_end = end
+        while line_end > start:
+            line_start = buffer.rfind(self._new_line, start, line_end - 1) + 1
+            if line_start == 0:
+                line_start = start
+            if self._start_search(buffer[line_start:line_end]):
+                return line_start
+            line_end = line_start
+
+    def _feed(self, buffer, start, end):
+        """Give the lines between start and end to the filter."""
+        process_line = self._filter.process_line
+        for line in split_lines(buffer[start:end]):
+            process_line(line)
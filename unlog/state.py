@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+
+try:
+    from scanner import is_ascii_compatible
+except ImportError:
+    from unlog.scanner import is_ascii_compatible
+
+
+#: Splits a decoded line on the new lines recognized in text mode.
+_TEXT_LINES = re.compile(r'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+')
+
+
+class State:
+    """The checkpoints of the files processed by the previous runs, stored in a
+    JSON file.
+
+    For each file, the checkpoint records its inode, a fingerprint of its first
+    bytes and the offset of the block that was being read when the end of the
+    file was reached. This block is not output: the next run processes the file
+    from the start of this block so it is output once complete. If the file was
+    replaced since the last run, the end of the old file is processed first if
+    it can still be found in the same directory, then the new file is processed
+    from its start. If the file was truncated, it is processed from its start.
+    """
+    #: Number of bytes at the start of a file used to recognize it.
+    FINGERPRINT_SIZE = 1024
+
+    def __init__(self, path):
+        """**PARAMETERS**
+
+        * *path* - The path of the state file. It is created if it doesn't
+          exist.
+        """
+        self._path = path
+        self._checkpoints = self._load()
+
+    def _load(self):
+        """Returns the checkpoints stored in the state file."""
+        try:
+            with open(self._path, 'r', encoding='utf-8') as state_file:
+                return json.load(state_file)['files']
+        except FileNotFoundError:
+            return {}
+        except (IOError, ValueError, KeyError, TypeError) as e:
+            sys.stderr.write('Cannot read the state file {}: {}. All the files '
+                             'will be processed from their start.\n'
+                             .format(self._path, e))
+            return {}
+
+    def save(self):
+        """Write the checkpoints to the state file. The file is replaced at
+        once so it is never left half written.
+        """
+        directory = os.path.dirname(os.path.abspath(self._path))
+        fd, temporary_path = tempfile.mkstemp(dir=directory, prefix='.unlog-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as state_file:
+                json.dump({'files': self._checkpoints}, state_file, indent=2,
+                          sort_keys=True)
+            os.replace(temporary_path, self._path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    @staticmethod
+    def can_checkpoint(output_filter, log_encoding='utf-8'):
+        """Returns True if the offsets of the lines can be found, ie if a new
+        line is always the byte \\n.
+        """
+        return output_filter.binary or is_ascii_compatible(log_encoding)
+
+    def process_file(self, output_filter, file_name, log_encoding='utf-8'):
+        """Process the part of file_name that wasn't processed by the previous
+        runs with output_filter and save its new checkpoint.
+        """
+        file_name = os.path.abspath(file_name)
+        checkpoint = self._checkpoints.get(file_name)
+        with open(file_name, 'rb') as file:
+            if checkpoint is not None and not self._is_same_file(checkpoint, file):
+                self._process_rotated_file(output_filter, file_name, checkpoint,
+                                           log_encoding)
+                checkpoint = None
+            elif checkpoint is not None\
+            and os.fstat(file.fileno()).st_size < checkpoint['offset']:
+                checkpoint = None
+            reader = _CheckpointReader(output_filter, log_encoding)
+            offset, filter_state = reader.process(file, checkpoint)
+            self._checkpoints[file_name] = self._make_checkpoint(
+                file, offset, filter_state)
+        self.save()
+
+    def _is_same_file(self, checkpoint, file):
+        """Returns True if the opened file is the one of the checkpoint."""
+        file_stat = os.fstat(file.fileno())
+        return (file_stat.st_ino, file_stat.st_dev)\
+            == (checkpoint['inode'], checkpoint['device'])\
+            and self._fingerprint(file, checkpoint['fingerprint_size'])\
+            == checkpoint['fingerprint']
+
+    def _process_rotated_file(self, output_filter, file_name, checkpoint,
+                              log_encoding):
+        """Process the end of the file of the checkpoint if it was renamed in
+        the same directory, like logrotate does.
+        """
+        directory = os.path.dirname(file_name)
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                entry_stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            if (entry_stat.st_ino, entry_stat.st_dev)\
+            != (checkpoint['inode'], checkpoint['device']):
+                continue
+            with open(entry.path, 'rb') as file:
+                if self._is_same_file(checkpoint, file)\
+                and entry_stat.st_size >= checkpoint['offset']:
+                    reader = _CheckpointReader(output_filter, log_encoding)
+                    reader.process(file, checkpoint, complete=True)
+            return
+
+    def _make_checkpoint(self, file, offset, filter_state):
+        """Returns the checkpoint to save for the opened file."""
+        file_stat = os.fstat(file.fileno())
+        fingerprint_size = min(self.FINGERPRINT_SIZE, file_stat.st_size)
+        return {'inode': file_stat.st_ino,
+                'device': file_stat.st_dev,
+                'fingerprint_size': fingerprint_size,
+                'fingerprint': self._fingerprint(file, fingerprint_size),
+                'offset': offset,
+                'filter': filter_state}
+
+    @staticmethod
+    def _fingerprint(file, size):
+        """Returns the hash of the first size bytes of the file."""
+        file.seek(0)
+        data = file.read(size)
+        if len(data) < size:
+            return None
+        return hashlib.sha1(data).hexdigest()
+
+
+class _CheckpointReader:
+    """Gives the lines of a file opened in binary mode to a filter and keeps
+    track of the offset from which the current block can be processed again.
+    """
+
+    def __init__(self, output_filter, log_encoding='utf-8'):
+        self._filter = output_filter
+        self._log_encoding = log_encoding
+        self._binary = output_filter.binary
+
+    def process(self, file, checkpoint=None, complete=False):
+        """Process the file from the offset of the checkpoint. The last line is
+        only processed if it ends with a new line or if *complete* is True.
+
+        **RETURN** - a tuple containing the offset from which the next run must
+        start and the state of the filter to restore then.
+        """
+        output_filter = self._filter
+        if checkpoint is None:
+            offset = 0
+            output_filter.restore_state()
+        else:
+            offset = checkpoint['offset']
+            output_filter.restore_state(**checkpoint['filter'])
+        file.seek(offset)
+
+        position = block_offset = offset
+        block_start = output_filter.block_start
+        block_state = output_filter.get_state()
+        groups_started = output_filter.groups_started
+        if output_filter.stats is not None:
+            file = output_filter.stats.iter_timed(file)
+        for raw_line in file:
+            if not raw_line.endswith(b'\n') and not complete:
+                break
+            for line_start, line_end, line in self._iter_lines(raw_line,
+                                                               position):
+                output_filter.process_line(line)
+                if output_filter.block_start != block_start:
+                    block_start = output_filter.block_start
+                    block_offset = line_end if block_start[1] else line_start
+                    block_state = dict(output_filter.get_state(),
+                                       streaming=False)
+                    groups_started = output_filter.groups_started
+            position += len(raw_line)
+
+        filter_state = output_filter.get_state()
+        if filter_state['streaming']:
+            # The block was already output: continue it from where we are.
+            block_offset = position
+        else:
+            filter_state = dict(block_state, skip_group_headers=
+                                output_filter.groups_started - groups_started)
+        output_filter.finish(complete=complete)
+        return block_offset, filter_state
+
+    def _iter_lines(self, raw_line, position):
+        """Yields the start and end offsets and the line as seen by the filter
+        of each line made of raw_line: in text mode, \\r also ends a line.
+        """
+        line_end = position + len(raw_line)
+        if self._binary:
+            yield position, line_end, raw_line
+            return
+
+        text = raw_line.decode(self._log_encoding)
+        if '\r' not in text:
+            yield position, line_end, text
+            return
+
+        for part in _TEXT_LINES.findall(text):
+            line_start = position
+            position += len(part.encode(self._log_encoding))
+            yield line_start, position,\
+                part.replace('\r\n', '\n').replace('\r', '\n')
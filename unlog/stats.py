@@ -0,0 +1,178 @@
+import os
+import time
+
+
+class Stats:
+    """Counts what a run of unlog read and output and measures where the time
+    goes.
+
+    The time is measured per pattern, the cumulative time spent evaluating it,
+    and per phase. The phases don't overlap: :py:meth:`switch` ends the
+    current phase and starts a new one, so the sum of the phases is the
+    duration of the run:
+
+    * *read* - Reading and decoding the input.
+    * *scan* - Searching the patterns across the input with a
+      :py:class:`unlog.scanner.Scanner`.
+    * *filter* - Processing the lines with the
+      :py:class:`unlog.filter.Filter`, including the time spent in the
+      patterns.
+    * *output* - Writing the output to stdout.
+    * *mail* - Preparing and sending the reports by email.
+    * *other* - Everything else, like starting and reading the config file.
+    """
+    #: The counters, in the order they are reported.
+    COUNTERS = ('lines_read', 'bytes_read', 'blocks_seen', 'blocks_matched',
+                'blocks_deduplicated', 'lines_emitted', 'groups', 'mails_sent')
+    #: The patterns whose time is measured.
+    PATTERNS = ('start', 'error', 'start_group', 'end_group')
+    #: The phases of a run.
+    PHASES = ('read', 'scan', 'filter', 'output', 'mail', 'other')
+    #: Describes the counters in the Prometheus textfile.
+    _counter_help = {
+        'lines_read': 'Lines read from the inputs.',
+        'bytes_read': 'Bytes read from the inputs.',
+        'blocks_seen': 'Blocks processed by the filter.',
+        'blocks_matched': 'Blocks matching the error pattern.',
+        'blocks_deduplicated': 'Matching blocks folded into a previous one.',
+        'lines_emitted': 'Lines written to stdout or to the reports.',
+        'groups': 'Groups started.',
+        'mails_sent': 'Emails sent.',
+    }
+
+    def __init__(self):
+        for counter in self.COUNTERS:
+            setattr(self, counter, 0)
+        #: The number of matching blocks of each error class.
+        self.error_class_blocks = {}
+        self.pattern_time = dict.fromkeys(self.PATTERNS, 0.0)
+        self.phase_time = dict.fromkeys(self.PHASES, 0.0)
+        self._phase = 'other'
+        self._phase_start = time.perf_counter()
+
+    def switch(self, phase):
+        """End the current phase and start phase. Returns the name of the phase
+        that ended so it can be started again afterwards.
+        """
+        now = time.perf_counter()
+        self.phase_time[self._phase] += now - self._phase_start
+        previous, self._phase, self._phase_start = self._phase, phase, now
+        return previous
+
+    def count_error_class(self, error_class):
+        """Count a matching block tagged with error_class."""
+        self.error_class_blocks[error_class] = \
+            self.error_class_blocks.get(error_class, 0) + 1
+
+    def timed(self, search, pattern):
+        """Returns a function calling search and adding the time it takes to
+        the time of pattern.
+        """
+        pattern_time = self.pattern_time
+        perf_counter = time.perf_counter
+
+        def timed_search(*args):
+            start = perf_counter()
+            try:
+                return search(*args)
+            finally:
+                pattern_time[pattern] += perf_counter() - start
+
+        return timed_search
+
+    def iter_timed(self, iterable, phase='read'):
+        """Yields the items of iterable, the time spent getting them being
+        added to phase.
+        """
+        iterator = iter(iterable)
+        while True:
+            previous = self.switch(phase)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.switch(previous)
+            yield item
+
+    @property
+    def elapsed(self):
+        """The number of seconds since the stats were created."""
+        return sum(self.phase_time.values()) + time.perf_counter()\
+            - self._phase_start
+
+    def format(self):
+        """Returns the stats as text for humans."""
+        self.switch(self._phase)
+        elapsed = self.elapsed or float('inf')
+        lines = ['unlog statistics:']
+        for counter in self.COUNTERS:
+            lines.append('  {}: {}'.format(counter.replace('_', ' '),
+                                           getattr(self, counter)))
+        for error_class, blocks in self.error_class_blocks.items():
+            lines.append('  blocks matched [{}]: {}'.format(error_class,
+                                                             blocks))
+        lines.append('  throughput: {:.0f} lines/s, {:.1f} MB/s'.format(
+            self.lines_read / elapsed,
+            self.bytes_read / elapsed / 1024 / 1024))
+        lines.append('time per pattern:')
+        for pattern in self.PATTERNS:
+            lines.append('  {}: {:.3f} s'.format(pattern.replace('_', ' '),
+                                                  self.pattern_time[pattern]))
+        lines.append('time per phase:')
+        for phase in self.PHASES:
+            lines.append('  {}: {:.3f} s'.format(phase,
+                                                  self.phase_time[phase]))
+        lines.append('  total: {:.3f} s'.format(self.elapsed))
+        return '\n'.join(lines) + '\n'
+
+    def format_prometheus(self):
+        """Returns the stats in the Prometheus text exposition format. The
+        values are the ones of the run, so they are exposed as gauges.
+        """
+        self.switch(self._phase)
+        lines = []
+        for counter in self.COUNTERS:
+            lines.extend(self._prometheus_metric(
+                counter, self._counter_help[counter],
+                [('', getattr(self, counter))]))
+        if self.error_class_blocks:
+            lines.extend(self._prometheus_metric(
+                'error_class_blocks', 'Blocks matching each error class.',
+                [('{{error_class="{}"}}'.format(error_class), blocks)
+                 for error_class, blocks in self.error_class_blocks.items()]))
+        lines.extend(self._prometheus_metric(
+            'pattern_seconds', 'Seconds spent evaluating each pattern.',
+            [('{{pattern="{}"}}'.format(pattern), self.pattern_time[pattern])
+             for pattern in self.PATTERNS]))
+        lines.extend(self._prometheus_metric(
+            'phase_seconds', 'Seconds spent in each phase of the run.',
+            [('{{phase="{}"}}'.format(phase), self.phase_time[phase])
+             for phase in self.PHASES]))
+        lines.extend(self._prometheus_metric(
+            'run_seconds', 'Duration of the run.', [('', self.elapsed)]))
+        lines.extend(self._prometheus_metric(
+            'last_run_timestamp_seconds', 'End of the run.',
+            [('', time.time())]))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _prometheus_metric(name, help_text, samples):
+        """Returns the lines describing the metric name and its samples, a list
+        of tuples containing the labels and the value.
+        """
+        name = 'unlog_' + name
+        lines = ['# HELP {} {}'.format(name, help_text),
+                 '# TYPE {} gauge'.format(name)]
+        for labels, value in samples:
+            lines.append('{}{} {}'.format(name, labels, value))
+        return lines
+
+    def write_prometheus(self, file_name):
+        """Write the stats to file_name for the textfile collector of the
+        Prometheus node exporter. The file is replaced atomically so the
+        collector never reads it half written.
+        """
+        with open(file_name + '.tmp', 'w', encoding='utf-8') as stats_file:
+            stats_file.write(self.format_prometheus())
+        os.replace(file_name + '.tmp', file_name)
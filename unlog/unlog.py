@@ -1,19 +1,37 @@
 import sys
 import os
+import io
 import copy
+import contextlib
 
+# The modules only needed by some options are imported when they are used so
+# that unlog starts quickly when used as a simple filter.
 try:
-    from config import Config
     from filter import Filter
+    from scanner import Scanner
+    from reader import read_lines
+    from compressed import (get_compression, get_decompression_errors,
+                            open_decompressed)
 except ImportError:
-    from unlog.config import Config
     from unlog.filter import Filter
+    from unlog.scanner import Scanner
+    from unlog.reader import read_lines
+    from unlog.compressed import (get_compression, get_decompression_errors,
+                                  open_decompressed)
 
 
 class Unlog:
     """Filter the output of a command or a log file according to pattern passed
     in the *args* argument or according to a config file.
     """
+    #: Size of the buffer used to read the files in binary mode.
+    BINARY_BUFFER_SIZE = 1024 * 1024
+    #: Arguments that are only used by Unlog and must not be passed to Filter.
+    ARGS_NOT_FOR_FILTER = ['files', 'config_file', 'use_config_section', 'scan',
+                          'jobs', 'split_size', 'follow', 'follow_interval',
+                          'idle_timeout', 'state', 'digest', 'mail_queue',
+                          'flush_mail_queue', 'stats', 'stats_file',
+                          'commands', ]
 
     def __init__(self, args):
         """    **PARAMETERS**
@@ -23,91 +41,427 @@ class Unlog:
       """
         self._args = args
         self._check_args()
-        if args.start_pattern:
-            self._filter_from_args()
-        else:
-            self._filter_from_config()
+        self._mail_sender = None
+        self._exit_code = 0
+        if args.flush_mail_queue:
+            self._open_mail_queue().flush()
+            if not args.files and not args.start_pattern\
+            and not args.use_config_section:
+                return
+        self._stats = self._create_stats()\
+            if args.stats or args.stats_file else None
+        self._state = self._open_state() if args.state else None
+        self._mail_digest = self._create_mail_digest() if args.digest else None
+        try:
+            if args.start_pattern:
+                self._filter_from_args()
+            else:
+                self._filter_from_config()
+            if self._mail_digest is not None:
+                self._send_mail_digest()
+        finally:
+            if self._mail_sender is not None:
+                self._close_mail_sender()
+            if self._stats is not None:
+                self._report_stats()
+        if self._exit_code:
+            sys.exit(self._exit_code)
 
     def _check_args(self):
         """Verify that the arguments are coherent. Exit with error code 2 if
         incoherences are fonud.
         """
         if not self._args.files and not self._args.start_pattern \
-        and not self._args.use_config_section:
+        and not self._args.use_config_section and not self._args.flush_mail_queue:
             sys.stderr.write('You must give a file or a start pattern.\n')
             sys.exit(2)
+        if self._args.files and self._args.commands:
+            sys.stderr.write('You cannot give files and commands.\n')
+            sys.exit(2)
+        if self._args.flush_mail_queue and not self._args.mail_queue:
+            sys.stderr.write('You must give the queue to flush with '
+                             '--mail-queue.\n')
+            sys.exit(2)
         if (self._args.start_group_pattern and not self._args.end_group_pattern)\
         or (not self._args.start_group_pattern and self._args.end_group_pattern):
             sys.stderr.write('You must --start-group and --end-group.')
             sys.exit(2)
 
+    def _create_stats(self):
+        """Returns the :py:class:`unlog.stats.Stats` of the run."""
+        try:
+            from stats import Stats
+        except ImportError:
+            from unlog.stats import Stats
+        return Stats()
+
+    def _report_stats(self):
+        """Print the stats on stderr with --stats and write them to the
+        Prometheus textfile given by --stats-file.
+        """
+        if self._args.stats:
+            sys.stderr.write(self._stats.format())
+        if self._args.stats_file:
+            try:
+                self._stats.write_prometheus(
+                    os.path.expanduser(self._args.stats_file))
+            except IOError as e:
+                sys.stderr.write('Cannot write the stats: {}\n'.format(e))
+
+    def _open_state(self):
+        """Returns the :py:class:`unlog.state.State` read from the state file.
+        """
+        try:
+            from state import State
+        except ImportError:
+            from unlog.state import State
+        return State(os.path.expanduser(self._args.state))
+
+    def _create_mail_digest(self):
+        """Returns the :py:class:`unlog.mail.Digest` collecting the reports of
+        the run.
+        """
+        try:
+            from mail import Digest
+        except ImportError:
+            from unlog.mail import Digest
+        return Digest()
+
+    def _open_mail_queue(self):
+        """Returns the :py:class:`unlog.mail.MailQueue` of the directory given
+        by --mail-queue.
+        """
+        try:
+            from mail import MailQueue
+        except ImportError:
+            from unlog.mail import MailQueue
+        return MailQueue(os.path.expanduser(self._args.mail_queue))
+
+    def _get_mail_sender(self):
+        """Returns the :py:class:`unlog.mail.MailSender` sending the emails of
+        the run in the background. It is started on the first call.
+        """
+        if self._mail_sender is None:
+            try:
+                from mail import MailSender
+            except ImportError:
+                from unlog.mail import MailSender
+            mail_queue = self._open_mail_queue() if self._args.mail_queue\
+                else None
+            self._mail_sender = MailSender(mail_queue)
+        return self._mail_sender
+
+    def _send_mail_digest(self):
+        """Send the reports collected in the digest."""
+        if self._stats is not None:
+            previous = self._stats.switch('mail')
+            self._stats.mails_sent += self._mail_digest.send(
+                self._get_mail_sender())
+            self._stats.switch(previous)
+        else:
+            self._mail_digest.send(self._get_mail_sender())
+
+    def _close_mail_sender(self):
+        """Wait until the emails sent in the background are sent."""
+        if self._stats is not None:
+            previous = self._stats.switch('mail')
+            self._mail_sender.close()
+            self._stats.switch(previous)
+        else:
+            self._mail_sender.close()
+
+    def _setup_filter(self, output_filter, report_title=None):
+        """Make output_filter add its reports to the digest if one is used or
+        send them in the background and measure it if stats are requested.
+        """
+        if self._stats is not None:
+            output_filter.set_stats(self._stats)
+        if self._mail_digest is not None:
+            output_filter.set_mail_digest(self._mail_digest, report_title)
+        elif output_filter.mails_reports:
+            output_filter.set_mail_sender(self._get_mail_sender())
+
     def _filter_from_args(self):
         """Filter the files or stdin according to the patterns give by the
         arguments provided on the command line.
         """
         config = copy.copy(self._args.__dict__)
-        # Must not be passed to filter (unuseful)
-        del config['files']
-        # The following key are only used when processing from a config file
-        del config['config_file']
-        del config['use_config_section']
-        # The filter manipulates string in the proper encoding. No need to pass it.
-        del config['log_encoding']
+        for key in self.ARGS_NOT_FOR_FILTER:
+            del config[key]
         self._output_filter = Filter(**config)
         # If no files are provided, read from stdin
         if self._args.files:
             self._files = self._args.files
             self.process_files()
+        elif self._args.commands:
+            self.run_commands(self._args.log_encoding)
         else:
             self.process_stdin()
 
     def process_files(self):
         """Loop on each file given on the command line and process them.
         """
+        if self._args.follow:
+            self._follow_files([
+                (file_name, self._output_filter.clone(), self._args.log_encoding)
+                for file_name in self._files])
+            return
+        elif self._must_process_in_parallel(self._files):
+            self._process_files_in_parallel(self._files)
+            return
+
         for file in self._files:
             self.process_file(file, log_encoding=self._args.log_encoding)
 
+    def _must_process_in_parallel(self, files):
+        """Returns True if several processes are allowed and useful. Files
+        processed with a state file, whose reports are sent in a digest or
+        whose stats are measured are always processed one after the other.
+        """
+        return self._args.jobs > 1 and len(files) > 1 and self._state is None\
+            and self._mail_digest is None and self._stats is None
+
+    def _process_files_in_parallel(self, files):
+        """Process each file in its own Unlog in a pool of *jobs* processes.
+
+        The output of each file is written as soon as it and the ones of the
+        previous files are available, so it comes in the order of the command
+        line. Reports sent by email are sent by the workers.
+        """
+        import multiprocessing
+
+        jobs = [(self._args, file_name) for file_name in files]
+        exit_code = 0
+        with multiprocessing.Pool(self._args.jobs) as pool:
+            for output, file_exit_code in pool.imap(_process_file_job, jobs):
+                sys.stdout.write(output)
+                sys.stdout.flush()
+                exit_code = exit_code or file_exit_code
+        if exit_code:
+            sys.exit(exit_code)
+
     def process_file(self, file_name, log_encoding='utf-8'):
         """Open file_name and process it with :py:meth:`unlog.filter.Filter.process_file`
+
+        If the filter works on bytes, the file is opened in binary mode with a
+        large buffer and the lines are not decoded.
+
+        Unless disabled, the file is processed with a
+        :py:class:`unlog.scanner.Scanner` if it gives the same result. Big files
+        are split and their parts are processed in parallel if several jobs
+        are allowed.
+
+        With a state file, only the part of the file that wasn't processed by
+        the previous runs is read, line by line.
+
+        Files compressed with gzip, bzip2 or xz are decompressed as they are
+        read and always processed line by line from their start.
         """
+        self._setup_filter(self._output_filter, file_name)
         try:
-            with open(file_name, 'r', encoding=log_encoding) as file:
+            compression = get_compression(file_name)
+            if compression:
+                self._process_compressed_file(file_name, compression,
+                                              log_encoding)
+                return
+            elif self._state is not None\
+            and self._state.can_checkpoint(self._output_filter, log_encoding):
+                self._state.process_file(self._output_filter, file_name,
+                                         log_encoding)
+                return
+            elif self._must_split_file(file_name, log_encoding):
+                self._split_file(file_name, log_encoding)
+                return
+            elif self._args.scan\
+            and Scanner.can_scan(self._output_filter, log_encoding):
+                with open(file_name, 'rb') as file:
+                    Scanner(self._output_filter, log_encoding).process_file(file)
+                return
+            elif self._output_filter.binary:
+                file = open(file_name, 'rb', buffering=self.BINARY_BUFFER_SIZE)
+            else:
+                file = open(file_name, 'r', encoding=log_encoding)
+            with file:
                 self._output_filter.process_file(file)
         except IOError as e:
             sys.stderr.write(str(e))
             sys.stderr.write("\n")
 
+    def _process_compressed_file(self, file_name, compression, log_encoding):
+        """Process a compressed file with
+        :py:meth:`unlog.filter.Filter.process_file`. If the file is corrupted,
+        what could be read is processed and the error is written on stderr.
+        """
+        if self._output_filter.binary:
+            log_encoding = None
+        try:
+            with open_decompressed(file_name, compression, log_encoding) as file:
+                self._output_filter.process_file(file)
+        except get_decompression_errors(compression) as e:
+            self._output_filter.finish()
+            sys.stderr.write('{}: {}\n'.format(file_name, e))
+
+    def _must_split_file(self, file_name, log_encoding):
+        """Returns True if the file is big enough to be split in parts
+        processed in parallel.
+        """
+        if self._args.jobs <= 1 or self._stats is not None:
+            return False
+        try:
+            from parallel import FileSplitter
+        except ImportError:
+            from unlog.parallel import FileSplitter
+        split_size = self._args.split_size or FileSplitter.RANGE_SIZE
+        return FileSplitter.can_split(self._output_filter, log_encoding)\
+            and os.path.isfile(file_name)\
+            and os.path.getsize(file_name) > split_size
+
+    def _split_file(self, file_name, log_encoding):
+        """Process the parts of a big file in parallel with
+        :py:func:`unlog.parallel.process_file_in_parallel`.
+        """
+        try:
+            from parallel import process_file_in_parallel
+        except ImportError:
+            from unlog.parallel import process_file_in_parallel
+        process_file_in_parallel(self._output_filter, file_name,
+                                 self._args.jobs, log_encoding,
+                                 self._args.scan, self._args.split_size)
+
     def process_stdin(self):
         """Process each line on the stdin with
         :py:meth:`unlog.filter.Filter.process_line`
+
+        Stdin is read by large chunks, the lines being processed as soon as
+        they are available.
         """
-        for line in iter(sys.stdin.readline, ''):
-            self._output_filter.process_line(line)
-        # We must print the stack when we reach the last line of stdin so that the
-        # errors located at the end are displayed.
-        self._output_filter.print_stack()
-        self._output_filter.send_mail()
+        self._setup_filter(self._output_filter)
+        process_line = self._output_filter.process_line
+        lines = read_lines(sys.stdin.buffer, self._output_filter.binary,
+                           sys.stdin.encoding, sys.stdin.errors)
+        if self._stats is not None:
+            lines = self._stats.iter_timed(lines)
+        for line in lines:
+            process_line(line)
+        self._output_filter.finish()
+
+    def run_commands(self, log_encoding='utf-8'):
+        """Run the commands concurrently with
+        :py:func:`unlog.command.run_commands`, the output of each command
+        being filtered by its own clone of the filter. Only the output of the
+        commands after the first one is buffered. Unlog exits with the exit
+        code of the first command that failed.
+        """
+        try:
+            from command import Command, run_commands
+        except ImportError:
+            from unlog.command import Command, run_commands
+        commands = []
+        for command in self._args.commands:
+            output_filter = self._output_filter.clone()
+            commands.append(Command(command, output_filter, log_encoding,
+                                    buffer_output=bool(commands)))
+            self._setup_filter(output_filter, commands[-1].name)
+        self._exit_code = run_commands(commands)
 
     def _filter_from_config(self):
         """Filter the files according to the patterns defined in the
         configuration file.
         """
+        try:
+            from config import Config
+        except ImportError:
+            from unlog.config import Config
         self._config = Config(self._args)
         if self._args.files:
             self.process_files_from_config()
+        elif self._args.commands:
+            self._output_filter = self._get_single_config_filter()
+            self.run_commands(self._get_config_log_encoding())
         else:
-            self._output_filter = self._config.get_filter()
+            named_filters = self._config.get_filters()
+            if len(named_filters) > 1:
+                self._fan_out(named_filters, sys.stdin.buffer)
+                return
+            self._output_filter = named_filters[0][1]
             self.process_stdin()
 
+    def _get_single_config_filter(self, file_name=''):
+        """Returns the filter of the config section of file_name or None. Exit
+        with error code 2 if several sections apply: only files and stdin can
+        be processed by several filters, and only without a state file.
+        """
+        named_filters = self._config.get_filters(file_name)
+        self._check_single_section(named_filters)
+        return named_filters[0][1] if named_filters else None
+
+    def _check_single_section(self, named_filters):
+        """Exit with error code 2 if several sections apply."""
+        if len(named_filters) > 1:
+            sys.stderr.write('Several sections cannot be used when following '
+                             'files, running commands or with --state.\n')
+            sys.exit(2)
+
+    def _fan_out(self, named_filters, file, title=None, scan=False):
+        """Process the binary file with the filters of several sections with
+        a :py:class:`unlog.fanout.FanOut`, reading it once. It is scanned if
+        *scan* is True, which must only be the case for a file opened directly
+        from the disk.
+        """
+        try:
+            from fanout import FanOut
+        except ImportError:
+            from unlog.fanout import FanOut
+        for _, output_filter in named_filters:
+            self._setup_filter(output_filter, title)
+        FanOut(named_filters, self._get_config_log_encoding(),
+               scan).process_file(file)
+
     def process_files_from_config(self):
         """Loop over each file given on the command line and process them
         according to the actions defined in the associated config file. The file
         is then passed to :py:meth:`process_file_filter_from_config`.
         """
+        if self._args.follow:
+            self._follow_files_from_config()
+            return
+        elif self._must_process_in_parallel(self._args.files):
+            self._process_files_in_parallel(self._args.files)
+            return
+
         for file_name in self._args.files:
             file_name = self._correct_path_input_file(file_name)
             self.process_file_filter_from_config(file_name)
 
+    def _follow_files_from_config(self):
+        """Follow each file given on the command line that has a section in the
+        config file.
+        """
+        followed_files = []
+        for file_name in self._args.files:
+            file_name = self._correct_path_input_file(file_name)
+            output_filter = self._get_single_config_filter(file_name)
+            if output_filter:
+                followed_files.append((file_name, output_filter,
+                                       self._get_config_log_encoding()))
+        self._follow_files(followed_files)
+
+    def _follow_files(self, followed_files):
+        """Read the new lines of the followed files until interrupted.
+
+        *followed_files* is a list of tuples containing the name of a file, the
+        filter to use and the encoding of the file.
+        """
+        try:
+            from follow import FollowedFile, Follower
+        except ImportError:
+            from unlog.follow import FollowedFile, Follower
+        for file_name, output_filter, _ in followed_files:
+            self._setup_filter(output_filter, file_name)
+        Follower([FollowedFile(*followed_file) for followed_file in followed_files],
+                 interval=self._args.follow_interval,
+                 idle_timeout=self._args.idle_timeout).follow()
+
     def _correct_path_input_file(self, file_name):
         """Expand the ~ variable and transform a relative path into an absolute
         one.
@@ -118,11 +472,69 @@ class Unlog:
 
     def process_file_filter_from_config(self, file_name):
         """Process the file_name with the filters defined in config with
-        :py:meth:`process_file`.
+        :py:meth:`process_file`. If several sections apply to the file, it is
+        read once and processed by the filter of each section.
         """
-        self._output_filter = self._config.get_filter(file_name)
-        if self._output_filter:
-            if 'encoding' in self._config:
-                self.process_file(file_name, log_encoding=self._config['encoding'])
+        named_filters = self._config.get_filters(file_name)
+        if self._state is not None:
+            # The checkpoints are made for a single filter.
+            self._check_single_section(named_filters)
+        if len(named_filters) > 1:
+            self._fan_out_file(file_name, named_filters)
+        elif named_filters:
+            self._output_filter = named_filters[0][1]
+            self.process_file(file_name,
+                              log_encoding=self._get_config_log_encoding())
+
+    def _fan_out_file(self, file_name, named_filters):
+        """Process file_name with the filters of several sections, reading it
+        once. Compressed files are decompressed as they are read. If the file
+        is corrupted, what could be read is processed and the error is written
+        on stderr.
+        """
+        try:
+            compression = get_compression(file_name)
+            if compression:
+                errors = get_decompression_errors(compression)
+                file = open_decompressed(file_name, compression, None)
             else:
-                self.process_file(file_name)
+                errors = IOError
+                file = open(file_name, 'rb', buffering=self.BINARY_BUFFER_SIZE)
+        except IOError as e:
+            sys.stderr.write(str(e))
+            sys.stderr.write("\n")
+            return
+        try:
+            with file:
+                self._fan_out(named_filters, file, file_name,
+                              self._args.scan and not compression)
+        except errors as e:
+            sys.stderr.write('{}: {}\n'.format(file_name, e))
+
+    def _get_config_log_encoding(self):
+        """Returns the encoding of the files processed with the config file."""
+        if 'encoding' in self._config:
+            return self._config['encoding']
+        return 'utf-8'
+
+
+def _process_file_job(job):
+    """Process a single file in a worker of the pool used by
+    :py:meth:`Unlog._process_files_in_parallel`.
+
+    **RETURN** - a tuple containing what was written on stdout and the exit
+    code of Unlog.
+    """
+    args, file_name = job
+    args = copy.copy(args)
+    args.files = [file_name]
+    args.jobs = 1
+    # The queue was flushed once by the parent process.
+    args.flush_mail_queue = False
+    exit_code = 0
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        try:
+            Unlog(args)
+        except SystemExit as e:
+            exit_code = e.code
+    return output.getvalue(), exit_code